@@ -1,179 +1,366 @@
-import argparse
-import re
-import sys
-from enum import Enum
-import os
-
-import requests
-from lxml import etree, html
-from lxml.builder import E
-from lxml.html import fromstring
+import time
 
+# taken before anything else is imported, for --startup-profile
+STARTUP = {"start": time.perf_counter()}
 
+import bisect
 import sys
-
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap
+import threading
+from collections import OrderedDict, namedtuple
+
+import RunMetrics
+from HttpCache import HttpCache
+from ZwoLibrary import WorkoutLibrary
+from ZwoOutput import ArchiveWriter, DirectoryWriter
+
+from PyQt5.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QObject,
+    QPointF,
+    QRunnable,
+    QSize,
+    Qt,
+    QThreadPool,
+    QTimer,
+    pyqtSignal,
+)
+from PyQt5.QtGui import QColor, QPainter, QPixmap, QPolygonF
 from PyQt5 import QtGui
 from PyQt5.QtWidgets import (
     QApplication,
     QCheckBox,
-    QComboBox,
-    QDateEdit,
-    QDateTimeEdit,
-    QDial,
-    QDoubleSpinBox,
-    QFontComboBox,
+    QHBoxLayout,
     QLabel,
-    QLCDNumber,
     QLineEdit,
+    QListView,
+    QListWidget,
     QMainWindow,
     QProgressBar,
     QPushButton,
-    QRadioButton,
-    QSlider,
-    QSpinBox,
-    QTimeEdit,
     QVBoxLayout,
     QWidget,
     QFileDialog,
     QFormLayout,
-    QScrollArea,
-)
-
-
-
-class StepPosition(Enum):
-    FIRST = 0
-    MIDDLE = 1
-    LAST = 2
-
-def calc_duration(hrs,mins, secs):
-    d = 0
-    if secs:
-        d += int(secs)
-    if mins:
-        d += int(mins) * 60
-    if hrs:
-        d += int(hrs) * 60 * 60
-    return d
-
-def ramp(match, pos):
-    label = {
-        StepPosition.FIRST: "Warmup",
-        StepPosition.LAST: "Cooldown"
-    }.get(pos, "Ramp")
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    cadence = match.get("cadence")
-    low_power = match["low"] / 100.0
-    high_power = match["high"] / 100.0
-    node = etree.Element(label)
-    node.set("Duration", str(duration))
-    node.set("PowerLow", str(low_power))
-    node.set("PowerHigh", str(high_power))
-    node.set("pace", str(0))
-    if cadence:
-        node.set("Cadence", str(cadence))
-    return node
-
-def steady(match, pos):
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    cadence = match.get("cadence")
-    power = match["power"] / 100.0
-    node = E.SteadyState(Duration=str(duration), Power=str(power), pace=str(0))
-    if cadence:
-        node.set("Cadence", str(cadence))
-    return node
-
-def intervals(match, pos):
-    on_duration = calc_duration(match["on_hrs"], match["on_mins"], match["on_secs"])
-    off_duration = calc_duration(match["on_hrs"], match["off_mins"], match["off_secs"])
-    reps = match["reps"]
-    on_power = match["on_power"] / 100.0
-    off_power = match["off_power"] / 100.0
-    on_cadence = match.get("on_cadence")
-    off_cadence = match.get("off_cadence")
-    node = E.IntervalsT(
-        Repeat=str(reps),
-        OnDuration=str(on_duration),
-        OffDuration=str(off_duration),
-        OnPower=str(on_power),
-        OffPower=str(off_power),
-        pace=str(0),
-    )
-    if on_cadence and off_cadence:
-        node.set("Cadence", str(on_cadence))
-        node.set("CadenceResting", str(off_cadence))
-    return node
-
-def free_ride(match, pos):
-    # TODO: can have cadence?
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    return E.FreeRide(Duration=str(duration), FlatRoad=str(0))
-
-RAMP_RE = re.compile(
-    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
-    r'(?:@ (?P<cadence>\d+)rpm, )?from (?P<low>\d+) to (?P<high>\d+)% FTP'
-)
-
-STEADY_RE = re.compile(
-    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
-    r'@ (?:(?P<cadence>\d+)rpm, )?(?P<power>\d+)% FTP'
-)
-
-INTERVALS_RE = re.compile(
-    r'(?P<reps>\d+)x (?:(?P<on_hrs>\d+)hr )?(?:(?P<on_mins>\d+)min )?(?:(?P<on_secs>\d+)sec )?'
-    r'@ (?:(?P<on_cadence>\d+)rpm, )?(?P<on_power>\d+)% FTP,'
-    r'(?:(?P<off_hrs>\d+)hr )?(?:(?P<off_mins>\d+)min )?(?:(?P<off_secs>\d+)sec )?'
-    r'@ (?:(?P<off_cadence>\d+)rpm, )?(?P<off_power>\d+)% FTP'
-)
-
-FREE_RIDE_RE = re.compile(
-    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?free ride'
 )
 
-#OVER_UNDER_RE = re.compile(
-#    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?free ride'
-#)
-
-BLOCKS = [
-    (RAMP_RE, ramp),
-    (STEADY_RE, steady),
-    (INTERVALS_RE, intervals),
-    (FREE_RIDE_RE, free_ride),
-]
-def parse_args():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("target", help="file or URL")
-    return ap.parse_args()
-
-def parse_node(step, pos):
-    text = step.text_content()
-    for regex, func in BLOCKS:
-        match = regex.match(text)
-        if match:
-            match_int = {
-                k: int(v) if v else None for k, v in match.groupdict().items()
-            }
-            return func(match_int, pos)
-    raise RuntimeError(f"Couldn't parse {text}")
-
-def fetch_url(url):
-    return requests.get(url).content
-
-def read_file(path):
-    try:
-        return open(path).read()
-    except FileNotFoundError as e:
+STARTUP["imports"] = time.perf_counter()
+PROFILE_STARTUP = "--startup-profile" in sys.argv
+# "--server URL" lets a conversion service (GetZwo.py --serve) convert the plans
+SERVER = sys.argv[sys.argv.index("--server") + 1] if "--server" in sys.argv[:-1] else None
+
+# a converted workout in the preview list, with its steps for the thumbnail
+Preview = namedtuple("Preview", ["document", "steps"])
+
+THUMBNAIL_SIZE = QSize(120, 32)
+# thumbnails kept; only the rows on screen need one, the rest are drawn again
+THUMBNAIL_CACHE = 512
+# Zwift's zone colours, Z1 to Z6, and grey for free rides
+ZONE_COLORS = ["#7f7f7f", "#338cff", "#59bf59", "#ffcc3f", "#ff6639", "#ff330c"]
+FREE_RIDE_COLOR = "#c8c8c8"
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def load_engine():
+    """Import the conversion engine (GetZwo, requests, lxml) on first use.
+
+    Keeping it out of the module imports makes the window appear sooner,
+    the first download pays the import instead.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            start = time.perf_counter()
+            import GetZwo
+            _engine = GetZwo
+            STARTUP["engine"] = time.perf_counter() - start
+            if PROFILE_STARTUP:
+                print(f"startup profile: engine import {STARTUP['engine'] * 1e3:8.1f} ms",
+                      file=sys.stderr)
+    return _engine
+
+
+def report_startup():
+    STARTUP["ready"] = time.perf_counter()
+    steps = [
+        ("imports", "start", "imports"),
+        ("window built", "imports", "window"),
+        ("first event loop pass", "window", "ready"),
+        ("time to window ready", "start", "ready"),
+    ]
+    print("startup profile:", file=sys.stderr)
+    for name, begin, end in steps:
+        print(f"    {name:24s} {(STARTUP[end] - STARTUP[begin]) * 1e3:8.1f} ms", file=sys.stderr)
+
+
+class WorkerSignals(QObject):
+    # workouts done, workouts found, title of the last workout
+    progress = pyqtSignal(int, int, str)
+    # workouts written, cancelled, RunMetrics summary
+    finished = pyqtSignal(int, bool, str)
+    # the Previews of the page, cancelled, RunMetrics summary
+    previewed = pyqtSignal(object, bool, str)
+    error = pyqtSignal(str)
+
+
+class DownloadWorker(QRunnable):
+    """Fetches a plan page and writes its workouts off the GUI thread.
+
+    With preview the workouts are only converted and sent back as Previews,
+    given previews it writes those instead of fetching the page again. With
+    a server the conversion service at that URL converts the page. With
+    dedup identical workouts are stored once, as hard links to the same file.
+    """
+
+    def __init__(self, url, datapath, cache, library, archive=False,
+                 preview=False, previews=None, server=None, dedup=False):
+        super().__init__()
+        self.url = url
+        self.datapath = datapath
+        self.cache = cache
+        self.library = library
+        self.archive = archive
+        self.preview = preview
+        self.previews = previews
+        self.server = server
+        self.dedup = dedup
+        self.signals = WorkerSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def convert(self, engine, workouts):
+        """Yield a Preview for every workout that converts."""
+        for ifile, workout in enumerate(workouts):
+            if self._cancel.is_set():
+                return
+            try:
+                steps = engine.parse_steps(node.text_content() for node in workout.steps)
+                with RunMetrics.timer("stats"):
+                    stats = engine.workout_stats(steps)
+                strfilename = 'training ' + str(ifile) + ' ' + workout.title + '.zwo'
+                # check for slash in strfilename and remove if needed
+                strfilename = strfilename.replace('/', '_')
+                with RunMetrics.timer("serialise"):
+                    document = engine.Document(
+                        strfilename,
+                        engine.workout_text(workout.title, steps, workout.description, stats),
+                        workout.title,
+                        workout.description,
+                        stats,
+                        engine.steps_key(steps),
+                    )
+            except Exception as e:
+                RunMetrics.count("workouts_failed")
+                print('error in file ' + str(ifile) + ': ' + str(e))
+                continue
+            yield Preview(document, steps)
+
+    def update_library(self, documents):
+        if documents and not self._cancel.is_set():
+            try:
+                with RunMetrics.timer("library"):
+                    self.library.replace_plan(self.url, documents)
+            except Exception as e:
+                print('library not updated: ' + str(e))
+
+    def run(self):
+        # the numbers of this download only, shown when it is done
+        metrics = RunMetrics.enable()
+        try:
+            engine = load_engine()
+            if self.previews is not None:
+                previews = self.previews
+                total = len(previews)
+            elif self.server is not None and engine.is_url(self.url):
+                data = engine.fetch_plan(self.server, self.url, engine.get_client())
+                _, documents, steps = engine.decode_plan(data)
+                # the App's own file names
+                previews = [
+                    Preview(document._replace(filename=(
+                        'training ' + str(ifile) + ' ' + document.title + '.zwo').replace('/', '_')), s)
+                    for ifile, (document, s) in enumerate(zip(documents, steps))
+                ]
+                total = len(previews)
+            else:
+                if engine.is_url(self.url):
+                    content = engine.fetch_url(self.url, cache=self.cache)
+                else:
+                    # a page saved from the browser
+                    content = engine.read_file(self.url)
+                workouts = engine.page_workouts(content)
+                previews = self.convert(engine, workouts)
+                total = len(workouts)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+            return
+        self.signals.progress.emit(0, total, "")
+        if self.preview:
+            converted = []
+            for preview in previews:
+                converted.append(preview)
+                self.signals.progress.emit(len(converted), total, preview.document.title)
+            self.update_library([preview.document for preview in converted])
+            self.signals.previewed.emit(converted, self._cancel.is_set(), RunMetrics.summary(metrics))
+            return
+        try:
+            if self.archive:
+                plan = self.url.rstrip('/').rsplit('/', 1)[-1] or 'workouts'
+                writer = ArchiveWriter(self.datapath + '/' + plan + '.zip', self.dedup)
+            else:
+                # with dedup, also links to plans downloaded before into the folder
+                writer = DirectoryWriter(self.datapath, self.dedup)
+        except OSError as e:
+            self.signals.error.emit(str(e))
+            return
+        written = 0
+        documents = []
+        for preview in previews:
+            if self._cancel.is_set():
+                break
+            document = preview.document
+            try:
+                # write the file
+                with RunMetrics.timer("write"):
+                    path = writer.write(document.filename, document.text, document.key)
+                documents.append(document)
+                written += 1
+                print('file ', path, ' done')
+            except Exception as e:
+                RunMetrics.count("workouts_failed")
+                print('error in file ' + document.filename + ': ' + str(e))
+            self.signals.progress.emit(written, total, document.title)
+        writer.close()
+        # a selection from the preview is already in the library as a whole
+        if self.previews is None:
+            self.update_library(documents)
+        summary = RunMetrics.summary(metrics)
+        if self.dedup:
+            summary += ", " + str(writer.dedup.stats['linked']) + " duplicates not stored again"
+        self.signals.finished.emit(written, self._cancel.is_set(), summary)
+
+
+def render_thumbnail(steps, size=THUMBNAIL_SIZE):
+    """Draw the power profile of a workout, every block in its zone colour."""
+    # loaded with the engine, before there is anything to preview
+    import numpy as np
+    from ZwoStats import FREE_RIDE_POWER, ZONE_BOUNDS, segments
+
+    pixmap = QPixmap(size)
+    pixmap.fill(Qt.transparent)
+    durations, starts, ends = segments(steps)
+    total = int(durations.sum())
+    if not total:
+        return pixmap
+    free = np.isnan(starts)
+    starts[free] = ends[free] = FREE_RIDE_POWER
+    top = max(1.5, float(max(starts.max(), ends.max())))
+    x_scale = size.width() / total
+    y_scale = size.height() / top
+    bounds = list(ZONE_BOUNDS)
+    painter = QPainter(pixmap)
+    painter.setPen(Qt.NoPen)
+    t = 0
+    for duration, start, end, free_ride in zip(durations.tolist(), starts.tolist(),
+                                               ends.tolist(), free.tolist()):
+        if duration <= 0:
+            continue
+        if free_ride:
+            color = FREE_RIDE_COLOR
+        else:
+            color = ZONE_COLORS[bisect.bisect_left(bounds, (start + end) / 2)]
+        painter.setBrush(QColor(color))
+        x0 = t * x_scale
+        x1 = (t + duration) * x_scale
+        bottom = size.height()
+        painter.drawPolygon(QPolygonF([
+            QPointF(x0, bottom),
+            QPointF(x0, bottom - start * y_scale),
+            QPointF(x1, bottom - end * y_scale),
+            QPointF(x1, bottom),
+        ]))
+        t += duration
+    painter.end()
+    return pixmap
+
+
+class WorkoutListModel(QAbstractListModel):
+    """The previewed workouts of a page, each with a checkbox and a thumbnail.
+
+    The view only asks for the rows it shows, so thumbnails are drawn as they
+    scroll into sight and kept in a bounded LRU cache: a plan with thousands
+    of workouts costs no more than the rows on screen.
+    """
+
+    def __init__(self, parent=None, cache_size=THUMBNAIL_CACHE):
+        super().__init__(parent)
+        self.previews = []
+        self.checked = []
+        self.cache_size = cache_size
+        self._thumbnails = OrderedDict()
+
+    def set_previews(self, previews):
+        self.beginResetModel()
+        self.previews = list(previews)
+        self.checked = [True] * len(self.previews)
+        self._thumbnails.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.previews)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        document = self.previews[row].document
+        if role == Qt.DisplayRole:
+            stats = document.stats
+            return (document.title + '  (' + str(round(stats.duration / 60)) + ' min, IF '
+                    + format(stats.intensity, '.2f') + ', TSS ' + str(round(stats.tss)) + ')')
+        if role == Qt.DecorationRole:
+            return self.thumbnail(row)
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[row] else Qt.Unchecked
+        if role == Qt.ToolTipRole:
+            return document.description
         return None
 
-def text(tree, selector):
-    return tree.xpath(f"{selector}/text()")[0]
-
-def element_text(element, text):
-    node = etree.Element(element)
-    node.text = text
-    return node
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+        self.checked[index.row()] = value == Qt.Checked
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def thumbnail(self, row):
+        pixmap = self._thumbnails.get(row)
+        if pixmap is not None:
+            self._thumbnails.move_to_end(row)
+            return pixmap
+        pixmap = render_thumbnail(self.previews[row].steps)
+        self._thumbnails[row] = pixmap
+        if len(self._thumbnails) > self.cache_size:
+            self._thumbnails.popitem(last=False)
+        return pixmap
+
+    def set_all_checked(self, checked):
+        if not self.previews:
+            return
+        self.checked = [checked] * len(self.previews)
+        self.dataChanged.emit(self.index(0), self.index(len(self.previews) - 1),
+                              [Qt.CheckStateRole])
+
+    def checked_previews(self):
+        return [preview for preview, checked in zip(self.previews, self.checked) if checked]
 
 
 # Subclass QMainWindow to customize your application's main window
@@ -184,6 +371,12 @@ class MainWindow(QMainWindow):
         self.setWindowIcon(QtGui.QIcon('Logo_TMD1.png'))
         self.dirsel = "C:\\Temp\\ZwoFiles\\"
         self.hmtlsel = 'https://whatsonzwift.com/workouts/pebble-pounder'
+        # opened by the first download or search, not to slow down the start
+        self.cache = None
+        self.library = None
+        self.worker = None
+        self.preview_url = None
+        self.threadpool = QThreadPool.globalInstance()
         self.acceptDrops()
 
         self.setWindowTitle("Widgets App")
@@ -203,10 +396,62 @@ class MainWindow(QMainWindow):
         self.download_widget.clicked.connect(self.download)
         layout.addWidget(self.download_widget)
 
+        self.preview_widget = QPushButton("Preview")
+        self.preview_widget.clicked.connect(self.preview)
+        layout.addWidget(self.preview_widget)
+
         self.setdir_widget = QPushButton("select folder")
         self.setdir_widget.clicked.connect(self.getDirectory)
         layout.addWidget(self.setdir_widget)
 
+        self.archive_widget = QCheckBox("save the plan as one .zip file")
+        layout.addWidget(self.archive_widget)
+
+        self.dedup_widget = QCheckBox("store identical workouts once")
+        layout.addWidget(self.dedup_widget)
+
+        self.cancel_widget = QPushButton("Cancel")
+        self.cancel_widget.setEnabled(False)
+        self.cancel_widget.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_widget)
+
+        self.progress_widget = QProgressBar()
+        self.progress_widget.setValue(0)
+        layout.addWidget(self.progress_widget)
+
+        # only the visible rows are drawn, see WorkoutListModel
+        self.preview_model = WorkoutListModel(self)
+        self.preview_list = QListView()
+        self.preview_list.setModel(self.preview_model)
+        self.preview_list.setUniformItemSizes(True)
+        self.preview_list.setIconSize(THUMBNAIL_SIZE)
+        self.preview_list.setMinimumHeight(160)
+        layout.addWidget(self.preview_list)
+
+        previewLayout = QHBoxLayout()
+        self.check_all_widget = QCheckBox("all")
+        self.check_all_widget.setChecked(True)
+        self.check_all_widget.toggled.connect(self.preview_model.set_all_checked)
+        previewLayout.addWidget(self.check_all_widget)
+        self.save_checked_widget = QPushButton("save checked workouts")
+        self.save_checked_widget.setEnabled(False)
+        self.save_checked_widget.clicked.connect(self.save_checked)
+        previewLayout.addWidget(self.save_checked_widget)
+        layout.addLayout(previewLayout)
+
+        self.search_widget = QLineEdit()
+        self.search_widget.setPlaceholderText("search the downloaded workouts, e.g. threshold")
+        self.search_widget.textChanged.connect(self.search)
+        layout.addWidget(self.search_widget)
+
+        self.results_widget = QListWidget()
+        self.results_widget.setMaximumHeight(120)
+        layout.addWidget(self.results_widget)
+
+        self.export_widget = QPushButton("export search results to the folder")
+        self.export_widget.clicked.connect(self.export_results)
+        layout.addWidget(self.export_widget)
+
         self.labelDownload = QLabel("App info: ")
         self.labelDownload.setWordWrap(True)
         self.labelDownload.setAlignment(Qt.AlignHCenter)
@@ -226,26 +471,6 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.labelx3)
         self.labelx3.setOpenExternalLinks(True)
 
-        # # add scroll area
-        # self.vbox = QVBoxLayout()
-        # self.scroll_layout = QScrollArea()
-        # #self.scroll_widget = QWidget()
-        # for i in range(1, 10):
-        #     object = QLabel("TextLabel")
-        #     self.vbox.addWidget(object)
-        # # Scroll Area Properties
-        # self.scroll_layout.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        # self.scroll_layout.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        # self.scroll_layout.setWidgetResizable(True)
-        #
-        # #self.scroll_layout.setWidget(self.widget)
-        # layout.addLayout(self.vbox)
-
-        #self.setCentralWidget(self.scroll)
-
-        #self.setGeometry(600, 100, 1000, 900)
-        #self.setWindowTitle('Scroll Area Demonstration')
-
         # creating label
         self.labelpict = QLabel(self)
         layout.addWidget(self.labelpict)
@@ -292,85 +517,152 @@ class MainWindow(QMainWindow):
     def getzwofilesC(self):
 
         self.labelDownload.setText("App info: download .zwo files started")
-        content = fetch_url(self.hmtlsel)
-        # content = fetch_url('https://whatsonzwift.com/workouts/pebble-pounder')
-        tree = html.fromstring(content)
-        title = text(tree, '//h4[contains(@class, "flaticon-bike")]').strip()
-        desc = text(tree, '//div[contains(@class, "workoutdescription")]/p')
-        steps = tree.xpath('//div[contains(@class, "workoutlist")]/div')
-
-        WorkoutNames = tree.xpath('//h4[@class="glyph-icon flaticon-bike"]')
-        descNames = tree.xpath('//div[contains(@class, "workoutdescription")]/div')
-
-        linesource = []
-        for il, node in enumerate(steps):
-            linesource.append(node.sourceline)
-
-        # get difference between lines
-        ctfiles = 1
-        inewfile = []
-        for i in range(0, len(linesource) - 1):
-            diffLines = linesource[i + 1] - linesource[i]
-            if diffLines > 10:
-                ctfiles = ctfiles + 1
-                inewfile.append(i + 1)
-        inewfile.append(len(linesource))
-        self.labelDownload.setText("App info: " + str(ctfiles) + "found")
-
-        for ifile in range(0, ctfiles - 1):
-            try:
-                root = etree.Element("workout_file")
-                root.append(element_text("author", "M. Afschrift"))
-                titlesel = WorkoutNames[ifile + 1]
-                title = titlesel.text_content()
-                root.append(element_text("name", title))
-
-                # find the descrtion after the title
-                root.append(element_text("description", "ToDo"))
-                root.append(element_text("sportType", "bike"))
-                root.append(etree.Element("tags"))
-                workout = etree.Element("workout")
-
-                # selected indices in this file
-                stepindices = range(inewfile[ifile], inewfile[ifile + 1])
-
-                for i in range(0, len(stepindices)):
-                    node = steps[stepindices[i]]
-                    if i == 0:
-                        pos = StepPosition.FIRST
-                    elif i == len(steps) - 1:
-                        pos = StepPosition.LAST
-                    else:
-                        pos = StepPosition.MIDDLE
-                    workout.append(parse_node(node, pos))
-                root.append(workout)
-                # write the file
-                etree.indent(root, space="    ")
-                strfilename = 'training ' + str(ifile) + ' ' + title + '.zwo'
-                # check for slash in strfilename and remove if needed
-                strfilename = strfilename.replace('/', '_')
-                datapath = self.dirsel
-                if not (os.path.isdir(datapath)):
-                    os.makedirs(datapath)
-                    #print('open file ', datapath)
-                with open(datapath + '/' + strfilename, 'w') as f:
-                    f.write(
-                        etree.tostring(root, pretty_print=True, encoding="unicode"),
-                    )
-                #print('open file ', datapath)
-                print('file ', datapath + '/' + strfilename , ' done')
-            except:
-                print('errr in file' + str(ifile))
-        self.labelDownload.setText("App info: " + str(ctfiles) + " zwo files downloaded")
+        self.start_worker(DownloadWorker(
+            self.hmtlsel, self.dirsel, self.open_cache(), self.open_library(),
+            self.archive_widget.isChecked(), server=SERVER,
+            dedup=self.dedup_widget.isChecked()
+        ))
+
+    def open_cache(self):
+        if self.cache is None:
+            self.cache = HttpCache()
+        return self.cache
+
+    def open_library(self):
+        if self.library is None:
+            self.library = WorkoutLibrary()
+        return self.library
+
+    def start_worker(self, worker):
+        self.worker = worker
+        self.worker.signals.progress.connect(self.download_progress)
+        self.worker.signals.finished.connect(self.download_finished)
+        self.worker.signals.previewed.connect(self.preview_finished)
+        self.worker.signals.error.connect(self.download_error)
+        self.download_widget.setEnabled(False)
+        self.preview_widget.setEnabled(False)
+        self.save_checked_widget.setEnabled(False)
+        self.cancel_widget.setEnabled(True)
+        self.progress_widget.setRange(0, 0)
+        self.threadpool.start(self.worker)
+
+    def preview(self):
+        self.labelDownload.setText("App info: preview started")
+        self.preview_url = self.hmtlsel
+        self.start_worker(DownloadWorker(
+            self.hmtlsel, self.dirsel, self.open_cache(), self.open_library(), preview=True,
+            server=SERVER
+        ))
+
+    def preview_finished(self, previews, cancelled, metrics):
+        self.download_done()
+        self.search(self.search_widget.text())
+        self.preview_model.set_previews(previews)
+        self.check_all_widget.setChecked(True)
+        self.save_checked_widget.setEnabled(bool(previews))
+        if cancelled:
+            self.labelDownload.setText("App info: preview cancelled after " + str(len(previews)) + " workouts")
+        else:
+            self.labelDownload.setText(
+                "App info: " + str(len(previews)) + " workouts converted in " + metrics
+                + ", check the ones to save"
+            )
+
+    def save_checked(self):
+        previews = self.preview_model.checked_previews()
+        if not previews:
+            self.labelDownload.setText("App info: no workouts checked")
+            return
+        self.labelDownload.setText("App info: saving " + str(len(previews)) + " zwo files")
+        self.start_worker(DownloadWorker(
+            self.preview_url, self.dirsel, self.open_cache(), self.open_library(),
+            self.archive_widget.isChecked(), previews=previews,
+            dedup=self.dedup_widget.isChecked()
+        ))
+
+    def download_progress(self, done, total, title):
+        self.progress_widget.setRange(0, max(total, 1))
+        self.progress_widget.setValue(done)
+        if done == 0:
+            self.labelDownload.setText("App info: " + str(total) + " found")
+        else:
+            self.labelDownload.setText(
+                "App info: " + str(done) + "/" + str(total) + " " + title
+            )
+
+    def download_finished(self, written, cancelled, metrics):
+        self.download_done()
+        self.search(self.search_widget.text())
+        if cancelled:
+            self.labelDownload.setText("App info: cancelled after " + str(written) + " zwo files")
+        else:
+            self.labelDownload.setText(
+                "App info: " + str(written) + " zwo files downloaded in " + metrics
+            )
+        print('download finished')
+
+    def download_error(self, message):
+        self.download_done()
+        self.progress_widget.setRange(0, 1)
+        self.progress_widget.setValue(0)
+        self.labelDownload.setText("App info: download failed: " + message)
+
+    def download_done(self):
+        self.worker = None
+        self.download_widget.setEnabled(True)
+        self.preview_widget.setEnabled(True)
+        self.save_checked_widget.setEnabled(bool(self.preview_model.previews))
+        self.cancel_widget.setEnabled(False)
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.labelDownload.setText("App info: cancelling...")
+
+    def search(self, text):
+        # answered from the library index, fast enough to run on every key
+        self.results_widget.clear()
+        if not text.strip():
+            return
+        rows = self.open_library().query(text=text, limit=200)
+        for row in rows:
+            self.results_widget.addItem(
+                row['title'] + '  (' + str(round(row['duration'] / 60)) + ' min, IF '
+                + format(row['intensity'], '.2f') + ', ' + (row['zone'] or 'free ride')
+                + ')  ' + row['plan']
+            )
+        self.labelDownload.setText("App info: " + str(len(rows)) + " workouts found in the library")
+
+    def export_results(self):
+        text = self.search_widget.text()
+        if not text.strip():
+            self.labelDownload.setText("App info: type a search first")
+            return
+        try:
+            writer = DirectoryWriter(self.dirsel)
+            rows = self.open_library().query(text=text, documents=True)
+            for row in rows:
+                writer.write(row['filename'], row['document'])
+        except OSError as e:
+            self.labelDownload.setText("App info: export failed: " + str(e))
+            return
+        self.labelDownload.setText("App info: " + str(len(rows)) + " zwo files exported")
+
     def download(self):
 
         # message that download started
         self.getzwofilesC()
-        print('download finished')
 
 if __name__ == "__main__":
     myapp = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+    STARTUP["window"] = time.perf_counter()
+    if PROFILE_STARTUP:
+        # runs once the event loop has processed the first show/paint events
+        QTimer.singleShot(0, report_startup)
     myapp.exec()
+    # the cache saves its index in batches, keep the last pages too
+    if window.cache is not None:
+        window.cache.close()
 
@@ -1,38 +1,95 @@
 import argparse
+import functools
+import hashlib
+import itertools
+import multiprocessing
 import re
 import sys
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
+from urllib.parse import unquote, urlsplit
 import os
 
 import requests
+from requests.adapters import HTTPAdapter
 from lxml import etree, html
 from lxml.builder import E
-from lxml.html import fromstring
+
+from HttpCache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, CacheMiss, HttpCache
+from HttpClient import DEFAULT_RATE, DEFAULT_RETRIES, DEFAULT_TIMEOUT, HttpClient
+from ZwoModel import (
+    FREE_RIDE, INTERVALS, RAMP, STEADY, ZONE_NAMES, Document, Step, Workout, dominant_zone,
+    fold_repeats, steps_key,
+)
+from ZwoOutput import (
+    ARCHIVE_SUFFIXES,
+    ArchiveWriter,
+    DirectoryWriter,
+    SyncWriter,
+    content_hash,
+    open_writer,
+    write_links_report,
+)
+from ZwoCrawler import DEFAULT_CRAWL_STATE, CrawlFrontier
+from ZwoLibrary import DEFAULT_LIBRARY, WorkoutLibrary
+from ZwoSources import LocalPage, is_url, local_pages, page_chunks, read_page, target_name
+from ZwoStats import (
+    format_duration,
+    stats_summary,
+    stats_tags,
+    workout_stats,
+    workouts_stats,
+    write_stats_table,
+)
+from ZwoPipeline import Pipeline, default_parse_workers
+from ZwoReader import inventory, write_inventory
+from ZwoRender import RENDER_FORMATS, read_roster, render_fingerprint, render_plan
+from ZwoService import (
+    DEFAULT_ALLOWED_HOSTS,
+    DEFAULT_PORT,
+    DEFAULT_SERVICE_CACHE,
+    ConversionService,
+    PlanCache,
+    decode_plan,
+    fetch_plan,
+    parse_address,
+)
+import RunMetrics
+from ZwoXml import workout_text, write_workout
+
+DEFAULT_OUTDIR = "C:\\Temp\\ZwoFiles\\"
+# bump when the generated .zwo files change, so --sync rewrites everything
+CONVERTER_VERSION = 3
+# pages a crawl hands to the pipeline at a time
+CRAWL_BATCH = 256
+
+# What the parse stage hands back for a page: its Documents, the (filename,
+# text) of the --format renders and, in a crawl, the links on the page.
+Converted = namedtuple("Converted", ["page_hash", "documents", "files", "links"],
+                       defaults=[(), ()])
 
 class StepPosition(Enum):
     FIRST = 0
     MIDDLE = 1
     LAST = 2
 
-RAMP_RE = re.compile(
-    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
-    r'(?:@ (?P<cadence>\d+)rpm, )?from (?P<low>\d+) to (?P<high>\d+)% FTP'
-)
-
-STEADY_RE = re.compile(
+# One grammar for every step type, one alternative per kind of block:
+#   [reps x ]duration @ [cadence rpm, ]power% FTP[,duration @ [cadence rpm, ]power% FTP]
+#   duration [@ cadence rpm, ]from low to high% FTP
+#   [reps x ]duration free ride
+# Plain alternatives, no conditional groups, so a text that isn't a step
+# fails as fast as one that is matches.
+STEP_RE = re.compile(
+    r'(?:(?P<reps>\d+)x )?'
     r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
-    r'@ (?:(?P<cadence>\d+)rpm, )?(?P<power>\d+)% FTP'
-)
-
-INTERVALS_RE = re.compile(
-    r'(?P<reps>\d+)x (?:(?P<on_hrs>\d+)hr )?(?:(?P<on_mins>\d+)min )?(?:(?P<on_secs>\d+)sec )?'
-    r'@ (?:(?P<on_cadence>\d+)rpm, )?(?P<on_power>\d+)% FTP,'
-    r'(?:(?P<off_hrs>\d+)hr )?(?:(?P<off_mins>\d+)min )?(?:(?P<off_secs>\d+)sec )?'
-    r'@ (?:(?P<off_cadence>\d+)rpm, )?(?P<off_power>\d+)% FTP'
-)
-
-FREE_RIDE_RE = re.compile(
-    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?free ride'
+    r'(?:@ (?:(?P<cadence>\d+)rpm, )?(?P<power>\d+)% FTP'
+    r'(?:,(?:(?P<off_hrs>\d+)hr )?(?:(?P<off_mins>\d+)min )?(?:(?P<off_secs>\d+)sec )?'
+    r'@ (?:(?P<off_cadence>\d+)rpm, )?(?P<off_power>\d+)% FTP)?'
+    r'|(?:@ (?P<ramp_cadence>\d+)rpm, )?from (?P<low>\d+) to (?P<high>\d+)% FTP'
+    r'|(?P<free>free ride))'
 )
 
 def calc_duration(hrs,mins, secs):
@@ -45,168 +102,1113 @@ def calc_duration(hrs,mins, secs):
         d += int(hrs) * 60 * 60
     return d
 
-def ramp(match, pos):
+# XML serialisers, one per step kind
+
+def ramp(step, pos):
     label = {
         StepPosition.FIRST: "Warmup",
         StepPosition.LAST: "Cooldown"
     }.get(pos, "Ramp")
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    cadence = match.get("cadence")
-    low_power = match["low"] / 100.0
-    high_power = match["high"] / 100.0
     node = etree.Element(label)
-    node.set("Duration", str(duration))
-    node.set("PowerLow", str(low_power))
-    node.set("PowerHigh", str(high_power))
+    node.set("Duration", str(step.duration))
+    node.set("PowerLow", str(step.power_low))
+    node.set("PowerHigh", str(step.power_high))
     node.set("pace", str(0))
-    if cadence:
-        node.set("Cadence", str(cadence))
+    if step.cadence:
+        node.set("Cadence", str(step.cadence))
     return node
 
-def steady(match, pos):
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    cadence = match.get("cadence")
-    power = match["power"] / 100.0
-    node = E.SteadyState(Duration=str(duration), Power=str(power), pace=str(0))
-    if cadence:
-        node.set("Cadence", str(cadence))
+def steady(step, pos):
+    node = E.SteadyState(Duration=str(step.duration), Power=str(step.power_low), pace=str(0))
+    if step.cadence:
+        node.set("Cadence", str(step.cadence))
     return node
 
-def intervals(match, pos):
-    on_duration = calc_duration(match["on_hrs"], match["on_mins"], match["on_secs"])
-    off_duration = calc_duration(match["on_hrs"], match["off_mins"], match["off_secs"])
-    reps = match["reps"]
-    on_power = match["on_power"] / 100.0
-    off_power = match["off_power"] / 100.0
-    on_cadence = match.get("on_cadence")
-    off_cadence = match.get("off_cadence")
+def intervals(step, pos):
     node = E.IntervalsT(
-        Repeat=str(reps),
-        OnDuration=str(on_duration),
-        OffDuration=str(off_duration),
-        OnPower=str(on_power),
-        OffPower=str(off_power),
+        Repeat=str(step.reps),
+        OnDuration=str(step.duration),
+        OffDuration=str(step.off_duration),
+        OnPower=str(step.power_low),
+        OffPower=str(step.off_power),
         pace=str(0),
     )
-    if on_cadence and off_cadence:
-        node.set("Cadence", str(on_cadence))
-        node.set("CadenceResting", str(off_cadence))
+    if step.cadence and step.off_cadence:
+        node.set("Cadence", str(step.cadence))
+        node.set("CadenceResting", str(step.off_cadence))
     return node
 
-def free_ride(match, pos):
+def free_ride(step, pos):
     # TODO: can have cadence?
-    duration = calc_duration(match["hrs"], match["mins"], match["secs"])
-    return E.FreeRide(Duration=str(duration), FlatRoad=str(0))
+    return E.FreeRide(Duration=str(step.duration), FlatRoad=str(0))
 
-BLOCKS = [
-    (RAMP_RE, ramp),
-    (STEADY_RE, steady),
-    (INTERVALS_RE, intervals),
-    (FREE_RIDE_RE, free_ride),
-]
+STEP_ELEMENTS = {
+    RAMP: ramp,
+    STEADY: steady,
+    INTERVALS: intervals,
+    FREE_RIDE: free_ride,
+}
+
+def step_element(step, pos):
+    return STEP_ELEMENTS[step.kind](step, pos)
 
 def parse_args():
     ap = argparse.ArgumentParser()
-    ap.add_argument("target", help="file or URL")
-    return ap.parse_args()
-
-def parse_node(step, pos):
-    text = step.text_content()
-    for regex, func in BLOCKS:
-        match = regex.match(text)
-        if match:
-            match_int = {
-                k: int(v) if v else None for k, v in match.groupdict().items()
-            }
-            return func(match_int, pos)
-    raise RuntimeError(f"Couldn't parse {text}")
-
-def fetch_url(url):
-    return requests.get(url).content
+    ap.add_argument("targets", nargs="*", metavar="target",
+                    help="URL, or saved pages: an .html file, a directory, "
+                         "a .zip or a .warc/.warc.gz archive")
+    ap.add_argument("-i", "--input-file",
+                    help="text file with one target per line (# starts a comment)")
+    ap.add_argument("-j", "--workers", "--fetch-workers", type=int, default=8,
+                    help="number of pages downloaded concurrently (default: 8)")
+    ap.add_argument("--parse-workers", type=int,
+                    help="number of processes converting pages, 0 converts in "
+                         "the main process (default: one per core)")
+    ap.add_argument("--queue-size", type=int, default=16,
+                    help="pages that may wait between the download, convert and "
+                         "write stages (default: %(default)s)")
+    ap.add_argument("-o", "--outdir", default=DEFAULT_OUTDIR,
+                    help="folder for the .zwo files (default: %(default)s)")
+    ap.add_argument("--archive",
+                    help="write all workouts into this .zip/.tar/.tar.gz file "
+                         "instead of separate files")
+    ap.add_argument("--sync", action="store_true",
+                    help="only write workouts that changed since the last run and "
+                         "remove the ones that disappeared (keeps a manifest in --outdir)")
+    ap.add_argument("--dedup", action="store_true",
+                    help="store identical workouts once: hard links in --outdir, "
+                         "link members or a list of duplicates in an --archive")
+    ap.add_argument("--dedup-report", metavar="CSV",
+                    help="with --dedup, write which files are copies of which to this CSV file")
+    ap.add_argument("--stats", metavar="CSV",
+                    help="also write duration, NP, IF, TSS and time in zone of "
+                         "every workout to this CSV file")
+    ap.add_argument("--roster", metavar="CSV",
+                    help="riders (name and ftp columns) to write absolute-watt .erg files for, "
+                         "one folder per rider")
+    ap.add_argument("--format", action="append", choices=RENDER_FORMATS, dest="formats",
+                    help="also write this format next to the .zwo files, may be repeated "
+                         "(erg is always written with --roster)")
+    ap.add_argument("--crawl", action="store_true",
+                    help="follow the links of the target URLs to all plans below them, "
+                         "resuming the last crawl if one was interrupted")
+    ap.add_argument("--crawl-state", default=DEFAULT_CRAWL_STATE,
+                    help="file that remembers the pages of the crawl (default: %(default)s)")
+    ap.add_argument("--restart", action="store_true",
+                    help="forget the last crawl and start from the targets again")
+    ap.add_argument("--library", default=DEFAULT_LIBRARY,
+                    help="SQLite library every converted workout is added to "
+                         f"(default: {DEFAULT_LIBRARY})")
+    ap.add_argument("--no-library", action="store_true",
+                    help="don't add the converted workouts to the library")
+    ap.add_argument("--profile", action="store_true",
+                    help="print where the time went and what was processed at the end")
+    ap.add_argument("--metrics", metavar="FILE",
+                    help="write the run's metrics to FILE, in Prometheus text "
+                         "format if it ends in .prom, as JSON otherwise")
+    ap.add_argument("--stream", action="store_true",
+                    help="parse pages while they download and write every "
+                         "workout as soon as it is complete")
+    ap.add_argument("--server", metavar="URL",
+                    help="let the conversion service at URL (see --serve) convert the plans")
+    service = ap.add_argument_group(
+        "conversion service",
+        "run a local HTTP service that converts plans for Apps and command lines "
+        "started with --server")
+    service.add_argument("--serve", metavar="[HOST:]PORT", nargs="?", const=str(DEFAULT_PORT),
+                         help=f"start the service (default port {DEFAULT_PORT}, localhost only)")
+    service.add_argument("--allow-host", metavar="HOST", action="append",
+                         help="host whose plans the service converts, may be repeated "
+                              f"(default: {', '.join(DEFAULT_ALLOWED_HOSTS)})")
+    service.add_argument("--service-cache", type=int, default=DEFAULT_SERVICE_CACHE // 2**20,
+                         metavar="MB", help="memory for converted plans (default: %(default)s MB)")
+    ap.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                    help="maximum requests per second to one site (default: %(default)s)")
+    ap.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                    help="retries after timeouts, 429 and 5xx answers (default: %(default)s)")
+    ap.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                    help="seconds to wait for a server (default: %(default)s)")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                    help=f"HTTP cache directory (default: {DEFAULT_CACHE_DIR})")
+    ap.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // 2**20,
+                    help="maximum size of the HTTP cache in MB (default: %(default)s)")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="always download the full pages")
+    ap.add_argument("--offline", action="store_true",
+                    help="only use pages from the HTTP cache, no network access")
+    existing = ap.add_argument_group(
+        "existing .zwo files", "read .zwo files instead of converting plans")
+    existing.add_argument("--inventory", action="store_true",
+                          help="list duration, IF, TSS and zone of the .zwo files in the "
+                               "targets (files or folders) and which of them are the same "
+                               "workout; --stats writes the list to a CSV file")
+    query = ap.add_argument_group(
+        "library queries", "search the library instead of downloading anything"
+    )
+    query.add_argument("--find", metavar="TEXT",
+                       help="words in the title or description")
+    query.add_argument("--duration", metavar="MIN-MAX", type=minutes_range,
+                       help="duration in minutes, e.g. 45-60, 90- or -30")
+    query.add_argument("--intensity", metavar="MIN-MAX", type=parse_range,
+                       help="intensity factor, e.g. 0.85-0.95")
+    query.add_argument("--zone", choices=ZONE_NAMES,
+                       help="zone with the most time in it")
+    query.add_argument("--plan", help="part of the plan URL")
+    query.add_argument("--export", action="store_true",
+                       help="write the matching workouts to --outdir or --archive "
+                            "instead of listing them")
+    args = ap.parse_args()
+    args.query = any(
+        value is not None for value in
+        (args.find, args.duration, args.intensity, args.zone, args.plan)
+    ) or args.export
+    if args.query and (args.targets or args.input_file):
+        ap.error("library queries don't take targets")
+    if args.query and args.no_library:
+        ap.error("library queries need the library")
+    if args.archive and not args.archive.endswith(ARCHIVE_SUFFIXES):
+        ap.error("--archive must end in " + ", ".join(ARCHIVE_SUFFIXES))
+    if args.sync and args.archive:
+        ap.error("--sync works on --outdir, not on an --archive")
+    if args.offline and args.no_cache:
+        ap.error("--offline needs the cache")
+    if args.serve and (args.targets or args.input_file or args.query or args.server):
+        ap.error("--serve takes no targets, library queries or --server")
+    if args.server and (args.crawl or args.stream or args.offline):
+        ap.error("--server can't be combined with --crawl, --stream or --offline")
+    if args.server and not all(is_url(target) for target in args.targets):
+        ap.error("--server converts URLs, not saved pages")
+    # a roster is for the .erg files, whatever else --format asks for
+    args.formats = sorted(set(args.formats or ()) | ({"erg"} if args.roster else set()))
+    if "erg" in args.formats and not args.roster:
+        ap.error("--format erg needs the FTPs of a --roster")
+    if args.formats and (args.stream or args.query or args.serve):
+        ap.error("--roster and --format can't be combined with --stream, --serve or a library query")
+    args.riders = ()
+    if args.roster:
+        try:
+            args.riders = tuple(read_roster(args.roster))
+        except (OSError, ValueError) as e:
+            ap.error(str(e))
+        if not args.riders:
+            ap.error(f"{args.roster}: no riders")
+    if args.dedup_report and not args.dedup:
+        ap.error("--dedup-report needs --dedup")
+    if args.dedup and (args.serve or (args.query and not args.export)):
+        ap.error("--dedup applies to the files written")
+    if args.inventory and (args.query or args.serve or args.crawl or args.stream or args.server
+                           or args.formats or args.sync or args.archive or args.dedup):
+        ap.error("--inventory only takes targets, --input-file, --stats and --parse-workers")
+    if args.inventory and any(is_url(target) for target in args.targets):
+        ap.error("--inventory reads .zwo files, not URLs")
+    if args.restart and not args.crawl:
+        ap.error("--restart only applies to --crawl")
+    if args.crawl and (args.query or args.stream):
+        ap.error("--crawl can't be combined with a library query or --stream")
+    if args.crawl and args.archive:
+        ap.error("--crawl writes to --outdir, an --archive can't be resumed")
+    if args.crawl and not all(is_url(target) for target in args.targets):
+        ap.error("--crawl starts from URLs")
+    if not args.targets and not args.input_file and not (args.query or args.crawl or args.serve):
+        ap.error("give at least one target, --input-file or a library query")
+    if args.workers < 1:
+        ap.error("--workers must be at least 1")
+    if args.parse_workers is not None and args.parse_workers < 0:
+        ap.error("--parse-workers can't be negative")
+    if args.queue_size < 1:
+        ap.error("--queue-size must be at least 1")
+    if args.rate <= 0:
+        ap.error("--rate must be positive")
+    if args.retries < 0:
+        ap.error("--retries can't be negative")
+    if args.timeout <= 0:
+        ap.error("--timeout must be positive")
+    return args
+
+def read_targets(args):
+    targets = list(args.targets)
+    if args.input_file:
+        with open(args.input_file) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    targets.append(line)
+    # drop duplicates but keep the order of the command line / file
+    return list(dict.fromkeys(targets))
+
+@functools.lru_cache(maxsize=4096)
+def parse_step_text(text):
+    """Match a normalised step text once and return its Step.
+
+    Plan pages repeat the same step texts over and over, so results are
+    memoised; the returned Step is shared and must not be modified.
+    """
+    match = STEP_RE.match(text)
+    if match is None:
+        raise RuntimeError(f"Couldn't parse {text}")
+    # the groups in the order of STEP_RE, only the ones used are converted
+    (reps, hrs, mins, secs, cadence, power, off_hrs, off_mins, off_secs, off_cadence,
+     off_power, ramp_cadence, low, high, free) = match.groups()
+    duration = calc_duration(hrs, mins, secs)
+    if free:
+        step = Step(FREE_RIDE, duration)
+    elif low:
+        step = Step(RAMP, duration, int(low) / 100.0, int(high) / 100.0,
+                    int(ramp_cadence) if ramp_cadence else None)
+    elif reps and off_power:
+        step = Step(
+            INTERVALS,
+            duration,
+            int(power) / 100.0,
+            int(power) / 100.0,
+            int(cadence) if cadence else None,
+            reps=int(reps),
+            off_duration=calc_duration(off_hrs, off_mins, off_secs),
+            off_power=int(off_power) / 100.0,
+            off_cadence=int(off_cadence) if off_cadence else None,
+        )
+    else:
+        step = Step(STEADY, duration, int(power) / 100.0, int(power) / 100.0,
+                    int(cadence) if cadence else None)
+    if reps and step.kind != INTERVALS:
+        raise RuntimeError(f"Couldn't parse {text}")
+    return step
+
+def normalise_step_text(text):
+    return " ".join(text.split())
+
+def step_pattern(text):
+    """The step type a text that STEP_RE rejected was probably meant to be."""
+    if "free ride" in text:
+        return FREE_RIDE
+    if "from" in text and " to" in text:
+        return RAMP
+    if re.match(r"\d+x ", text):
+        return INTERVALS
+    if "@" in text:
+        return STEADY
+    return "unknown"
+
+def parse_steps(texts):
+    """The Steps of a workout, with on/off runs folded into intervals."""
+    if not RunMetrics.enabled():
+        return fold_repeats([parse_step_text(normalise_step_text(text)) for text in texts])
+    steps = []
+    before = parse_step_text.cache_info()
+    with RunMetrics.timer("parse_steps"):
+        for text in texts:
+            text = normalise_step_text(text)
+            try:
+                steps.append(parse_step_text(text))
+            except RuntimeError:
+                RunMetrics.count("step_misses", pattern=step_pattern(text))
+                raise
+    after = parse_step_text.cache_info()
+    RunMetrics.count("steps", len(steps))
+    RunMetrics.count("step_memo", after.hits - before.hits, result="hit")
+    RunMetrics.count("step_memo", after.misses - before.misses, result="miss")
+    folded = fold_repeats(steps)
+    RunMetrics.count("steps_folded", len(steps) - len(folded))
+    return folded
+
+def step_position(i, count):
+    if i == 0:
+        return StepPosition.FIRST
+    if i == count - 1:
+        return StepPosition.LAST
+    return StepPosition.MIDDLE
+
+def make_session(pool_size=8):
+    # one keep-alive connection pool shared by all downloads
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def make_client(workers=8, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT):
+    return HttpClient(make_session(workers), rate=rate, max_concurrency=workers,
+                      retries=retries, timeout=timeout)
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = make_client()
+    return _client
+
+def fetch_url(url, client=None, cache=None, offline=False):
+    with RunMetrics.timer("fetch"):
+        content = _fetch_url(url, client, cache, offline)
+    RunMetrics.count("bytes_fetched", len(content))
+    return content
+
+def _fetch_url(url, client, cache, offline):
+    if cache is None:
+        if offline:
+            raise CacheMiss("offline without a cache")
+        if client is None:
+            client = get_client()
+        return client.get(url).content
+    if offline:
+        content = cache.read(url)
+        if content is None:
+            RunMetrics.count("http_cache", result="miss")
+            raise CacheMiss("not in the cache")
+        RunMetrics.count("http_cache", result="hit")
+        return content
+    if client is None:
+        client = get_client()
+    # revalidate the cached copy, an unchanged page only costs a 304
+    response = client.get(url, headers=cache.conditional_headers(url))
+    if response.status_code == 304:
+        content = cache.read(url)
+        if content is not None:
+            RunMetrics.count("http_cache", result="hit")
+            return content
+        # evicted in the meantime
+        response = client.get(url)
+    RunMetrics.count("http_cache", result="miss")
+    if response.status_code == 200:
+        cache.store(url, response.content, response.headers)
+    return response.content
+
+def iter_chunks(content, chunk_size=64 * 1024):
+    for i in range(0, len(content), chunk_size):
+        yield content[i:i + chunk_size]
+
+def stream_url(url, client=None, cache=None, offline=False, chunk_size=64 * 1024):
+    """Like fetch_url, but yields the page in chunks while it downloads."""
+    if offline:
+        yield from iter_chunks(fetch_url(url, cache=cache, offline=True), chunk_size)
+        return
+    if client is None:
+        client = get_client()
+    headers = cache.conditional_headers(url) if cache is not None else {}
+    with client.get(url, headers=headers, stream=True) as response:
+        if response.status_code != 304:
+            chunks = response.iter_content(chunk_size)
+            if cache is not None:
+                RunMetrics.count("http_cache", result="miss")
+                if response.status_code == 200:
+                    # compressed into the cache as it comes, never held whole
+                    chunks = cache.store_chunks(url, chunks, response.headers)
+            for chunk in chunks:
+                RunMetrics.count("bytes_fetched", len(chunk))
+                yield chunk
+            return
+    # closed first, so fetching a page evicted in the meantime gets a slot
+    content = cache.read(url)
+    if content is None:
+        content = fetch_url(url, client, cache)
+    else:
+        RunMetrics.count("http_cache", result="hit")
+    yield from iter_chunks(content, chunk_size)
 
 def read_file(path):
-    try:
-        return open(path).read()
-    except FileNotFoundError as e:
-        return None
+    """The bytes of a saved page, read through a memory map."""
+    return read_page(LocalPage(path, path))
+
+def expand_targets(targets):
+    """Replace local files, directories and archives by the pages in them.
+
+    Returns the URLs and LocalPages to convert, and (target, error) for the
+    local targets that could not be read.
+    """
+    pages = []
+    errors = []
+    for target in targets:
+        if is_url(target):
+            pages.append(target)
+            continue
+        try:
+            pages += local_pages(target)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            errors.append((target, e))
+    return pages, errors
 
-def text(tree, selector):
-    return tree.xpath(f"{selector}/text()")[0]
+def fetch_target(target, client=None, cache=None, offline=False):
+    # saved pages are read by the parse stage itself, straight from the file
+    if isinstance(target, LocalPage):
+        return target
+    return fetch_url(target, client, cache, offline)
+
+def target_chunks(target, client=None, cache=None, offline=False):
+    if isinstance(target, LocalPage):
+        return page_chunks(target)
+    return stream_url(target, client, cache, offline)
+
+def page_links(content):
+    """The href of every link on a page."""
+    if not content.strip():
+        return []
+    with RunMetrics.timer("links"):
+        return html.fromstring(content).xpath("//a/@href")
 
 def element_text(element, text):
     node = etree.Element(element)
     node.text = text
     return node
 
+# (tag, class) of the page elements that make up a workout
+SEGMENT_TAGS = ("h4", "div")
+SEGMENT_CLASSES = {
+    ("h4", "flaticon-bike"): "title",
+    ("div", "workoutdescription"): "description",
+    ("div", "workoutlist"): "steps",
+}
+
+def classify(element):
+    if element.tag not in SEGMENT_TAGS:
+        return None
+    for name in element.get("class", "").split():
+        kind = SEGMENT_CLASSES.get((element.tag, name))
+        if kind:
+            return kind
+    return None
+
+class Segmenter:
+    """Pairs every step list with the title and description in front of it.
+
+    Feed it the page elements in document order; it returns a Workout when
+    an element closes one and None otherwise.
+    """
+
+    def __init__(self):
+        self.title = None
+        self.description = None
+
+    def feed(self, element):
+        kind = classify(element)
+        if kind == "title":
+            self.title = element.text_content().strip()
+            self.description = None
+        elif kind == "description":
+            paragraph = element.find("p")
+            if paragraph is not None:
+                self.description = paragraph.text_content().strip()
+        elif kind == "steps":
+            workout = Workout(
+                self.title,
+                self.description,
+                [node for node in element if node.tag == "div"],
+            )
+            self.title = self.description = None
+            if workout.title and workout.steps:
+                return workout
+        return None
+
+def segment_workouts(tree):
+    """Split a parsed page into workouts in a single walk over the tree."""
+    segmenter = Segmenter()
+    workouts = []
+    for element in tree.iter(*SEGMENT_TAGS):
+        workout = segmenter.feed(element)
+        if workout is not None:
+            workouts.append(workout)
+    return workouts
+
+def page_workouts(content):
+    with RunMetrics.timer("html_parse"):
+        tree = html.fromstring(content)
+    with RunMetrics.timer("segment"):
+        return segment_workouts(tree)
+
+def iter_workouts(chunks):
+    """Parse an HTML page incrementally from an iterable of byte chunks.
+
+    Yields a Workout, with the step texts instead of the step nodes, as soon
+    as its step list is closed, and drops the parsed part of the tree
+    afterwards so memory stays bounded by the size of one workout.
+    """
+    parser = etree.HTMLPullParser(events=("end",))
+    parser.set_element_class_lookup(html.HtmlElementClassLookup())
+    segmenter = Segmenter()
+
+    def events():
+        for _, element in parser.read_events():
+            workout = segmenter.feed(element)
+            if classify(element) != "steps":
+                continue
+            if workout is not None:
+                yield workout._replace(
+                    steps=[node.text_content() for node in workout.steps]
+                )
+            # free the finished part of the document
+            element.clear()
+            for node in itertools.chain([element], element.iterancestors()):
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+
+    fed = False
+    for chunk in chunks:
+        fed = fed or bool(chunk)
+        with RunMetrics.timer("html_parse"):
+            parser.feed(chunk)
+        yield from events()
+    if not fed:
+        # an empty page has no workouts, closing the parser would raise
+        return
+    with RunMetrics.timer("html_parse"):
+        parser.close()
+    yield from events()
+
+def workout_xml(title, steps, description=None, stats=None):
+    if stats is None:
+        stats = workout_stats(steps)
+    root = etree.Element("workout_file")
+    root.append(element_text("author", "M. Afschrift"))
+    root.append(element_text("name", title))
+    summary = stats_summary(stats)
+    if description:
+        summary = description + "\n\n" + summary
+    root.append(element_text("description", summary))
+    root.append(element_text("sportType", "bike"))
+    tags = etree.SubElement(root, "tags")
+    for tag in stats_tags(stats):
+        etree.SubElement(tags, "tag", name=tag)
+    workout = etree.Element("workout")
+    for i, step in enumerate(steps):
+        workout.append(step_element(step, step_position(i, len(steps))))
+    root.append(workout)
+    return root
+
+def workout_filename(title):
+    # check for slash in strfilename and remove if needed
+    return (title + '.zwo').replace('/', '_')
+
+def workout_document(root):
+    # the reference serialisation; ZwoXml.write_workout writes the same bytes
+    etree.indent(root, space="    ")
+    return etree.tostring(root, pretty_print=True, encoding="unicode")
+
+def parse_page(content):
+    """The workouts of a page with parsed steps, and their stats."""
+    workouts = [
+        workout._replace(
+            steps=parse_steps(node.text_content() for node in workout.steps)
+        )
+        for workout in page_workouts(content)
+    ]
+    # the stats of the whole page in one vectorised pass
+    with RunMetrics.timer("stats"):
+        all_stats = workouts_stats([workout.steps for workout in workouts])
+    RunMetrics.count("pages")
+    RunMetrics.count("workouts", len(workouts))
+    return workouts, all_stats
+
+def page_documents(content):
+    """Convert a page to a list of Documents.
+
+    This is the parse stage of the pipeline and runs in a worker process,
+    so it returns plain picklable values instead of writing anything.
+    """
+    return page_plan(content)[0]
+
+def page_plan(content):
+    """The Documents of a page and the steps of every workout."""
+    workouts, all_stats = parse_page(content)
+    with RunMetrics.timer("serialise"):
+        documents = [
+            Document(
+                workout_filename(workout.title),
+                workout_text(workout.title, workout.steps, workout.description, stats),
+                workout.title,
+                workout.description,
+                stats,
+                steps_key(workout.steps),
+            )
+            for workout, stats in zip(workouts, all_stats)
+        ]
+    return documents, [workout.steps for workout in workouts]
+
+def convert_target(content, riders=(), formats=()):
+    """Parse stage of the pipeline: the Converted page.
+
+    content is a downloaded page, or a LocalPage that is read here, in the
+    worker process, chunk by chunk from a memory map. formats are rendered
+    for riders from the parsed steps.
+    """
+    if isinstance(content, LocalPage):
+        hasher = hashlib.sha256()
+        documents = []
+        steps = []
+        convert_stream(hash_chunks(page_chunks(content), hasher), None,
+                       documents=documents, steps=steps)
+        page_hash = hasher.hexdigest()
+    else:
+        page_hash = content_hash(content)
+        documents, steps = page_plan(content)
+    return Converted(page_hash, documents, render_documents(documents, steps, riders, formats))
+
+def render_documents(documents, steps, riders=(), formats=()):
+    """The (filename, text) of the other formats of a page's workouts."""
+    if not formats:
+        return []
+    with RunMetrics.timer("render"):
+        return list(render_plan(
+            [
+                (os.path.splitext(document.filename)[0], document.title,
+                 document.description, workout_steps)
+                for document, workout_steps in zip(documents, steps)
+            ],
+            riders,
+            formats,
+        ))
+
+def crawl_target(content, riders=(), formats=()):
+    """convert_target for a crawl, with the links of pages that hold no workouts.
+
+    Plan and workout pages are where a crawl ends, only the index pages in
+    between are searched for more pages.
+    """
+    converted = convert_target(content, riders, formats)
+    if converted.documents:
+        return converted
+    return converted._replace(links=page_links(content))
+
+def served_plan(data, riders=(), formats=()):
+    """convert_target for --server, where the service converted the page."""
+    page_hash, documents, steps = decode_plan(data)
+    files = render_documents(documents, steps, riders, formats)
+    return Converted(page_hash, documents, files), None
+
+def hash_chunks(chunks, hasher):
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def write_documents(documents, writer, table=None, files=()):
+    with RunMetrics.timer("write"):
+        for document in documents:
+            writer.write(document.filename, document.text, document.key)
+        for filename, text in files:
+            writer.write(filename, text)
+    if table is not None:
+        table.extend((document.title, document.stats) for document in documents)
+    return len(documents)
+
+def convert_stream(chunks, writer, table=None, documents=None, steps=None):
+    """Write the workouts of a streamed page; Documents go to documents if given.
+
+    With documents, writer may be None to only collect them. The parsed
+    steps of every workout go to steps if given.
+    """
+    count = 0
+    for workout in iter_workouts(chunks):
+        workout_steps = parse_steps(workout.steps)
+        with RunMetrics.timer("stats"):
+            stats = workout_stats(workout_steps)
+        filename = workout_filename(workout.title)
+        key = steps_key(workout_steps)
+        if documents is None:
+            with RunMetrics.timer("write"):
+                writer.write_to(
+                    filename,
+                    lambda f: write_workout(f, workout.title, workout_steps, workout.description, stats),
+                    key,
+                )
+        else:
+            with RunMetrics.timer("serialise"):
+                document = Document(
+                    filename,
+                    workout_text(workout.title, workout_steps, workout.description, stats),
+                    workout.title,
+                    workout.description,
+                    stats,
+                    key,
+                )
+            if writer is not None:
+                with RunMetrics.timer("write"):
+                    writer.write(filename, document.text, key)
+            documents.append(document)
+        if steps is not None:
+            steps.append(workout_steps)
+        if table is not None:
+            table.append((workout.title, stats))
+        count += 1
+    RunMetrics.count("pages")
+    RunMetrics.count("workouts", count)
+    return count
+
+def plan_folder(url):
+    """The folder for the files of a crawled page: its URL path, a folder per part.
+
+    Every page has a folder of its own that stays the same from crawl to
+    crawl, also when plans on different paths end in the same name.
+    """
+    parts = urlsplit(url)
+    names = [
+        unquote(name).replace("/", "_").replace("\\", "_")
+        for name in parts.path.split("/")
+        if name not in ("", ".", "..")
+    ]
+    return "/".join(names) or parts.hostname or "workouts"
+
+def store_documents(url, converted, writer, sync=False, table=None, library=None,
+                    folder=None):
+    """Write a Converted page and add its Documents to the library.
+
+    The files go into folder if given. Returns the number of workouts, or
+    None if --sync found the page unchanged.
+    """
+    documents, files = converted.documents, converted.files
+    if folder is not None:
+        documents = [document._replace(filename=f"{folder}/{document.filename}")
+                     for document in documents]
+        files = [(f"{folder}/{filename}", text) for filename, text in files]
+    if sync:
+        if writer.unchanged(url, converted.page_hash):
+            return None
+        page = writer.page(url, converted.page_hash)
+        count = write_documents(documents, page, table, files)
+        # an empty page must not remove the workouts of the last run
+        if count:
+            page.close()
+    else:
+        count = write_documents(documents, writer, table, files)
+    if count and library is not None:
+        with RunMetrics.timer("library"):
+            library.replace_plan(url, converted.documents)
+    return count
+
+def store_pages(pages, writer, sync=False, table=None, library=None, folders=False):
+    """Store the pages coming out of the pipeline.
+
+    Yields (PageResult, count) for every page. A page that failed has its
+    error set (and is reported here), count is None for it and for pages
+    --sync found unchanged. With folders every page gets a plan_folder.
+    """
+    for page in pages:
+        url = target_name(page.url)
+        if page.stage == "fetch":
+            print(f"{url}: download failed ({page.error})", file=sys.stderr)
+            RunMetrics.count("pages_failed", stage="fetch")
+            yield page, None
+            continue
+        try:
+            if page.error is not None:
+                RunMetrics.merge(getattr(page.error, "snapshot", None))
+                raise page.error
+            converted, snapshot = page.result
+            RunMetrics.merge(snapshot)
+            count = store_documents(url, converted, writer, sync, table, library,
+                                    plan_folder(url) if folders else None)
+        except Exception as e:
+            print(f"{url}: conversion failed ({e})", file=sys.stderr)
+            RunMetrics.count("pages_failed", stage="convert")
+            yield page._replace(error=e, stage="convert"), None
+            continue
+        yield page, count
+
+def crawl(frontier, make_pipeline, writer, sync=False, table=None, library=None):
+    """Convert the pending pages of a crawl until there are none left.
+
+    Every page is checkpointed in the frontier as soon as it is stored, so
+    an interrupted crawl continues where it stopped. The files of every page
+    go into a plan_folder, different plans often have workouts with the same
+    title. Returns the number of pages that failed.
+    """
+    failed = 0
+    while True:
+        urls = frontier.pending(CRAWL_BATCH)
+        if not urls:
+            return failed
+        for page, _ in store_pages(make_pipeline(len(urls)).run(urls),
+                                   writer, sync, table, library, folders=True):
+            if page.error is not None:
+                frontier.failed(page.url, page.error)
+                failed += 1
+                continue
+            converted = page.result[0]
+            added = frontier.done(page.url, len(converted.documents), converted.links)
+            RunMetrics.count("crawl_pages")
+            RunMetrics.count("crawl_links", len(converted.links))
+            RunMetrics.count("crawl_discovered", added)
+
+def sync_stream(url, chunks, sync, table=None, documents=None):
+    page = sync.page(url)
+    count = convert_stream(page.track(chunks), page, table, documents)
+    if count:
+        page.close()
+    return count
+
+def stream_page(url, chunks, writer, sync=False, table=None, library=None):
+    """Convert one streamed page in a worker thread and add it to the library."""
+    documents = [] if library is not None else None
+    if sync:
+        count = sync_stream(url, chunks, writer, table, documents)
+    else:
+        count = convert_stream(chunks, writer, table, documents)
+    if count and library is not None:
+        with RunMetrics.timer("library"):
+            library.replace_plan(url, documents)
+    return count
+
+def parse_range(text, scale=1):
+    """Parse "low-high", "low-", "-high" or "value" into a (low, high) tuple."""
+    low, sep, high = text.partition("-")
+    if not sep:
+        high = low
+    try:
+        return tuple(float(part) * scale if part.strip() else None for part in (low, high))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a range: {text}")
+
+def minutes_range(text):
+    return parse_range(text, 60)
+
+def print_workouts(rows):
+    for row in rows:
+        print(f"{format_duration(row['duration'])}  IF {row['intensity']:.2f}  "
+              f"TSS {row['tss']:3.0f}  {row['zone'] or '-':3s}  {row['title']}  ({row['plan']})")
+
+def report_dedup(args, writer):
+    """Print what --dedup saved and write the --dedup-report."""
+    if not args.dedup:
+        return
+    index = writer.dedup
+    saved = index.stats["saved"]
+    saved = f"{saved / 2**20:.1f} MB" if saved >= 2**20 else f"{saved / 1024:.0f} KB"
+    unchanged = index.stats["unchanged"]
+    unchanged = f", {unchanged} unchanged" if unchanged else ""
+    unchanged = index.stats["unchanged"]
+    unchanged = f", {unchanged} unchanged" if unchanged else ""
+    print("dedup: {files} files, {unique} stored, {linked} duplicates not stored again "
+          "({retitled} of them under another title), ".format(**index.stats)
+          + f"{saved} not written{unchanged}", file=sys.stderr)
+    if args.dedup_report:
+        root = writer.path if isinstance(writer, DirectoryWriter) else ""
+        write_links_report(args.dedup_report, index, root)
+
+def query_library(args):
+    library = WorkoutLibrary(args.library)
+    start = time.perf_counter()
+    rows = library.query(
+        text=args.find,
+        duration=args.duration,
+        intensity=args.intensity,
+        zone=args.zone,
+        plan=args.plan,
+        documents=args.export,
+    )
+    elapsed = time.perf_counter() - start
+    if args.export:
+        writer = open_writer(args.outdir, args.archive, args.dedup)
+        for row in rows:
+            writer.write(row["filename"], row["document"])
+        writer.close()
+        print(f"{len(rows)} workouts exported", file=sys.stderr)
+        report_dedup(args, writer)
+    else:
+        print_workouts(rows)
+        print(f"{len(rows)} of {len(library)} workouts ({elapsed * 1e3:.1f} ms)",
+              file=sys.stderr)
+    library.close()
+
+def inventory_files(args):
+    """Read the .zwo files of the targets and report them, see --inventory."""
+    workers = args.parse_workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    rows = inventory(read_targets(args), workers)
+    if args.stats:
+        rows = write_inventory(args.stats, rows)
+    start = time.perf_counter()
+    files = failed = duplicates = 0
+    # the first file of every different workout
+    first = {}
+    for row in rows:
+        files += 1
+        if row.error is not None:
+            print(f"{row.path}: can't read ({row.error})", file=sys.stderr)
+            failed += 1
+            continue
+        original = first.setdefault(row.key, row.path)
+        if original != row.path:
+            duplicates += 1
+        if not args.stats:
+            stats = row.stats
+            same = f"  = {original}" if original != row.path else ""
+            print(f"{format_duration(stats.duration)}  IF {stats.intensity:.2f}  "
+                  f"TSS {stats.tss:3.0f}  {dominant_zone(stats.zones) or '-':3s}  "
+                  f"{row.title}  ({row.path}){same}")
+    elapsed = time.perf_counter() - start
+    print(f"{files} files, {len(first)} different workouts, {duplicates} duplicates, "
+          f"{failed} unreadable ({files / max(elapsed, 1e-9):.0f} files/s)", file=sys.stderr)
+    return failed
+
+def crawl_catalogue(args, seeds, make_pipeline, writer, table=None, library=None):
+    with CrawlFrontier(args.crawl_state) as frontier:
+        if args.restart:
+            frontier.reset()
+        for seed in seeds:
+            if not is_url(target_name(seed)):
+                print(f"{target_name(seed)}: not a URL, can't be crawled", file=sys.stderr)
+        frontier.add_seeds(seed for seed in seeds if isinstance(seed, str))
+        if not frontier.seeds():
+            print("nothing to crawl, give the URL of an index page", file=sys.stderr)
+            return 1
+        retried = frontier.retry_failed()
+        counts = frontier.counts()
+        if counts["done"]:
+            print(f"crawl: resuming with {counts['pending']} pages to go "
+                  f"({counts['done']} done, {retried} failed ones tried again)",
+                  file=sys.stderr)
+        try:
+            failed = crawl(frontier, make_pipeline, writer, args.sync, table, library)
+        except KeyboardInterrupt:
+            print("crawl: interrupted, run it again to continue", file=sys.stderr)
+            failed = 1
+        counts = frontier.counts()
+        print("crawl: {done} pages done, {failed} failed, {pending} pending, "
+              "{workouts} workouts".format(**counts), file=sys.stderr)
+        return failed
+
+def serve(args):
+    cache = None if args.no_cache else HttpCache(args.cache_dir, args.cache_size * 2**20)
+    client = make_client(args.workers, args.rate, args.retries, args.timeout)
+    plans = PlanCache(
+        functools.partial(fetch_url, client=client, cache=cache),
+        page_plan,
+        args.service_cache * 2**20,
+    )
+    host, port = parse_address(args.serve)
+    service = ConversionService(
+        (host, port), plans, tuple(args.allow_host or DEFAULT_ALLOWED_HOSTS)
+    )
+    print(f"converting plans on http://{host}:{port}/, Ctrl+C to stop", file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+        if cache is not None:
+            cache.close()
+
 def main():
     args = parse_args()
-    #content = read_file("https://whatsonzwift.com/workouts/build-me-up/week-4-pedaling-drills")
-    content = read_file(args.target)
-    #if not content:
-    content = fetch_url(args.target)
-    #content = fetch_url('https://whatsonzwift.com/workouts/pebble-pounder')
-    tree = html.fromstring(content)
-    title = text(tree, '//h4[contains(@class, "flaticon-bike")]').strip()
-    desc = text(tree, '//div[contains(@class, "workoutdescription")]/p')
-    steps = tree.xpath('//div[contains(@class, "workoutlist")]/div')
-
-    WorkoutNames = tree.xpath('//h4[@class="glyph-icon flaticon-bike"]')
-    descNames = tree.xpath('//div[contains(@class, "workoutdescription")]/div')
-
-    linesource = []
-    for il, node in enumerate(steps):
-        linesource.append(node.sourceline)
-
-    #get difference between lines
-    ctfiles = 1
-    inewfile = []
-    for i in range(0, len(linesource)-1):
-        diffLines = linesource[i+1] - linesource[i]
-        if diffLines > 10:
-            ctfiles = ctfiles+1
-            inewfile.append(i+1)
-    inewfile.append(len(linesource))
-
-    for ifile in range(0, ctfiles-1):
-        root = etree.Element("workout_file")
-        root.append(element_text("author", "M. Afschrift"))
-        titlesel = WorkoutNames[ifile+1]
-        title = titlesel.text_content()
-        root.append(element_text("name", title))
-
-        # find the descrtion after the title
-
-        root.append(element_text("description", "ToDo"))
-        root.append(element_text("sportType", "bike"))
-        root.append(etree.Element("tags"))
-        workout = etree.Element("workout")
-
-        # selected indices in this file
-        stepindices = range(inewfile[ifile],inewfile[ifile+1])
-
-        for i in range(0, len(stepindices)):
-            node = steps[stepindices[i]]
-            if i == 0:
-                pos = StepPosition.FIRST
-            elif i == len(steps) - 1:
-                pos = StepPosition.LAST
-            else:
-                pos = StepPosition.MIDDLE
-            workout.append(parse_node(node, pos))
-        root.append(workout)
-        #write the file
-        etree.indent(root, space="    ")
-        strfilename = title + '.zwo'
-        # check for slash in strfilename and remove if needed
-        strfilename = strfilename.replace('/', '_')
-        datapath = "C:\\Temp\\ZwoFiles\\"
-        if not(os.path.isdir(datapath)):
-            os.makedirs(datapath)
-        with open(datapath + strfilename, 'w') as f:
-            f.write(
-                etree.tostring(root, pretty_print=True, encoding="unicode"),
+    if args.query:
+        query_library(args)
+        return
+    if args.serve:
+        serve(args)
+        return
+    if args.profile or args.metrics:
+        RunMetrics.enable()
+    if args.inventory:
+        failed = inventory_files(args)
+        if args.metrics:
+            RunMetrics.write_report(args.metrics)
+        if args.profile:
+            print(RunMetrics.format_report(), file=sys.stderr)
+        if failed:
+            sys.exit(1)
+        return
+    targets, errors = expand_targets(read_targets(args))
+    for target, error in errors:
+        print(f"{target}: can't read ({error})", file=sys.stderr)
+    if args.sync:
+        # other riders or formats make other files
+        salt = render_fingerprint(args.riders, args.formats) if args.formats else ""
+        writer = SyncWriter(args.outdir, CONVERTER_VERSION, salt, args.dedup)
+    else:
+        writer = open_writer(args.outdir, args.archive, args.dedup)
+    cache = None
+    if not args.no_cache:
+        cache = HttpCache(args.cache_dir, args.cache_size * 2**20)
+    table = [] if args.stats else None
+    library = None if args.no_library else WorkoutLibrary(args.library)
+    failed = len(errors)
+    if args.stream:
+        client = make_client(args.workers, args.rate, args.retries, args.timeout)
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {}
+            for target in targets:
+                url = target_name(target)
+                chunks = target_chunks(target, client, cache, args.offline)
+                future = pool.submit(
+                    stream_page, url, chunks, writer, args.sync, table, library
+                )
+                futures[future] = url
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    count = future.result()
+                except (requests.RequestException, CacheMiss) as e:
+                    print(f"{url}: download failed ({e})", file=sys.stderr)
+                    RunMetrics.count("pages_failed", stage="fetch")
+                    failed += 1
+                    continue
+                except Exception as e:
+                    print(f"{url}: conversion failed ({e})", file=sys.stderr)
+                    RunMetrics.count("pages_failed", stage="convert")
+                    failed += 1
+                    continue
+                if count == 0:
+                    print(f"{url}: no workouts found", file=sys.stderr)
+                    failed += 1
+    else:
+        client = make_client(args.workers, args.rate, args.retries, args.timeout)
+
+        def make_pipeline(pages):
+            parse_workers = args.parse_workers
+            if parse_workers is None:
+                parse_workers = default_parse_workers(pages)
+            fetch = functools.partial(fetch_target, client=client, cache=cache, offline=args.offline)
+            target = functools.partial(crawl_target if args.crawl else convert_target,
+                                       riders=args.riders, formats=args.formats)
+            # the parse processes send their metrics back with every page
+            convert = functools.partial(RunMetrics.measured, target)
+            if args.server:
+                fetch = functools.partial(fetch_plan, args.server, client=client)
+                convert = functools.partial(served_plan, riders=args.riders, formats=args.formats)
+                parse_workers = 0
+            return Pipeline(
+                fetch,
+                convert,
+                fetch_workers=args.workers,
+                parse_workers=parse_workers,
+                queue_size=args.queue_size,
+                initializer=RunMetrics.enable_worker if RunMetrics.enabled() else None,
+                # downloaded pages can be checked before they are converted, but
+                # a crawl needs the links of every page
+                skip=(lambda url, content: isinstance(content, bytes)
+                      and writer.unchanged(url, content_hash(content)))
+                if args.sync and not args.crawl else None,
             )
-        #print('file one done')
+
+        if args.crawl:
+            failed += crawl_catalogue(args, targets, make_pipeline, writer, table, library)
+        else:
+            for page, count in store_pages(make_pipeline(len(targets)).run(targets),
+                                           writer, args.sync, table, library):
+                if page.error is not None:
+                    failed += 1
+                elif count == 0:
+                    print(f"{target_name(page.url)}: no workouts found", file=sys.stderr)
+                    failed += 1
+    writer.close()
+    if table is not None:
+        write_stats_table(args.stats, table)
+    if args.sync:
+        print("sync: {pages_skipped} pages unchanged, {written} files written, "
+              "{unchanged} unchanged, {removed} removed".format(**writer.stats))
+    report_dedup(args, writer.directory if args.sync else writer)
+    if cache is not None:
+        cache.close()
+    if library is not None:
+        library.close()
+    if args.metrics:
+        RunMetrics.write_report(args.metrics)
+    if args.profile:
+        print(RunMetrics.format_report(), file=sys.stderr)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
+    # the parse processes of a frozen (PyInstaller) build start here too
+    multiprocessing.freeze_support()
     main()
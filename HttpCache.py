@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".getzwo", "cache")
+DEFAULT_CACHE_SIZE = 200 * 1024 * 1024
+INDEX_FILE = "index.json"
+# the index is written at most this often (seconds) while pages come in,
+# and on close()
+SAVE_INTERVAL = 5.0
+# eviction goes down to this share of max_bytes, so a full cache doesn't
+# sort its entries again for every page stored
+EVICT_TO = 0.9
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+class HttpCache:
+    """Size-bounded on-disk cache of page bodies, keyed by URL.
+
+    Bodies are stored zlib-compressed, one file per URL, next to an index with
+    the validators (ETag / Last-Modified) needed for conditional requests.
+    When the compressed size exceeds max_bytes the least recently used
+    entries are removed.
+
+    The index is saved every SAVE_INTERVAL seconds and by close(), not for
+    every page, which would make storing n pages quadratic. After a crash
+    the pages of the last few seconds are downloaded again.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._index = self._load_index()
+        self._total = sum(entry["size"] for entry in self._index.values())
+        self._saved = time.monotonic()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.path, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # forget entries whose body file is gone
+        return {
+            url: entry for url, entry in index.items()
+            if os.path.isfile(self._body_path(url))
+        }
+
+    def _save_index(self):
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+        self._saved = time.monotonic()
+
+    def _body_path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key + ".z")
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._index
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index)
+
+    def total_size(self):
+        with self._lock:
+            return self._total
+
+    def conditional_headers(self, url):
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return {}
+            headers = {}
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            return headers
+
+    def read(self, url):
+        """Return the cached body of url, or None if it is not cached."""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None
+            try:
+                with open(self._body_path(url), "rb") as f:
+                    body = zlib.decompress(f.read())
+            except (OSError, zlib.error):
+                self._total -= self._index.pop(url)["size"]
+                return None
+            entry["atime"] = time.time()
+            return body
+
+    def store(self, url, body, headers):
+        data = zlib.compress(body, 6)
+        path = self._body_path(url)
+        with self._lock:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            self._add(url, tmp, len(data), headers)
+
+    def store_chunks(self, url, chunks, headers):
+        """Store the body of url while passing its chunks on.
+
+        The chunks are compressed into the cache file as they come, so the
+        body is never held in memory. Nothing is stored if they stop early.
+        """
+        compressor = zlib.compressobj(6)
+        tmp = f"{self._body_path(url)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    data = compressor.compress(chunk)
+                    f.write(data)
+                    size += len(data)
+                    yield chunk
+                data = compressor.flush()
+                f.write(data)
+                size += len(data)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._add(url, tmp, size, headers)
+
+    def _add(self, url, tmp, size, headers):
+        """Move the compressed body in tmp into place; call with the lock held."""
+        os.replace(tmp, self._body_path(url))
+        old = self._index.get(url)
+        if old is not None:
+            self._total -= old["size"]
+        self._index[url] = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "size": size,
+            "atime": time.time(),
+        }
+        self._total += size
+        self._evict()
+        if time.monotonic() - self._saved >= SAVE_INTERVAL:
+            self._save_index()
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for url in sorted(self._index, key=lambda u: self._index[u]["atime"]):
+            if self._total <= self.max_bytes * EVICT_TO:
+                break
+            self._total -= self._index.pop(url)["size"]
+            try:
+                os.remove(self._body_path(url))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        # persist the access times so the LRU order survives the run
+        with self._lock:
+            self._save_index()
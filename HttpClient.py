@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import RunMetrics
+
+DEFAULT_RATE = 10.0
+DEFAULT_RETRIES = 4
+DEFAULT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 10.0
+
+# statuses that mean "slow down and try again"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 503}
+
+
+class FetchError(requests.RequestException):
+    """A page could not be downloaded, or the server answered with an error."""
+
+    def __init__(self, url, message, status=None):
+        super().__init__(message if status is None else f"HTTP {status}")
+        self.url = url
+        self.status = status
+
+
+class TokenBucket:
+    """Allows rate requests per second on average and bursts of up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Send nothing for seconds, e.g. what a Retry-After header asks for."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class AdaptiveLimit:
+    """AIMD limit on the number of requests in flight to one host.
+
+    Every good response adds 1/limit (so about one per round of requests),
+    an overload signal (429/5xx, timeout or a response much slower than the
+    fastest one seen) halves it. The requests already in flight when the
+    limit was halved report the same overload, so it is halved at most once
+    per round trip.
+    """
+
+    def __init__(self, maximum, slow_factor=4.0, slow_floor=1.0):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.slow_factor = slow_factor
+        self.slow_floor = slow_floor
+        self.in_flight = 0
+        self.fastest = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            if latency is not None:
+                if self.fastest is None or latency < self.fastest:
+                    self.fastest = latency
+                if latency > max(self.slow_floor, self.slow_factor * self.fastest):
+                    overloaded = True
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_decrease >= (self.fastest or 0.0):
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Host:
+    def __init__(self, rate, burst, max_concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = AdaptiveLimit(max_concurrency)
+
+
+def release_when_done(response, release):
+    """Call release once the body of a streamed response is read or closed.
+
+    urllib3 hands the connection back with release_conn() in both cases.
+    """
+    raw = response.raw
+    release_conn = raw.release_conn
+    released = False
+
+    def release_once():
+        nonlocal released
+        try:
+            release_conn()
+        finally:
+            if not released:
+                released = True
+                release()
+
+    raw.release_conn = release_once
+
+
+def retry_after(response):
+    """Seconds from a Retry-After header, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """requests.Session wrapper that is polite to every host it talks to.
+
+    Per host, a token bucket spaces the requests out to rate per second and
+    an AdaptiveLimit bounds how many run at once, shrinking when the server
+    shows signs of overload and growing back while it keeps up. Requests time
+    out, and connection errors, timeouts, 429 and 5xx are retried with
+    jittered exponential backoff (honouring Retry-After). get() returns the
+    response for 2xx/304 and raises FetchError otherwise. A response got
+    with stream=True keeps its place in the limit until its body is read or
+    it is closed, so use it in a with block.
+    """
+
+    def __init__(self, session, rate=DEFAULT_RATE, burst=None, max_concurrency=8,
+                 retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT,
+                 backoff=0.5, max_backoff=30.0):
+        self.session = session
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.timeout = (min(CONNECT_TIMEOUT, timeout), timeout)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        key = urlsplit(url).netloc
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = Host(self.rate, self.burst, self.max_concurrency)
+            return host
+
+    def delay(self, attempt):
+        # "full jitter": anywhere between 0 and the exponential bound
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url, headers=None, stream=False):
+        host = self.host(url)
+        attempt = 0
+        while True:
+            host.bucket.acquire()
+            host.limit.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(
+                    url, headers=headers, stream=stream, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                host.limit.release(overloaded=True)
+                RunMetrics.count("http_errors", error=type(e).__name__)
+                if attempt >= self.retries:
+                    raise FetchError(url, str(e)) from e
+                RunMetrics.count("http_retries")
+                time.sleep(self.delay(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                host.limit.release()
+                raise
+            status = response.status_code
+            RunMetrics.count("http_responses", status=status)
+            overloaded = status in RETRY_STATUSES
+            latency = time.monotonic() - start
+            if stream and status < 400:
+                # the body still comes over the connection; a slow reader
+                # holds the slot but doesn't count as a slow server
+                release_when_done(response, lambda: host.limit.release(latency))
+                return response
+            host.limit.release(latency, overloaded)
+            if status < 400:
+                return response
+            response.close()
+            if not overloaded or attempt >= self.retries:
+                raise FetchError(url, "download failed", status)
+            RunMetrics.count("http_retries")
+            wait = retry_after(response) if status in OVERLOAD_STATUSES else None
+            if wait is not None:
+                host.bucket.pause(min(wait, self.max_backoff))
+            else:
+                time.sleep(self.delay(attempt))
+            attempt += 1
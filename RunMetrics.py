@@ -0,0 +1,263 @@
+import json
+import threading
+import time
+
+# The registry of the running conversion, None while metrics are off. Every
+# function below returns right away in that case, so instrumented code costs
+# one global lookup and a call when nobody is looking.
+_metrics = None
+# set in the parse processes, which send their numbers back with each page
+_worker = False
+
+
+class Metrics:
+    """Stage timers and counters of one run, shared by all its threads.
+
+    Counters and timers have a name and optional labels, e.g.
+    count("step_misses", pattern="ramp") or timer("fetch").
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.counters = {}
+        # (name, labels): [seconds, calls]
+        self.timers = {}
+
+    def count(self, name, n=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def record(self, name, seconds, calls=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            timer = self.timers.setdefault(key, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+    def take(self):
+        """Return the numbers so far as (counters, timers) and start over."""
+        with self._lock:
+            counters, timers = self.counters, self.timers
+            self.counters, self.timers = {}, {}
+        return counters, timers
+
+    def merge(self, snapshot):
+        counters, timers = snapshot
+        for (name, labels), n in counters.items():
+            self.count(name, n, labels)
+        for (name, labels), (seconds, calls) in timers.items():
+            self.record(name, seconds, calls, labels)
+
+
+class Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start, 1, self.labels)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def enable():
+    """Start collecting metrics for a new run and return its registry."""
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def enabled():
+    return _metrics is not None
+
+
+def enable_worker():
+    """Initializer of the parse processes of a run with metrics on."""
+    global _worker
+    enable()
+    _worker = True
+
+
+def count(name, n=1, **labels):
+    if _metrics is not None:
+        _metrics.count(name, n, tuple(sorted(labels.items())))
+
+
+def timer(name, **labels):
+    if _metrics is None:
+        return NULL_TIMER
+    return Timer(_metrics, name, tuple(sorted(labels.items())))
+
+
+class WorkerError(Exception):
+    """A failure in a parse process, with what it recorded up to then."""
+
+    def __init__(self, message, snapshot):
+        super().__init__(message, snapshot)
+        self.snapshot = snapshot
+
+    def __str__(self):
+        return self.args[0]
+
+
+def measured(function, *args):
+    """Call function(*args) and return (result, snapshot).
+
+    In a parse process the snapshot holds what the call recorded, for
+    merge() in the main process; elsewhere it is None.
+    """
+    if not _worker:
+        return function(*args), None
+    try:
+        result = function(*args)
+    except Exception as e:
+        raise WorkerError(str(e), _metrics.take()) from None
+    return result, _metrics.take()
+
+
+def merge(snapshot):
+    if _metrics is not None and snapshot is not None:
+        _metrics.merge(snapshot)
+
+
+def counter_value(counters, name, **labels):
+    return counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def rate(hits, misses):
+    return hits / (hits + misses) if hits + misses else None
+
+
+def report(metrics=None):
+    """The metrics as a JSON-serialisable dict."""
+    metrics = metrics or _metrics
+    with metrics._lock:
+        counters = dict(metrics.counters)
+        timers = {key: list(value) for key, value in metrics.timers.items()}
+
+    def label_text(name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+    cache_hits = counter_value(counters, "http_cache", result="hit")
+    cache_misses = counter_value(counters, "http_cache", result="miss")
+    memo_hits = counter_value(counters, "step_memo", result="hit")
+    memo_misses = counter_value(counters, "step_memo", result="miss")
+    return {
+        "wall_seconds": time.perf_counter() - metrics.start,
+        "stages": {
+            label_text(name, labels): {"seconds": seconds, "calls": calls}
+            for (name, labels), (seconds, calls) in sorted(timers.items())
+        },
+        "counters": {
+            label_text(name, labels): n
+            for (name, labels), n in sorted(counters.items())
+        },
+        "rates": {
+            "http_cache_hit_rate": rate(cache_hits, cache_misses),
+            "step_memo_hit_rate": rate(memo_hits, memo_misses),
+        },
+    }
+
+
+def prometheus_text(metrics=None, prefix="getzwo"):
+    """The metrics in the Prometheus text exposition format."""
+    metrics = metrics or _metrics
+    with metrics._lock:
+        counters = dict(metrics.counters)
+        timers = {key: list(value) for key, value in metrics.timers.items()}
+
+    def labels_text(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in labels
+        )
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    lines = [
+        f"# HELP {prefix}_run_seconds Wall-clock time of the run so far.",
+        f"# TYPE {prefix}_run_seconds gauge",
+        f"{prefix}_run_seconds {time.perf_counter() - metrics.start:.6f}",
+        f"# HELP {prefix}_stage_seconds_total Time spent in every stage, summed over threads and processes.",
+        f"# TYPE {prefix}_stage_seconds_total counter",
+    ]
+    for (name, labels), (seconds, _) in sorted(timers.items()):
+        lines.append(f"{prefix}_stage_seconds_total{labels_text((('stage', name),) + labels)} {seconds:.6f}")
+    lines += [
+        f"# HELP {prefix}_stage_calls_total Number of times every stage ran.",
+        f"# TYPE {prefix}_stage_calls_total counter",
+    ]
+    for (name, labels), (_, calls) in sorted(timers.items()):
+        lines.append(f"{prefix}_stage_calls_total{labels_text((('stage', name),) + labels)} {calls}")
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        for (other, labels), n in sorted(counters.items()):
+            if other == name:
+                lines.append(f"{prefix}_{name}_total{labels_text(labels)} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def write_report(path, metrics=None):
+    """Write the metrics to path, in Prometheus format for .prom files, JSON otherwise."""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".prom"):
+            f.write(prometheus_text(metrics))
+        else:
+            json.dump(report(metrics), f, indent=2)
+            f.write("\n")
+
+
+def format_report(metrics=None):
+    """A short table of the stage times and counters, for --profile."""
+    data = report(metrics)
+    lines = [f"run took {data['wall_seconds']:.3f} s"]
+    for name, stage in data["stages"].items():
+        lines.append(f"    {name:24s} {stage['seconds'] * 1e3:10.1f} ms  {stage['calls']:8d} calls")
+    for name, n in data["counters"].items():
+        lines.append(f"    {name:40s} {n:12d}")
+    for name, value in data["rates"].items():
+        if value is not None:
+            lines.append(f"    {name:40s} {value:12.1%}")
+    return "\n".join(lines)
+
+
+def summary(metrics=None):
+    """One line for the App's info area."""
+    data = report(metrics)
+    stages = ", ".join(
+        f"{name} {stage['seconds'] * 1e3:.0f} ms" for name, stage in data["stages"].items()
+    )
+    text = f"{data['wall_seconds']:.2f} s ({stages})" if stages else f"{data['wall_seconds']:.2f} s"
+    hit_rate = data["rates"]["http_cache_hit_rate"]
+    if hit_rate is not None:
+        text += f", cache hit rate {hit_rate:.0%}"
+    return text
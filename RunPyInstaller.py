@@ -1,8 +1,16 @@
+import sys
+
 import PyInstaller.__main__
 
+# --onedir builds a folder instead of a single exe. It starts faster because
+# nothing has to be unpacked to a temp folder on every launch.
+mode = '--onedir' if '--onedir' in sys.argv[1:] else '--onefile'
+
 PyInstaller.__main__.run([
     'App.py',
-    '--onefile',
+    mode,
     '--name=GetZwoFiles',
-    '--icon=Logo_TMD1.ico'
-])
\ No newline at end of file
+    '--icon=Logo_TMD1.ico',
+    # imported on the first download, see App.load_engine
+    '--hidden-import=GetZwo',
+])
@@ -0,0 +1,160 @@
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+DEFAULT_CRAWL_STATE = os.path.join(os.path.expanduser("~"), ".getzwo", "crawl.sqlite")
+
+# links to anything else (images, downloads, feeds) are not pages to crawl
+PAGE_SUFFIXES = ("", ".html", ".htm", ".php")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seeds (
+    url TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    workouts INTEGER,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, id);
+"""
+
+
+def normalise_url(url):
+    """The URL without query and fragment, scheme and host in lower case.
+
+    The catalogue addresses every page by its path, so this keeps one entry
+    per page however it is linked.
+    """
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", "", ""))
+
+
+def in_scope(url, seed):
+    """True for pages on the host of seed, at or below its path."""
+    parts = urlsplit(url)
+    scope = urlsplit(seed)
+    if (parts.scheme, parts.netloc) != (scope.scheme, scope.netloc):
+        return False
+    if posixpath.splitext(parts.path)[1].lower() not in PAGE_SUFFIXES:
+        return False
+    prefix = scope.path.rstrip("/")
+    return parts.path == prefix or parts.path.startswith(prefix + "/")
+
+
+class CrawlFrontier:
+    """The pages of a crawl and how far it got, in one SQLite file.
+
+    Every URL is stored once, as pending, done or failed, in the order it
+    was discovered. A page is marked done together with the links found on
+    it in a single transaction, so the file is a checkpoint after every page:
+    an interrupted crawl resumes with the pages that were still pending, and
+    pages that failed are tried again.
+    """
+
+    def __init__(self, path=DEFAULT_CRAWL_STATE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        self._seeds = self.seeds()
+
+    def seeds(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT url FROM seeds ORDER BY rowid")]
+
+    def add_seeds(self, urls):
+        """Start crawling from urls; links below them are followed."""
+        urls = [normalise_url(url) for url in urls]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO seeds (url) VALUES (?)",
+                                 [(url,) for url in urls])
+            self._db.executemany("INSERT OR IGNORE INTO frontier (url) VALUES (?)",
+                                 [(url,) for url in urls])
+        self._seeds = self.seeds()
+
+    def in_scope(self, url):
+        return any(in_scope(url, seed) for seed in self._seeds)
+
+    def pending(self, limit=None):
+        """The pending URLs, oldest first."""
+        sql = "SELECT url FROM frontier WHERE state = 'pending' ORDER BY id"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            return [row[0] for row in self._db.execute(sql, params)]
+
+    def done(self, url, workouts, links=()):
+        """Mark url done and add the in-scope links found on it.
+
+        links may be relative to url. Returns the number of new pages.
+        """
+        urls = {normalise_url(urljoin(url, link)) for link in links}
+        new = [(link,) for link in sorted(urls) if self.in_scope(link)]
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO frontier (url) VALUES (?)", new)
+            added = self._db.total_changes - before
+            self._db.execute(
+                "UPDATE frontier SET state = 'done', workouts = ?, error = NULL, updated = ? "
+                "WHERE url = ?",
+                (workouts, time.time(), url),
+            )
+        return added
+
+    def failed(self, url, error):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE frontier SET state = 'failed', error = ?, updated = ? WHERE url = ?",
+                (str(error), time.time(), url),
+            )
+
+    def retry_failed(self):
+        """Make the pages that failed last time pending again."""
+        with self._lock, self._db:
+            return self._db.execute(
+                "UPDATE frontier SET state = 'pending' WHERE state = 'failed'"
+            ).rowcount
+
+    def reset(self):
+        """Forget the crawl, seeds and all."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM frontier")
+            self._db.execute("DELETE FROM seeds")
+        self._seeds = []
+
+    def counts(self):
+        """Number of pages per state, and the workouts found so far."""
+        counts = {"pending": 0, "done": 0, "failed": 0}
+        with self._lock:
+            for state, n in self._db.execute(
+                "SELECT state, count(*) FROM frontier GROUP BY state"
+            ):
+                counts[state] = n
+            counts["workouts"] = self._db.execute(
+                "SELECT coalesce(sum(workouts), 0) FROM frontier"
+            ).fetchone()[0]
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,161 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from ZwoModel import ZONE_NAMES, dominant_zone
+
+DEFAULT_LIBRARY = os.path.join(os.path.expanduser("~"), ".getzwo", "library.sqlite")
+
+ZONE_COLUMNS = [name.lower() for name in ZONE_NAMES]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS workouts (
+    id INTEGER PRIMARY KEY,
+    plan TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    duration INTEGER NOT NULL,
+    average REAL NOT NULL,
+    normalized REAL NOT NULL,
+    intensity REAL NOT NULL,
+    tss REAL NOT NULL,
+    {", ".join(f"{column} INTEGER NOT NULL" for column in ZONE_COLUMNS)},
+    free_ride INTEGER NOT NULL,
+    zone TEXT,
+    document TEXT NOT NULL,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS workouts_plan ON workouts (plan);
+CREATE INDEX IF NOT EXISTS workouts_duration ON workouts (duration);
+CREATE INDEX IF NOT EXISTS workouts_intensity ON workouts (intensity);
+CREATE INDEX IF NOT EXISTS workouts_tss ON workouts (tss);
+CREATE INDEX IF NOT EXISTS workouts_zone ON workouts (zone, duration);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS workouts_text USING fts5(
+    title, description, content='workouts', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS workouts_insert AFTER INSERT ON workouts BEGIN
+    INSERT INTO workouts_text (rowid, title, description)
+    VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS workouts_delete AFTER DELETE ON workouts BEGIN
+    INSERT INTO workouts_text (workouts_text, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+END;
+"""
+
+COLUMNS = (
+    ["plan", "filename", "title", "description", "duration", "average",
+     "normalized", "intensity", "tss"]
+    + ZONE_COLUMNS + ["free_ride", "zone", "document", "added"]
+)
+# everything but the document, for listings
+SUMMARY_COLUMNS = ["id"] + [column for column in COLUMNS if column != "document"]
+
+
+def text_query(text):
+    """FTS5 query matching every word of text as a prefix, never a syntax error."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class WorkoutLibrary:
+    """Every converted workout in one SQLite file, indexed for quick queries.
+
+    Workouts are stored per source plan (the page URL) with their stats and
+    .zwo document, so they can be searched by duration, intensity, dominant
+    zone, plan and full text of title and description, and exported again
+    without downloading anything. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_LIBRARY):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def replace_plan(self, plan, documents):
+        """Store the Documents of a plan in place of the ones stored before."""
+        added = time.time()
+        rows = [
+            (plan, document.filename, document.title, document.description,
+             document.stats.duration, document.stats.average,
+             document.stats.normalized, document.stats.intensity,
+             document.stats.tss, *document.stats.zones,
+             document.stats.free_ride, dominant_zone(document.stats.zones),
+             document.text, added)
+            for document in documents
+        ]
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM workouts WHERE plan = ?", (plan,))
+            self._db.executemany(
+                f"INSERT INTO workouts ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+
+    def query(self, text=None, duration=None, intensity=None, zone=None,
+              plan=None, limit=None, documents=False):
+        """Return the matching workouts as sqlite3.Row objects.
+
+        duration (seconds) and intensity (IF) are (low, high) ranges where
+        either end may be None. With text the best matches come first,
+        otherwise the workouts are ordered by plan and title. The .zwo
+        document is only included if documents is true.
+        """
+        columns = SUMMARY_COLUMNS + (["document"] if documents else [])
+        sql = f"SELECT {', '.join('w.' + column for column in columns)} FROM workouts w"
+        where = []
+        params = []
+        if text and text_query(text):
+            sql += " JOIN workouts_text ON workouts_text.rowid = w.id"
+            where.append("workouts_text MATCH ?")
+            params.append(text_query(text))
+        for column, bounds in (("duration", duration), ("intensity", intensity)):
+            low, high = bounds or (None, None)
+            if low is not None:
+                where.append(f"w.{column} >= ?")
+                params.append(low)
+            if high is not None:
+                where.append(f"w.{column} <= ?")
+                params.append(high)
+        if zone:
+            where.append("w.zone = ?")
+            params.append(zone)
+        if plan:
+            where.append("w.plan LIKE ?")
+            params.append(f"%{plan}%")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if text and text_query(text):
+            sql += " ORDER BY workouts_text.rank"
+        else:
+            sql += " ORDER BY w.plan, w.title"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM workouts").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,174 @@
+import hashlib
+from collections import namedtuple
+
+RAMP = "ramp"
+STEADY = "steady"
+INTERVALS = "intervals"
+FREE_RIDE = "free_ride"
+
+# Zwift power zones, see ZwoStats.ZONE_BOUNDS
+ZONE_NAMES = ["Z1", "Z2", "Z3", "Z4", "Z5", "Z6"]
+
+# steps are Step objects once parsed, page nodes or texts before that
+Workout = namedtuple("Workout", ["title", "description", "steps"])
+# a converted workout, ready to be written: the .zwo text, its WorkoutStats
+# and the steps_key of its steps (None if unknown), which dedup links on
+Document = namedtuple(
+    "Document", ["filename", "text", "title", "description", "stats", "key"],
+    defaults=[None],
+)
+
+
+class Step:
+    """One block of a workout, independent of the output format.
+
+    Powers are fractions of FTP; a steady block has power_low == power_high
+    and a free ride has no power at all. For intervals duration, power_low
+    and cadence describe the on part, the off_* fields the off part, and
+    reps the number of on/off pairs. Durations are in seconds.
+
+    Parsed steps are shared between workouts (see GetZwo.parse_step_text),
+    so treat them as immutable.
+    """
+
+    __slots__ = (
+        "kind",
+        "duration",
+        "power_low",
+        "power_high",
+        "cadence",
+        "reps",
+        "off_duration",
+        "off_power",
+        "off_cadence",
+    )
+
+    def __init__(self, kind, duration, power_low=None, power_high=None,
+                 cadence=None, reps=1, off_duration=0, off_power=None,
+                 off_cadence=None):
+        self.kind = kind
+        self.duration = duration
+        self.power_low = power_low
+        self.power_high = power_high
+        self.cadence = cadence
+        self.reps = reps
+        self.off_duration = off_duration
+        self.off_power = off_power
+        self.off_cadence = off_cadence
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Step):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}" for name in self.__slots__[1:]
+            if getattr(self, name) is not None
+        )
+        return f"Step({self.kind!r}, {fields})"
+
+    @property
+    def total_duration(self):
+        if self.kind == INTERVALS:
+            return self.reps * (self.duration + self.off_duration)
+        return self.duration
+
+
+def steady_part(step):
+    return step.duration, step.power_low, step.cadence
+
+
+def interval_parts(step):
+    """The on and off part of intervals, each as (duration, power, cadence)."""
+    return (step.duration, step.power_low, step.cadence), \
+        (step.off_duration, step.off_power, step.off_cadence)
+
+
+def foldable(on, off):
+    """True if steady steps on and off can be the two parts of intervals.
+
+    IntervalsT only has a cadence when both parts have one.
+    """
+    return (
+        on.kind == STEADY and off.kind == STEADY and on != off
+        and bool(on.cadence) == bool(off.cadence)
+    )
+
+
+def fold_repeats(steps):
+    """Fold runs of alternating steady steps into intervals.
+
+    Two or more on/off pairs in a row become one intervals step, and pairs
+    or intervals right after intervals with the same parts are added to its
+    reps. The second-by-second power stays the same; a single pair is left
+    as it is. Every step is looked at a constant number of times.
+    """
+    folded = []
+    i = 0
+    count = len(steps)
+    while i < count:
+        step = steps[i]
+        if step.kind == INTERVALS:
+            parts = interval_parts(step)
+            reps = step.reps
+            j = i + 1
+        elif i + 1 < count and foldable(step, steps[i + 1]):
+            parts = steady_part(step), steady_part(steps[i + 1])
+            reps = 1
+            j = i + 2
+        else:
+            folded.append(step)
+            i += 1
+            continue
+        while j < count:
+            following = steps[j]
+            if following.kind == INTERVALS and interval_parts(following) == parts:
+                reps += following.reps
+                j += 1
+            elif (j + 1 < count and foldable(following, steps[j + 1])
+                  and (steady_part(following), steady_part(steps[j + 1])) == parts):
+                reps += 1
+                j += 2
+            else:
+                break
+        if step.kind == STEADY and reps == 1:
+            folded.append(step)
+            i += 1
+            continue
+        if step.kind == INTERVALS and reps == step.reps:
+            folded.append(step)
+        else:
+            (on, on_power, on_cadence), (off, off_power, off_cadence) = parts
+            folded.append(Step(INTERVALS, on, on_power, on_power, on_cadence, reps=reps,
+                               off_duration=off, off_power=off_power, off_cadence=off_cadence))
+        i = j
+    return folded
+
+
+def steps_key(steps):
+    """Hash of what a workout asks the rider to do.
+
+    Title and description don't count, and on/off runs hash like the
+    intervals they fold into, so copies of a workout match however they
+    were written.
+    """
+    canonical = repr([step.astuple() for step in fold_repeats(steps)])
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def workout_duration(steps):
+    return sum(step.total_duration for step in steps)
+
+
+def dominant_zone(zones):
+    """Name of the zone with the most time in it, None if there is none."""
+    if not any(zones):
+        return None
+    return ZONE_NAMES[max(range(len(zones)), key=zones.__getitem__)]
@@ -0,0 +1,517 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from collections import Counter
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def unique_name(filename, taken):
+    """Return filename, or "name (2).ext", "name (3).ext", ... if it is taken."""
+    name = filename
+    stem, ext = os.path.splitext(filename)
+    n = 2
+    while name in taken:
+        name = f"{stem} ({n}){ext}"
+        n += 1
+    taken.add(name)
+    return name
+
+
+class BodyIndex:
+    """The documents a writer stored, by dedup key, for dedup.
+
+    The key of a workout is the ZwoModel.steps_key of its steps, computed
+    when it was converted, so the same workout under another title is a
+    link too (and shows the title of the file it links to); other files
+    are keyed by their content hash. files maps every stored name to its
+    key, content hash and, for a file on disk, its (size, mtime) stamp.
+
+    stats counts the files written, the different documents stored, the
+    duplicates linked to them (retitled: under another title) and the bytes
+    that linking saved, and the files that already held the same document
+    (unchanged); links lists (duplicate, stored file, same) for the report,
+    same being "file" or "steps".
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stored = {}
+        self.files = {}
+        self.links = []
+        self.stats = dict.fromkeys(
+            ["files", "unique", "linked", "retitled", "saved", "unchanged"], 0
+        )
+
+    def lookup(self, key):
+        """The name that holds key and its files entry, (None, None) if none does."""
+        with self.lock:
+            name = self.stored.get(key)
+            return name, self.files.get(name)
+
+    def remember(self, key, digest, name, stamp=None):
+        """name now holds the document with key and digest (and nothing else)."""
+        with self.lock:
+            old = self.files.get(name)
+            if old is not None and old[0] != key and self.stored.get(old[0]) == name:
+                del self.stored[old[0]]
+            self.files[name] = (key, digest, stamp)
+            self.stored.setdefault(key, name)
+
+    def forget(self, key, name):
+        with self.lock:
+            if self.stored.get(key) == name:
+                del self.stored[key]
+
+    def count(self, name, size, original=None, same="file"):
+        with self.lock:
+            self.stats["files"] += 1
+            if original is None:
+                self.stats["unique"] += 1
+            elif original == name:
+                self.stats["unchanged"] += 1
+            else:
+                self.stats["linked"] += 1
+                self.stats["saved"] += size
+                if same == "steps":
+                    self.stats["retitled"] += 1
+                self.links.append((name, original, same))
+
+
+def write_links_report(path, index, root=""):
+    """Write the duplicates of a dedup run as CSV.
+
+    Every row is a file, the file it is a link to and what they share:
+    "file" for the same document, "steps" for the same workout under
+    another title.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "same_as", "same"])
+        for name, original, same in index.links:
+            writer.writerow([os.path.relpath(name, root) if root else name,
+                             os.path.relpath(original, root) if root else original,
+                             same])
+
+
+def file_stamp(path):
+    info = os.stat(path)
+    return info.st_size, info.st_mtime_ns
+
+
+class DirectoryWriter:
+    """Writes every workout to its own file in one directory.
+
+    The directory is created once, and every file is written to a temporary
+    name first and renamed into place, so a crash never leaves half a file.
+    Filenames may have a folder in front ("rider/workout.erg"), which is
+    created on first use.
+
+    With dedup, a workout with the same steps as one written before (key,
+    see BodyIndex) is a hard link to that file instead of a copy. Files are
+    replaced by renaming, never rewritten in place, so rewriting one of them
+    leaves its links as they are. The index of the stored files is kept in
+    DEDUP_FILE by close(), so later runs link to them without reading them;
+    a file changed since is not linked to.
+    """
+
+    def __init__(self, path, dedup=False):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._folders = {path}
+        self.dedup = BodyIndex() if dedup else None
+        if dedup:
+            self._load_index()
+
+    def write(self, filename, document, key=None):
+        if self.dedup is not None:
+            return self._write_once(filename, document, key)
+        return self.write_to(filename, lambda f: f.write(document))
+
+    def write_to(self, filename, serialise, key=None):
+        """Let serialise(f) write the document straight into the file."""
+        if self.dedup is not None:
+            return self._write_once(filename, buffered(serialise), key)
+        target, tmp = self._target(filename)
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                serialise(f)
+            os.replace(tmp, target)
+        except BaseException:
+            # open() may have failed before there was a file
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            raise
+        return target
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.path, DEDUP_FILE), encoding="utf-8") as f:
+                files = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for name, (key, digest, stamp) in files.items():
+            self.dedup.remember(key, digest, os.path.join(self.path, name), tuple(stamp))
+
+    def _save_index(self):
+        path = os.path.join(self.path, DEDUP_FILE)
+        with self.dedup.lock:
+            files = {
+                os.path.relpath(name, self.path): entry
+                for name, entry in self.dedup.files.items()
+            }
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(files, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _target(self, filename):
+        target = os.path.join(self.path, filename)
+        folder, name = os.path.split(target)
+        if folder not in self._folders:
+            os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
+        tmp = os.path.join(
+            folder, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        return target, tmp
+
+    def _intact(self, name, entry):
+        """True if name still holds what the index says."""
+        try:
+            return file_stamp(name) == entry[2]
+        except OSError:
+            return False
+
+    def _write_once(self, filename, document, key=None):
+        data = document.encode("utf-8")
+        digest = content_hash(data)
+        key = key or digest
+        target, tmp = self._target(filename)
+        original, entry = self.dedup.lookup(key)
+        if original is not None and not self._intact(original, entry):
+            # removed or changed by something else since
+            self.dedup.forget(key, original)
+            original = None
+        same = "file" if entry is not None and entry[1] == digest else "steps"
+        if original == target:
+            if same == "file":
+                self.dedup.count(target, len(data), original)
+                return target
+            # the same workout under a new title, that is this file's own
+            original = None
+        if original is not None and os.path.lexists(target) and os.path.samefile(original, target):
+            # a link to it already, from an earlier run
+            self.dedup.remember(key, entry[1], target, entry[2])
+            self.dedup.count(target, len(data), target)
+            return target
+        if original is not None:
+            try:
+                os.link(original, tmp)
+                os.replace(tmp, target)
+            except OSError:
+                # a file system without hard links
+                self.dedup.forget(key, original)
+                original = None
+            # renaming onto a link to the same file does nothing
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+        if original is None:
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(document)
+                os.replace(tmp, target)
+            except BaseException:
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                raise
+            self.dedup.remember(key, digest, target, file_stamp(target))
+        else:
+            self.dedup.remember(key, entry[1], target, entry[2])
+        self.dedup.count(target, len(data), original, same)
+        return target
+
+    def close(self):
+        if self.dedup is not None:
+            self._save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveWriter:
+    """Streams all workouts of a run into one .zip, .tar or .tar.gz file.
+
+    With dedup, a workout with the same steps as one already in the archive
+    (see BodyIndex) is only stored once: a tar gets a hard link member, a
+    zip lists the duplicates and the stored member they stand for in
+    LINKS_FILE.
+    """
+
+    def __init__(self, path, dedup=False):
+        self.path = path
+        self.dedup = BodyIndex() if dedup else None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._names = set()
+        if path.endswith(".zip"):
+            self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+            self._tar = None
+        elif path.endswith((".tar.gz", ".tgz")):
+            self._zip = None
+            self._tar = tarfile.open(path, "w:gz")
+        elif path.endswith(".tar"):
+            self._zip = None
+            self._tar = tarfile.open(path, "w")
+        else:
+            raise ValueError(f"{path}: archive must end in .zip, .tar, .tar.gz or .tgz")
+
+    def write(self, filename, document, key=None):
+        data = document.encode("utf-8")
+        digest = content_hash(data) if self.dedup is not None else None
+        with self._lock:
+            name = unique_name(filename, self._names)
+            original = entry = None
+            if digest:
+                key = key or digest
+                original, entry = self.dedup.lookup(key)
+            if self._zip is not None:
+                if original is None:
+                    self._zip.writestr(name, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.mtime = int(time.time())
+                if original is not None:
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = original
+                    self._tar.addfile(info)
+                else:
+                    info.size = len(data)
+                    self._tar.addfile(info, io.BytesIO(data))
+        if digest:
+            self.dedup.remember(key, digest if original is None else entry[1], name)
+            self.dedup.count(name, len(data), original,
+                             "file" if original is None or entry[1] == digest else "steps")
+        return f"{self.path}:{name}"
+
+    def write_to(self, filename, serialise, key=None):
+        return self.write(filename, buffered(serialise), key)
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                if self.dedup is not None and self.dedup.links:
+                    links = {name: original for name, original, _ in self.dedup.links}
+                    self._zip.writestr(unique_name(LINKS_FILE, self._names),
+                                       json.dumps(links, indent=1, ensure_ascii=False))
+                self._zip.close()
+            else:
+                self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def buffered(serialise):
+    f = io.StringIO()
+    serialise(f)
+    return f.getvalue()
+
+
+def open_writer(outdir, archive=None, dedup=False):
+    if archive:
+        return ArchiveWriter(archive, dedup)
+    return DirectoryWriter(outdir, dedup)
+
+
+MANIFEST_FILE = ".getzwo-manifest.json"
+# the manifest is written at most this often (seconds) while pages come in,
+# and on close()
+MANIFEST_INTERVAL = 5.0
+# in a deduplicated zip: {duplicate: stored member}
+LINKS_FILE = ".getzwo-links.json"
+# in a deduplicated directory: {file: [key, content hash, [size, mtime]]}
+DEDUP_FILE = ".getzwo-dedup.json"
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class SyncWriter:
+    """Incremental export into one directory, driven by a manifest.
+
+    The manifest records, per source URL, the hash of the page and of every
+    workout written from it. Unchanged pages are skipped, unchanged workouts
+    are not rewritten, and files of workouts that disappeared from a page are
+    removed. The manifest is only trusted for the same converter version.
+
+    salt stands for whatever else the files of a page depend on (the riders
+    and formats rendered); when it changes every page counts as changed, so
+    files that are no longer made are removed.
+
+    With dedup, duplicates are hard links, see DirectoryWriter, also to the
+    files of earlier runs.
+
+    The manifest is saved every MANIFEST_INTERVAL seconds and by close(),
+    so a page costs the same however many pages came before it. After a
+    crash the pages of the last few seconds count as changed.
+    """
+
+    def __init__(self, path, version, salt="", dedup=False):
+        self.directory = DirectoryWriter(path, dedup)
+        self.path = os.path.join(path, MANIFEST_FILE)
+        self.version = version
+        self.salt = salt
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(
+            ["pages_skipped", "written", "unchanged", "removed"], 0
+        )
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        if manifest.get("version") != version:
+            manifest = {"version": version, "pages": {}}
+        self.pages = manifest["pages"]
+        # how many pages list every file, a file is removed when none does
+        self._users = Counter(
+            filename for entry in self.pages.values() for filename in entry["workouts"]
+        )
+        self._saved = time.monotonic()
+
+    def page_key(self, page_hash):
+        if not self.salt or page_hash is None:
+            return page_hash
+        return content_hash(page_hash + self.salt)
+
+    def unchanged(self, url, page_hash):
+        """True if url was exported from the same page and its files are all there."""
+        page_hash = self.page_key(page_hash)
+        with self._lock:
+            entry = self.pages.get(url)
+            if entry is None or entry["page_hash"] != page_hash:
+                return False
+            if not all(
+                os.path.isfile(os.path.join(self.directory.path, filename))
+                for filename in entry["workouts"]
+            ):
+                return False
+            self.stats["pages_skipped"] += 1
+            return True
+
+    def page(self, url, page_hash=None):
+        return PageSync(self, url, page_hash)
+
+    def _finish(self, url, page_hash, workouts):
+        with self._lock:
+            old = self.pages.get(url, {"workouts": {}})["workouts"]
+            self.pages[url] = {"page_hash": page_hash, "workouts": workouts}
+            self._users.update(workouts.keys())
+            self._users.subtract(old.keys())
+            for filename in old:
+                if self._users[filename] > 0:
+                    continue
+                del self._users[filename]
+                target = os.path.join(self.directory.path, filename)
+                try:
+                    os.remove(target)
+                    self.stats["removed"] += 1
+                except FileNotFoundError:
+                    pass
+                # e.g. the folder of a rider that left the roster, or of a
+                # crawled plan and the folders it was in
+                folder = os.path.dirname(target)
+                while folder != self.directory.path:
+                    try:
+                        os.rmdir(folder)
+                    except OSError:
+                        break
+                    self.directory._folders.discard(folder)
+                    folder = os.path.dirname(folder)
+            if time.monotonic() - self._saved >= MANIFEST_INTERVAL:
+                self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "pages": self.pages}, f, indent=1)
+        os.replace(tmp, self.path)
+        self._saved = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._save()
+        self.directory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PageSync:
+    """Writer for the workouts of one page, see SyncWriter.page."""
+
+    def __init__(self, sync, url, page_hash):
+        self.sync = sync
+        self.url = url
+        self.page_hash = page_hash
+        self._hasher = None
+        with sync._lock:
+            self.old = dict(sync.pages.get(url, {"workouts": {}})["workouts"])
+        self.workouts = {}
+
+    def track(self, chunks):
+        """Pass chunks through while hashing them, for pages that are streamed."""
+        self._hasher = hashlib.sha256()
+        for chunk in chunks:
+            self._hasher.update(chunk)
+            yield chunk
+
+    def write(self, filename, document, key=None):
+        digest = content_hash(document)
+        target = os.path.join(self.sync.directory.path, filename)
+        self.workouts[filename] = digest
+        if self.old.get(filename) == digest and os.path.isfile(target):
+            with self.sync._lock:
+                self.sync.stats["unchanged"] += 1
+            return target
+        self.sync.directory.write(filename, document, key)
+        with self.sync._lock:
+            self.sync.stats["written"] += 1
+        return target
+
+    def write_to(self, filename, serialise, key=None):
+        # the document is hashed before it is written, so keep it in memory
+        return self.write(filename, buffered(serialise), key)
+
+    def close(self):
+        if self._hasher is not None:
+            self.page_hash = self._hasher.hexdigest()
+        self.sync._finish(self.url, self.sync.page_key(self.page_hash), self.workouts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # a failed conversion must not remove the files of the last good run
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# error is set when the page failed, stage tells where ("fetch" or "convert")
+PageResult = namedtuple("PageResult", ["url", "content", "result", "error", "stage"])
+
+# how often blocked stages look whether the run was abandoned
+POLL_INTERVAL = 0.1
+
+
+def default_parse_workers(pages):
+    """One parse process per core, none at all (convert in a thread) for a single page."""
+    if pages < 2:
+        return 0
+    return min(os.cpu_count() or 1, pages)
+
+
+class Pipeline:
+    """Fetch, convert and hand back pages in three overlapping stages.
+
+    fetch_workers threads call fetch(url) and put the pages on a bounded
+    queue. A dispatcher thread hands them to convert(content) in a pool of
+    parse_workers processes (0 converts in the dispatcher thread instead),
+    and run() yields a PageResult for every converted page in the calling
+    thread, which is where the writing happens. At most queue_size fetched
+    pages wait for a parse process and at most queue_size converted pages
+    wait for the writer, so memory stays flat however many URLs there are:
+    a slow writer stalls the parsers and slow parsers stall the downloads.
+
+    convert must be a picklable module-level function when parse_workers > 0.
+    skip(url, content) may return True to drop a page before it is converted.
+    initializer runs once in every parse process.
+    """
+
+    def __init__(self, fetch, convert, fetch_workers=8, parse_workers=0,
+                 queue_size=16, skip=None, initializer=None):
+        if fetch_workers < 1:
+            raise ValueError("fetch_workers must be at least 1")
+        if parse_workers < 0:
+            raise ValueError("parse_workers can't be negative")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        self.fetch = fetch
+        self.convert = convert
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.skip = skip
+        self.initializer = initializer
+
+    def run(self, urls):
+        urls = list(urls)
+        todo = queue.Queue()
+        for url in urls:
+            todo.put(url)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        results = queue.Queue()
+        # one slot per page that is converting or waiting for the writer
+        slots = threading.BoundedSemaphore(self.queue_size)
+        stop = threading.Event()
+        pool = None
+        if self.parse_workers:
+            pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers, initializer=self.initializer
+            )
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetcher():
+            while not stop.is_set():
+                try:
+                    url = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    page = PageResult(url, self.fetch(url), None, None, None)
+                except Exception as e:
+                    page = PageResult(url, None, None, e, "fetch")
+                if not put(fetched, page):
+                    return
+
+        def finished(page, future):
+            try:
+                results.put(page._replace(result=future.result()))
+            except Exception as e:
+                results.put(page._replace(error=e, stage="convert"))
+
+        def dispatcher():
+            for _ in urls:
+                page = None
+                while page is None and not stop.is_set():
+                    try:
+                        page = fetched.get(timeout=POLL_INTERVAL)
+                    except queue.Empty:
+                        pass
+                if page is None:
+                    return
+                while not slots.acquire(timeout=POLL_INTERVAL):
+                    if stop.is_set():
+                        return
+                if page.error is not None:
+                    results.put(page)
+                    continue
+                # every page gets exactly one result, also when skip fails or
+                # the pool broke (a parse process died), or run() would wait
+                # for it forever
+                try:
+                    if self.skip is not None and self.skip(page.url, page.content):
+                        slots.release()
+                        results.put(None)
+                    elif pool is not None:
+                        future = pool.submit(self.convert, page.content)
+                        future.add_done_callback(lambda f, page=page: finished(page, f))
+                    else:
+                        results.put(page._replace(result=self.convert(page.content)))
+                except Exception as e:
+                    results.put(page._replace(error=e, stage="convert"))
+
+        threads = [
+            threading.Thread(target=fetcher, daemon=True)
+            for _ in range(min(self.fetch_workers, len(urls)))
+        ]
+        threads.append(threading.Thread(target=dispatcher, daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in urls:
+                page = results.get()
+                if page is None:
+                    continue
+                try:
+                    yield page
+                finally:
+                    slots.release()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
@@ -0,0 +1,217 @@
+import csv
+import itertools
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+import RunMetrics
+from ZwoModel import FREE_RIDE, INTERVALS, RAMP, STEADY, Step, Workout, steps_key
+from ZwoStats import STATS_COLUMNS, stats_row, workouts_stats
+
+ZWO_SUFFIX = ".zwo"
+# files a reader process gets at a time: enough to make the stats one
+# vectorised pass and the inter-process traffic negligible
+READ_BATCH = 256
+
+# One file of an inventory. steps is the number of steps, key the
+# ZwoModel.steps_key of the workout; error is set instead of title, key and
+# stats when the file could not be read.
+InventoryRow = namedtuple(
+    "InventoryRow", ["path", "size", "title", "steps", "key", "stats", "error"]
+)
+
+# .zwo step elements, by lower-case tag
+RAMP_TAGS = ("warmup", "cooldown", "ramp")
+STEADY_TAGS = ("steadystate", "solidstate")
+FREE_RIDE_TAGS = ("freeride", "maxeffort")
+
+
+def number(attributes, *names, convert=float):
+    """The first of the attributes names that is present, as a number.
+
+    attributes have lower-case names, hand-made files aren't consistent.
+    """
+    for name in names:
+        value = attributes.get(name.lower())
+        if value is not None:
+            return convert(float(value))
+    return None
+
+
+def required(attributes, tag, *names):
+    value = number(attributes, *names)
+    if value is None:
+        raise ValueError(f"<{tag}> without {names[0]}")
+    return value
+
+
+def seconds(attributes, tag, *names):
+    return int(round(required(attributes, tag, *names)))
+
+
+def zwo_step(element):
+    """The Step of a child element of <workout>."""
+    tag = element.tag.lower()
+    attributes = {name.lower(): value for name, value in element.attrib.items()}
+    cadence = number(attributes, "Cadence", convert=round)
+    if tag in STEADY_TAGS:
+        power = required(attributes, element.tag, "Power", "PowerLow")
+        return Step(STEADY, seconds(attributes, element.tag, "Duration"), power, power, cadence)
+    if tag in RAMP_TAGS:
+        return Step(
+            RAMP,
+            seconds(attributes, element.tag, "Duration"),
+            required(attributes, element.tag, "PowerLow"),
+            required(attributes, element.tag, "PowerHigh"),
+            cadence,
+        )
+    if tag == "intervalst":
+        on_power = required(attributes, element.tag, "OnPower", "PowerOnHigh", "PowerOnLow")
+        return Step(
+            INTERVALS,
+            seconds(attributes, element.tag, "OnDuration"),
+            on_power,
+            on_power,
+            cadence,
+            reps=int(required(attributes, element.tag, "Repeat")),
+            off_duration=seconds(attributes, element.tag, "OffDuration"),
+            off_power=required(attributes, element.tag, "OffPower", "PowerOffLow", "PowerOffHigh"),
+            off_cadence=number(attributes, "CadenceResting", convert=round),
+        )
+    if tag in FREE_RIDE_TAGS:
+        return Step(FREE_RIDE, seconds(attributes, element.tag, "Duration"))
+    raise ValueError(f"unknown step <{element.tag}>")
+
+
+def read_zwo(source):
+    """The Workout of a .zwo file (a path or a binary file), with Steps.
+
+    The file is read element by element and every step is cleared once it
+    is converted, so memory doesn't grow with the length of the workout.
+    """
+    title = description = None
+    steps = []
+    for _, element in etree.iterparse(
+        source, events=("end",), remove_comments=True, remove_pis=True,
+        resolve_entities=False, no_network=True,
+    ):
+        parent = element.getparent()
+        if parent is None:
+            if element.tag != "workout_file":
+                raise ValueError(f"<{element.tag}> is not a workout file")
+        elif parent.tag == "workout":
+            steps.append(zwo_step(element))
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+        elif parent.getparent() is None:
+            if element.tag == "name":
+                title = element.text
+            elif element.tag == "description":
+                description = element.text
+    return Workout(title, description, steps)
+
+
+def zwo_files(paths):
+    """Yield the .zwo files in paths (files or directory trees) in order.
+
+    Directories are walked one at a time, the whole tree is never listed.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(ZWO_SUFFIX):
+                    yield os.path.join(root, filename)
+
+
+def inventory_batch(paths):
+    """The InventoryRows of paths; runs in a reader process."""
+    rows = []
+    workouts = []
+    with RunMetrics.timer("read"):
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                workout = read_zwo(path)
+            except (OSError, ValueError, etree.XMLSyntaxError) as e:
+                rows.append(InventoryRow(path, None, None, None, None, None, str(e)))
+                continue
+            rows.append(InventoryRow(path, size, workout.title, len(workout.steps),
+                                     steps_key(workout.steps), None, None))
+            workouts.append(workout.steps)
+    with RunMetrics.timer("stats"):
+        all_stats = iter(workouts_stats(workouts))
+    RunMetrics.count("files", len(paths))
+    RunMetrics.count("steps", sum(map(len, workouts)))
+    return [
+        row if row.error is not None else row._replace(stats=next(all_stats))
+        for row in rows
+    ]
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def inventory(paths, workers=0, batch_size=READ_BATCH):
+    """Yield an InventoryRow for every .zwo file in paths, in order.
+
+    Batches of files are read in a pool of workers processes (0 reads in
+    this one), with a couple of batches per process in flight so the walk
+    and the results stay small however many files there are. A single
+    batch is read here too, starting processes would take longer.
+    """
+    files = batches(zwo_files(paths), batch_size)
+    ahead = [batch for batch in (next(files, None), next(files, None)) if batch]
+    files = itertools.chain(ahead, files)
+    if not workers or len(ahead) < 2:
+        for batch in files:
+            yield from inventory_batch(batch)
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=RunMetrics.enable_worker if RunMetrics.enabled() else None,
+    ) as pool:
+        pending = deque()
+        for batch in files:
+            pending.append(pool.submit(RunMetrics.measured, inventory_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from collect(pending.popleft())
+        while pending:
+            yield from collect(pending.popleft())
+
+
+def collect(future):
+    rows, snapshot = future.result()
+    RunMetrics.merge(snapshot)
+    return rows
+
+
+INVENTORY_COLUMNS = ["path", "size", "steps", "key"] + STATS_COLUMNS + ["error"]
+
+
+def write_inventory(path, rows):
+    """Write InventoryRows as CSV while they come in; yields them on."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(INVENTORY_COLUMNS)
+        for row in rows:
+            if row.error is None:
+                stats = stats_row(row.title, row.stats)
+            else:
+                stats = [""] * len(STATS_COLUMNS)
+            writer.writerow([row.path, row.size, row.steps, row.key] + stats + [row.error])
+            yield row
@@ -0,0 +1,118 @@
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+from ZwoStats import FREE_RIDE_POWER, segments
+
+# formats rendered next to the .zwo files: .erg is in watts and written per
+# rider, .mrc is in percent of FTP like the .zwo and written once
+RENDER_FORMATS = ("erg", "mrc")
+
+Rider = namedtuple("Rider", ["name", "ftp"])
+
+
+def rider_folder(name):
+    """A folder name for a rider, without path separators."""
+    folder = name.replace("/", "_").replace("\\", "_").strip().strip(".")
+    return folder or "rider"
+
+
+def read_roster(path):
+    """The Riders in a CSV file with "name" and "ftp" columns (FTP in watts)."""
+    riders = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        columns = {(column or "").strip().lower(): column for column in reader.fieldnames or ()}
+        if "name" not in columns or "ftp" not in columns:
+            raise ValueError(f"{path}: needs a name and an ftp column")
+        for line, row in enumerate(reader, 2):
+            name = (row[columns["name"]] or "").strip()
+            text = (row[columns["ftp"]] or "").strip()
+            if not name and not text:
+                continue
+            try:
+                ftp = float(text)
+            except ValueError:
+                raise ValueError(f"{path}:{line}: FTP {text!r} is not a number") from None
+            if not name or ftp <= 0:
+                raise ValueError(f"{path}:{line}: every rider needs a name and a positive FTP")
+            riders.append(Rider(name, ftp))
+    folders = [rider_folder(rider.name) for rider in riders]
+    if len(set(folders)) != len(folders):
+        raise ValueError(f"{path}: two riders have the same name")
+    return riders
+
+
+def profile_points(steps):
+    """Course points of a workout: minutes and fraction of FTP at the start and
+    end of every block, so ramps are straight lines between their two points.
+
+    Free rides are ridden at FREE_RIDE_POWER, like in the stats.
+    """
+    durations, starts, ends = segments(steps)
+    keep = durations > 0
+    durations, starts, ends = durations[keep], starts[keep], ends[keep]
+    starts = np.where(np.isnan(starts), FREE_RIDE_POWER, starts)
+    ends = np.where(np.isnan(ends), FREE_RIDE_POWER, ends)
+    t = np.cumsum(durations)
+    minutes = np.empty(2 * len(durations))
+    minutes[0::2] = (t - durations) / 60.0
+    minutes[1::2] = t / 60.0
+    power = np.empty(2 * len(durations))
+    power[0::2] = starts
+    power[1::2] = ends
+    return minutes, power
+
+
+def course_text(title, description, filename, columns, minutes, values, ftp=None):
+    lines = [
+        "[COURSE HEADER]",
+        "VERSION = 2",
+        "UNITS = ENGLISH",
+        "DESCRIPTION = " + " ".join(((title or "") + ". " + (description or "")).split()),
+        "FILE NAME = " + filename,
+    ]
+    if ftp is not None:
+        lines.append(f"FTP = {ftp:g}")
+    lines += [columns, "[END COURSE HEADER]", "[COURSE DATA]"]
+    lines += map("{}\t{}".format, minutes, values)
+    lines += ["[END COURSE DATA]", ""]
+    return "\n".join(lines)
+
+
+def render_plan(workouts, riders=(), formats=RENDER_FORMATS):
+    """Yield (filename, text) of the .erg and .mrc files of a plan.
+
+    workouts are (stem, title, description, steps). Every workout is laid
+    out once, and the watts of all riders for the whole plan are a single
+    outer product of their FTPs with the concatenated power profiles. The
+    .erg files go to a folder per rider.
+    """
+    points = [profile_points(steps) for _, _, _, steps in workouts]
+    bounds = np.cumsum([0] + [len(minutes) for minutes, _ in points])
+    power = np.concatenate([p for _, p in points]) if points else np.zeros(0)
+    ftps = np.array([rider.ftp for rider in riders], dtype=np.float64)
+    watts = np.rint(np.multiply.outer(ftps, power)).astype(np.int64).tolist()
+    percent = np.round(power * 100.0, 1).tolist()
+    folders = [rider_folder(rider.name) for rider in riders]
+    for i, (stem, title, description, _) in enumerate(workouts):
+        start, end = bounds[i], bounds[i + 1]
+        # the same minutes for every rider, formatted once
+        minutes = [f"{m:.2f}" for m in points[i][0].tolist()]
+        if "mrc" in formats:
+            yield stem + ".mrc", course_text(
+                title, description, stem + ".mrc", "MINUTES PERCENT",
+                minutes, [f"{p:g}" for p in percent[start:end]],
+            )
+        if "erg" in formats:
+            for rider, folder, rider_watts in zip(riders, folders, watts):
+                yield folder + "/" + stem + ".erg", course_text(
+                    title, description, stem + ".erg", "MINUTES WATTS",
+                    minutes, rider_watts[start:end], rider.ftp,
+                )
+
+
+def render_fingerprint(riders, formats):
+    """Changes whenever the rendered files would, for the --sync manifest."""
+    return ",".join(sorted(formats)) + ";" + ";".join(f"{r.name}={r.ftp:g}" for r in riders)
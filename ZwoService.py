@@ -0,0 +1,286 @@
+import io
+import json
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+
+import requests
+
+import RunMetrics
+from HttpCache import CacheMiss
+from ZwoModel import Document, Step, steps_key
+from ZwoOutput import content_hash, unique_name
+from ZwoStats import WorkoutStats
+
+DEFAULT_PORT = 8770
+DEFAULT_SERVICE_CACHE = 64 * 1024 * 1024
+# converted plans older than this are checked against the origin again
+DEFAULT_MAX_AGE = 300.0
+DEFAULT_ALLOWED_HOSTS = ("whatsonzwift.com",)
+
+
+class Plan:
+    """A converted plan as the service sends it: JSON, a zip and the single files."""
+
+    def __init__(self, url, page_hash, documents, steps):
+        self.url = url
+        self.page_hash = page_hash
+        self.documents = documents
+        self.json = json.dumps(plan_json(page_hash, documents, steps)).encode("utf-8")
+        # the names in the zip, which /workout.zwo takes as well
+        self.files = {}
+        taken = set()
+        for document in documents:
+            self.files[unique_name(document.filename, taken)] = document
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for filename, document in self.files.items():
+                archive.writestr(filename, document.text)
+        self.zip = buffer.getvalue()
+        self.size = len(self.json) + len(self.zip)
+        self.checked = time.monotonic()
+
+
+def plan_json(page_hash, documents, steps):
+    return {
+        "hash": page_hash,
+        "workouts": [
+            {
+                "filename": document.filename,
+                "title": document.title,
+                "description": document.description,
+                "stats": document.stats._asdict(),
+                "steps": [step.astuple() for step in workout_steps],
+                "document": document.text,
+            }
+            for document, workout_steps in zip(documents, steps)
+        ],
+    }
+
+
+def decode_plan(data):
+    """(page hash, Documents, step lists) of a plan from the service's JSON.
+
+    Raises ValueError if the service could not convert the page.
+    """
+    if "error" in data:
+        raise ValueError(data["error"])
+    documents = []
+    steps = []
+    for workout in data["workouts"]:
+        stats = dict(workout["stats"], zones=tuple(workout["stats"]["zones"]))
+        workout_steps = [Step(*fields) for fields in workout["steps"]]
+        documents.append(Document(
+            workout["filename"],
+            workout["document"],
+            workout["title"],
+            workout["description"],
+            WorkoutStats(**stats),
+            steps_key(workout_steps),
+        ))
+        steps.append(workout_steps)
+    return data["hash"], documents, steps
+
+
+class PlanCache:
+    """Converted plans by URL, in a least recently used cache of max_bytes.
+
+    fetch(url) returns the page (through the disk cache, so an unchanged
+    page costs a 304) and convert(content) its (Documents, step lists).
+    Concurrent requests for a plan that is not cached wait for one shared
+    conversion. A plan older than max_age is fetched again but only
+    converted again if the page changed.
+    """
+
+    def __init__(self, fetch, convert, max_bytes=DEFAULT_SERVICE_CACHE,
+                 max_age=DEFAULT_MAX_AGE):
+        self.fetch = fetch
+        self.convert = convert
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "revalidated": 0, "evicted": 0}
+        self._plans = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        leader = False
+        with self._lock:
+            plan = self._plans.get(url)
+            if plan is not None and time.monotonic() - plan.checked < self.max_age:
+                self._plans.move_to_end(url)
+                self.stats["hits"] += 1
+                return plan
+            flight = self._flights.get(url)
+            if flight is None:
+                flight = self._flights[url] = Future()
+                leader = True
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return flight.result()
+        try:
+            plan = self._load(url, plan)
+            flight.set_result(plan)
+            return plan
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[url]
+
+    def _load(self, url, stale):
+        content = self.fetch(url)
+        page_hash = content_hash(content)
+        if stale is not None and stale.page_hash == page_hash:
+            stale.checked = time.monotonic()
+            with self._lock:
+                self.stats["revalidated"] += 1
+                if url in self._plans:
+                    self._plans.move_to_end(url)
+            return stale
+        documents, steps = self.convert(content)
+        plan = Plan(url, page_hash, documents, steps)
+        with self._lock:
+            self.stats["misses"] += 1
+            old = self._plans.pop(url, None)
+            if old is not None:
+                self.size -= old.size
+            # a plan bigger than the whole cache is served but not kept
+            if plan.size <= self.max_bytes:
+                self._plans[url] = plan
+                self.size += plan.size
+            while self.size > self.max_bytes:
+                _, old = self._plans.popitem(last=False)
+                self.size -= old.size
+                self.stats["evicted"] += 1
+        return plan
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, plans=len(self._plans), bytes=self.size,
+                        max_bytes=self.max_bytes)
+
+
+def host_allowed(url, allowed_hosts):
+    parts = urlsplit(url)
+    # hostname leaves out the port and user info of netloc, and is lower case
+    host = parts.hostname
+    if parts.scheme not in ("http", "https") or not host:
+        return False
+    if allowed_hosts is None:
+        return True
+    return any(
+        host == allowed or host.endswith("." + allowed)
+        for allowed in (allowed.lower() for allowed in allowed_hosts)
+    )
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """GET /plan.json, /plan.zip or /workout.zwo with ?url=<plan URL>, and /status.
+
+    /workout.zwo also takes file=<name of the .zwo in the plan>. Pages that
+    don't convert are a 422, or for /plan.json an {"error": ...} object, so
+    clients can tell them from a failed download (502, 404 if the page
+    doesn't exist).
+    """
+
+    server_version = "GetZwo"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        if parts.path == "/status":
+            self.send(200, "application/json",
+                      json.dumps(self.server.plans.status()).encode("utf-8"))
+            return
+        if parts.path not in ("/plan.json", "/plan.zip", "/workout.zwo"):
+            self.send_error(404, "unknown path")
+            return
+        url = query.get("url")
+        if not url:
+            self.send_error(400, "url missing")
+            return
+        if not host_allowed(url, self.server.allowed_hosts):
+            self.send_error(403, "host not allowed")
+            return
+        try:
+            plan = self.server.plans.get(url)
+        except (requests.RequestException, CacheMiss) as e:
+            # the service retried already; a page that doesn't exist is final
+            status = 404 if getattr(e, "status", None) in (404, 410) else 502
+            self.send_error(status, "download failed", str(e))
+            return
+        except Exception as e:
+            if parts.path == "/plan.json":
+                self.send(200, "application/json", json.dumps({"error": str(e)}).encode("utf-8"))
+            else:
+                self.send_error(422, "conversion failed", str(e))
+            return
+        if parts.path == "/plan.json":
+            self.send(200, "application/json", plan.json)
+            return
+        if not plan.documents:
+            self.send_error(404, "no workouts found")
+            return
+        if parts.path == "/plan.zip":
+            name = url.rstrip("/").rsplit("/", 1)[-1] or "workouts"
+            self.send(200, "application/zip", plan.zip, name + ".zip")
+        else:
+            document = plan.files.get(query.get("file"))
+            if document is None:
+                self.send_error(404, "no such workout in the plan")
+                return
+            self.send(200, "application/xml", document.text.encode("utf-8"), query["file"])
+
+    def send(self, status, content_type, body, filename=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if filename is not None:
+            self.send_header("Content-Disposition",
+                             f"attachment; filename*=UTF-8''{quote(filename)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ConversionService(ThreadingHTTPServer):
+    """Local HTTP service converting plans for several Apps and command lines.
+
+    Every request runs in its own thread, the conversions go through
+    plans, a PlanCache. Only plans on allowed_hosts are converted (None
+    allows any host), so the service can't be used to reach other servers.
+    """
+
+    daemon_threads = True
+    # a team's Apps asking at once must not wait for a SYN retry
+    request_queue_size = 64
+
+    def __init__(self, address, plans, allowed_hosts=DEFAULT_ALLOWED_HOSTS, verbose=False):
+        super().__init__(address, ServiceHandler)
+        self.plans = plans
+        self.allowed_hosts = allowed_hosts
+        self.verbose = verbose
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """Parse "port" or "host:port"."""
+    host, sep, port = text.rpartition(":")
+    return (host if sep and host else default_host), int(port)
+
+
+def fetch_plan(server, url, client):
+    """The JSON of a plan converted by the service at server, see decode_plan."""
+    with RunMetrics.timer("service"):
+        response = client.get(server.rstrip("/") + "/plan.json?" + urlencode({"url": url}))
+        return response.json()
@@ -0,0 +1,240 @@
+import mmap
+import os
+import zipfile
+import zlib
+from collections import namedtuple
+
+import RunMetrics
+
+HTML_SUFFIXES = (".html", ".htm")
+WARC_SUFFIXES = (".warc", ".warc.gz")
+
+# A saved page on disk. name identifies it in messages, the library and the
+# sync manifest (the original URL for WARC records). member is the entry of
+# a zip archive. For WARC records offset and length locate the HTTP response
+# in the file, or in the decompressed gzip member at gzip_member
+# (offset, length) of a .warc.gz.
+LocalPage = namedtuple(
+    "LocalPage",
+    ["name", "path", "member", "offset", "length", "gzip_member"],
+    defaults=[None, None, None, None],
+)
+
+
+def is_url(target):
+    return target.startswith(("http://", "https://"))
+
+
+def target_name(target):
+    return target.name if isinstance(target, LocalPage) else target
+
+
+def local_pages(path):
+    """The saved pages in a file, a directory tree, a zip or a WARC archive."""
+    if os.path.isdir(path):
+        pages = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(HTML_SUFFIXES + WARC_SUFFIXES + (".zip",)):
+                    pages += local_pages(os.path.join(root, filename))
+        return pages
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            return [
+                LocalPage(f"{path}/{info.filename}", path, info.filename)
+                for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(HTML_SUFFIXES)
+            ]
+    if lower.endswith(".warc.gz"):
+        return warc_gz_pages(path)
+    if lower.endswith(".warc"):
+        return warc_pages(path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"{path}: no such file or directory")
+    return [LocalPage(path, path)]
+
+
+def open_mmap(f):
+    # mmap can't map an empty file
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_headers(data):
+    """First line and lower-cased headers of a WARC or HTTP header block."""
+    lines = data.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+def warc_records(buffer, start=0, end=None):
+    """Yield (headers, block start, block end) of the WARC records in buffer."""
+    if end is None:
+        end = len(buffer)
+    pos = start
+    while pos < end:
+        # records are separated by blank lines
+        while buffer[pos:pos + 2] == b"\r\n":
+            pos += 2
+        if pos >= end:
+            return
+        header_end = buffer.find(b"\r\n\r\n", pos, end)
+        if header_end < 0:
+            raise ValueError(f"truncated WARC record at byte {pos}")
+        version, headers = parse_headers(buffer[pos:header_end])
+        if not version.startswith("WARC/"):
+            raise ValueError(f"no WARC record at byte {pos}")
+        block = header_end + 4
+        length = int(headers.get("content-length", 0))
+        yield headers, block, block + length
+        pos = block + length
+
+
+def html_response(buffer, headers, start, end):
+    """True for a WARC response record holding a successful HTML page."""
+    if headers.get("warc-type") != "response":
+        return False
+    if not headers.get("content-type", "").startswith("application/http"):
+        return False
+    header_end = buffer.find(b"\r\n\r\n", start, end)
+    if header_end < 0:
+        return False
+    status, http = parse_headers(buffer[start:header_end])
+    parts = status.split()
+    return (
+        len(parts) > 1 and parts[1] == "200"
+        and "html" in http.get("content-type", "html")
+    )
+
+
+def warc_pages(path):
+    with open(path, "rb") as f:
+        mm = open_mmap(f)
+        if mm is None:
+            return []
+        with mm:
+            return [
+                LocalPage(headers.get("warc-target-uri", path), path,
+                          offset=start, length=end - start)
+                for headers, start, end in warc_records(mm)
+                if html_response(mm, headers, start, end)
+            ]
+
+
+def warc_gz_pages(path, chunk_size=1024 * 1024):
+    # a .warc.gz is a series of gzip members, normally one per record; remember
+    # where every member starts so it can be decompressed on its own later
+    pages = []
+    with open(path, "rb") as f:
+        mm = open_mmap(f)
+        if mm is None:
+            return []
+        with mm:
+            offset = 0
+            while offset < len(mm):
+                inflate = zlib.decompressobj(31)
+                parts = []
+                pos = offset
+                while not inflate.eof and pos < len(mm):
+                    end = min(pos + chunk_size, len(mm))
+                    parts.append(inflate.decompress(mm[pos:end]))
+                    pos = end
+                if not inflate.eof:
+                    raise ValueError(f"{path}: truncated gzip member at byte {offset}")
+                member = (offset, pos - len(inflate.unused_data) - offset)
+                record = b"".join(parts)
+                pages += [
+                    LocalPage(headers.get("warc-target-uri", path), path,
+                              offset=start, length=end - start, gzip_member=member)
+                    for headers, start, end in warc_records(record)
+                    if html_response(record, headers, start, end)
+                ]
+                offset += member[1]
+    return pages
+
+
+def dechunk(data):
+    """Undo HTTP chunked transfer coding."""
+    out = []
+    pos = 0
+    while True:
+        line_end = data.index(b"\r\n", pos)
+        size = int(data[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            return b"".join(out)
+        out.append(data[line_end + 2:line_end + 2 + size])
+        pos = line_end + 2 + size + 2
+
+
+def http_body_chunks(buffer, start, end, chunk_size):
+    """The body of the HTTP response at buffer[start:end], in chunks."""
+    header_end = buffer.find(b"\r\n\r\n", start, end)
+    _, headers = parse_headers(buffer[start:header_end])
+    body = header_end + 4
+    transfer = headers.get("transfer-encoding", "").lower()
+    encoding = headers.get("content-encoding", "identity").lower()
+    if transfer in ("", "identity") and encoding == "identity":
+        # slices of the map, the page is never copied as a whole
+        for i in range(body, end, chunk_size):
+            yield buffer[i:min(i + chunk_size, end)]
+        return
+    data = buffer[body:end]
+    if "chunked" in transfer:
+        data = dechunk(data)
+    if encoding in ("gzip", "x-gzip"):
+        data = zlib.decompress(data, 47)
+    elif encoding == "deflate":
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            data = zlib.decompress(data, -15)
+    elif encoding != "identity":
+        raise ValueError(f"unsupported Content-Encoding {encoding}")
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def page_chunks(page, chunk_size=64 * 1024):
+    """Read a LocalPage in chunks, memory-mapping the file where possible."""
+    for chunk in _page_chunks(page, chunk_size):
+        RunMetrics.count("bytes_read", len(chunk))
+        yield chunk
+
+
+def _page_chunks(page, chunk_size):
+    if page.member is not None:
+        with zipfile.ZipFile(page.path) as archive, archive.open(page.member) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    with open(page.path, "rb") as f:
+        mm = open_mmap(f)
+        if mm is None:
+            return
+        with mm:
+            if page.gzip_member is not None:
+                start, length = page.gzip_member
+                record = zlib.decompress(mm[start:start + length], 31)
+                yield from http_body_chunks(
+                    record, page.offset, page.offset + page.length, chunk_size
+                )
+            elif page.offset is not None:
+                yield from http_body_chunks(
+                    mm, page.offset, page.offset + page.length, chunk_size
+                )
+            else:
+                for i in range(0, len(mm), chunk_size):
+                    yield mm[i:i + chunk_size]
+
+
+def read_page(page):
+    return b"".join(page_chunks(page))
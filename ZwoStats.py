@@ -0,0 +1,188 @@
+import csv
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from ZwoModel import FREE_RIDE, INTERVALS, RAMP, ZONE_NAMES, dominant_zone
+
+# Zwift power zones: upper bound of every zone as a fraction of FTP
+ZONE_BOUNDS = np.array([0.60, 0.76, 0.90, 1.05, 1.19])
+
+# free rides have no target; count them as easy endurance riding
+FREE_RIDE_POWER = 0.5
+
+NP_WINDOW = 30
+
+WorkoutStats = namedtuple(
+    "WorkoutStats",
+    ["duration", "average", "normalized", "intensity", "tss", "zones", "free_ride"],
+)
+
+
+def segments(steps):
+    """Flatten steps into (duration, start power, end power) segments.
+
+    Intervals are expanded into their on/off pairs, free rides get NaN power.
+    """
+    durations = []
+    starts = []
+    ends = []
+    for step in steps:
+        if step.kind == INTERVALS:
+            durations += [step.duration, step.off_duration] * step.reps
+            starts += [step.power_low, step.off_power] * step.reps
+            ends += [step.power_low, step.off_power] * step.reps
+        elif step.kind == FREE_RIDE:
+            durations.append(step.duration)
+            starts.append(math.nan)
+            ends.append(math.nan)
+        else:
+            durations.append(step.duration)
+            starts.append(step.power_low)
+            ends.append(step.power_high if step.kind == RAMP else step.power_low)
+    return (
+        np.array(durations, dtype=np.int64),
+        np.array(starts, dtype=np.float64),
+        np.array(ends, dtype=np.float64),
+    )
+
+
+def power_profile(steps):
+    """Second-by-second target power (fraction of FTP) of a workout.
+
+    Ramps are sampled in the middle of every second; free-ride seconds are NaN.
+    """
+    durations, starts, ends = segments(steps)
+    keep = durations > 0
+    durations, starts, ends = durations[keep], starts[keep], ends[keep]
+    if not len(durations):
+        return np.zeros(0)
+    segment = np.repeat(np.arange(len(durations)), durations)
+    offsets = np.cumsum(durations) - durations
+    t = np.arange(len(segment)) - offsets[segment] + 0.5
+    return starts[segment] + (ends - starts)[segment] * t / durations[segment]
+
+
+def profiles_stats(profiles):
+    """WorkoutStats for many power profiles in one vectorised pass.
+
+    The profiles are concatenated and every per-workout sum is a single
+    np.add.reduceat over the workout boundaries.
+    """
+    count = len(profiles)
+    if not count:
+        return []
+    lengths = np.array([len(p) for p in profiles], dtype=np.int64)
+    nonempty = np.flatnonzero(lengths)
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+    if len(nonempty):
+        power = np.concatenate([profiles[i] for i in nonempty])
+    else:
+        power = np.zeros(0)
+
+    def per_workout(values, dtype=np.float64):
+        sums = np.zeros(count, dtype=dtype)
+        if len(nonempty):
+            sums[nonempty] = np.add.reduceat(values, starts, dtype=dtype)
+        return sums
+
+    free = np.isnan(power)
+    power = np.where(free, FREE_RIDE_POWER, power)
+    average = per_workout(power) / np.maximum(lengths, 1)
+
+    # 30 s rolling average, to the 4th power, stored at the window's last second
+    cumulative = np.concatenate([[0.0], np.cumsum(power)])
+    fourth = np.zeros(len(power))
+    fourth[NP_WINDOW - 1:] = ((cumulative[NP_WINDOW:] - cumulative[:-NP_WINDOW]) / NP_WINDOW) ** 4
+    # windows reaching back into the previous workout don't count
+    for start in starts:
+        fourth[start:start + NP_WINDOW - 1] = 0.0
+    windows = np.maximum(lengths - (NP_WINDOW - 1), 0)
+    normalized = np.where(
+        windows > 0,
+        (per_workout(fourth) / np.maximum(windows, 1)) ** 0.25,
+        average,
+    )
+    tss = lengths / 3600.0 * normalized ** 2 * 100.0
+
+    # seconds below every zone bound, the differences are the time in zone
+    known = ~free
+    below = [per_workout(known & (power < bound), np.int64) for bound in ZONE_BOUNDS]
+    below = np.stack([np.zeros(count, dtype=np.int64)] + below + [per_workout(known, np.int64)])
+    zones = np.diff(below, axis=0).T
+    free_ride = per_workout(free, np.int64)
+
+    return [
+        WorkoutStats(
+            duration=int(lengths[i]),
+            average=float(average[i]),
+            normalized=float(normalized[i]),
+            intensity=float(normalized[i]),
+            tss=float(tss[i]),
+            zones=tuple(int(z) for z in zones[i]),
+            free_ride=int(free_ride[i]),
+        )
+        for i in range(count)
+    ]
+
+
+def workouts_stats(step_lists):
+    return profiles_stats([power_profile(steps) for steps in step_lists])
+
+
+def workout_stats(steps):
+    return workouts_stats([steps])[0]
+
+
+def format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+def stats_summary(stats):
+    lines = [
+        f"Duration {format_duration(stats.duration)}, IF {stats.intensity:.2f}, "
+        f"TSS {stats.tss:.0f}, NP {stats.normalized * 100:.0f}% FTP",
+        "Time in zone: " + ", ".join(
+            f"{name} {format_duration(seconds)}"
+            for name, seconds in zip(ZONE_NAMES, stats.zones) if seconds
+        ),
+    ]
+    if stats.free_ride:
+        lines.append(f"Free ride: {format_duration(stats.free_ride)}")
+    return "\n".join(lines)
+
+
+def stats_tags(stats):
+    return [
+        f"{round(stats.duration / 60)}min",
+        f"TSS {stats.tss:.0f}",
+        f"IF {stats.intensity:.2f}",
+        dominant_zone(stats.zones) or "free ride",
+    ]
+
+
+STATS_COLUMNS = (
+    ["title", "duration", "average", "normalized", "intensity", "tss"]
+    + ZONE_NAMES + ["free_ride"]
+)
+
+
+def stats_row(title, stats):
+    """The STATS_COLUMNS of a workout."""
+    return (
+        [title, stats.duration, f"{stats.average:.3f}",
+         f"{stats.normalized:.3f}", f"{stats.intensity:.3f}",
+         f"{stats.tss:.1f}"]
+        + list(stats.zones) + [stats.free_ride]
+    )
+
+
+def write_stats_table(path, rows):
+    """Write (title, WorkoutStats) rows as CSV, one workout per line."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(STATS_COLUMNS)
+        for title, stats in rows:
+            writer.writerow(stats_row(title, stats))
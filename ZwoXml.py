@@ -0,0 +1,133 @@
+import io
+import re
+
+from ZwoModel import FREE_RIDE, INTERVALS, RAMP, STEADY
+from ZwoStats import stats_summary, stats_tags, workout_stats
+
+AUTHOR = "M. Afschrift"
+INDENT = "    "
+
+# the same characters lxml refuses, and the same escapes it writes
+INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+TEXT_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"})
+ATTRIBUTE_ESCAPES = str.maketrans({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;",
+    "\r": "&#13;", "\n": "&#10;", "\t": "&#9;",
+})
+
+
+def check_text(value):
+    if INVALID_XML.search(value):
+        raise ValueError(
+            "All strings must be XML compatible: Unicode or ASCII, "
+            "no NULL bytes or control characters"
+        )
+    return value
+
+
+def escape_text(value):
+    return check_text(value).translate(TEXT_ESCAPES)
+
+
+def escape_attribute(value):
+    return check_text(value).translate(ATTRIBUTE_ESCAPES)
+
+
+def text_element(tag, value):
+    if value is None:
+        return f"{INDENT}<{tag}/>\n"
+    return f"{INDENT}<{tag}>{escape_text(value)}</{tag}>\n"
+
+
+def ramp_line(step, label):
+    line = (f'<{label} Duration="{step.duration}" PowerLow="{step.power_low}" '
+            f'PowerHigh="{step.power_high}" pace="0"')
+    if step.cadence:
+        line += f' Cadence="{step.cadence}"'
+    return line + "/>"
+
+
+def steady_line(step):
+    line = f'<SteadyState Duration="{step.duration}" Power="{step.power_low}" pace="0"'
+    if step.cadence:
+        line += f' Cadence="{step.cadence}"'
+    return line + "/>"
+
+
+def intervals_line(step):
+    line = (f'<IntervalsT Repeat="{step.reps}" OnDuration="{step.duration}" '
+            f'OffDuration="{step.off_duration}" OnPower="{step.power_low}" '
+            f'OffPower="{step.off_power}" pace="0"')
+    if step.cadence and step.off_cadence:
+        line += f' Cadence="{step.cadence}" CadenceResting="{step.off_cadence}"'
+    return line + "/>"
+
+
+def free_ride_line(step):
+    return f'<FreeRide Duration="{step.duration}" FlatRoad="0"/>'
+
+
+def step_lines(steps):
+    """Yield the <workout> children, in the same form as GetZwo.step_element."""
+    last = len(steps) - 1
+    for i, step in enumerate(steps):
+        if step.kind == RAMP:
+            label = "Warmup" if i == 0 else "Cooldown" if i == last else "Ramp"
+            line = ramp_line(step, label)
+        elif step.kind == STEADY:
+            line = steady_line(step)
+        elif step.kind == INTERVALS:
+            line = intervals_line(step)
+        elif step.kind == FREE_RIDE:
+            line = free_ride_line(step)
+        else:
+            raise ValueError(f"unknown step kind {step.kind!r}")
+        yield f"{INDENT}{INDENT}{line}\n"
+
+
+def write_workout(f, title, steps, description=None, stats=None):
+    """Write a .zwo document to the text file f without building a tree.
+
+    Every step is written to f as soon as it is formatted, so memory doesn't
+    grow with the length of the workout. The output is the same, byte for
+    byte, as workout_document(workout_xml(title, steps, description, stats))
+    in GetZwo.
+    """
+    if stats is None:
+        stats = workout_stats(steps)
+    summary = stats_summary(stats)
+    if description:
+        summary = description + "\n\n" + summary
+    # texts that can't be written fail here, before f is touched
+    header = (
+        "<workout_file>\n"
+        + text_element("author", AUTHOR)
+        + text_element("name", title)
+        + text_element("description", summary)
+        + text_element("sportType", "bike")
+    )
+    tags = [
+        f'{INDENT}{INDENT}<tag name="{escape_attribute(tag)}"/>\n' for tag in stats_tags(stats)
+    ]
+    f.write(header)
+    if tags:
+        f.write(f"{INDENT}<tags>\n")
+        for tag in tags:
+            f.write(tag)
+        f.write(f"{INDENT}</tags>\n")
+    else:
+        f.write(f"{INDENT}<tags/>\n")
+    if steps:
+        f.write(f"{INDENT}<workout>\n")
+        for line in step_lines(steps):
+            f.write(line)
+        f.write(f"{INDENT}</workout>\n")
+    else:
+        f.write(f"{INDENT}<workout/>\n")
+    f.write("</workout_file>\n")
+
+
+def workout_text(title, steps, description=None, stats=None):
+    f = io.StringIO()
+    write_workout(f, title, steps, description, stats)
+    return f.getvalue()
@@ -0,0 +1,86 @@
+"""Benchmark of --dedup: storing identical workouts of many plans once.
+
+Builds --plans plans that, like the plans on the site, reuse workouts from
+a shared pool, writes all of them the way the App does ("training N" in
+front of every file, a folder per plan) with and without dedup and compares
+the time and the disk space. --retitled of the workouts of every plan carry
+the plan's own title, which makes them different files with the same steps;
+with dedup these are links to the workout stored first:
+
+    python benchmarks/bench_dedup.py --plans 200
+
+tests/test_dedup.py checks what the files read back as.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GetZwo
+from ZwoModel import steps_key
+from ZwoOutput import DirectoryWriter
+from ZwoXml import workout_text
+from corpus import corpus
+
+
+def plans(seed, count, per_plan, retitled):
+    """(filename, text, steps key) of the workouts of count plans sharing one pool."""
+    pool = [
+        (document, steps, steps_key(steps))
+        for content in corpus(seed).values()
+        for document, steps in zip(*GetZwo.page_plan(content))
+    ]
+    rng = random.Random(seed)
+    files = []
+    for p in range(count):
+        for i, (document, steps, key) in enumerate(rng.sample(pool, per_plan)):
+            text = document.text
+            if rng.random() < retitled:
+                text = workout_text(f"Plan {p}: {document.title}", steps,
+                                    document.description, document.stats)
+            files.append((f"plan {p}/training {i} {document.filename}", text, key))
+    return files
+
+
+def disk_usage(folder):
+    """Bytes of the files in folder, every hard-linked file counted once."""
+    inodes = {}
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            info = os.stat(os.path.join(root, filename))
+            inodes[(info.st_dev, info.st_ino)] = info.st_blocks * 512
+    return sum(inodes.values())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--plans", type=int, default=200)
+    ap.add_argument("--per-plan", type=int, default=20)
+    ap.add_argument("--retitled", type=float, default=0.25,
+                    help="share of the workouts with a title of their own")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    files = plans(args.seed, args.plans, args.per_plan, args.retitled)
+    for dedup in (False, True):
+        with tempfile.TemporaryDirectory() as folder:
+            writer = DirectoryWriter(folder, dedup)
+            start = time.perf_counter()
+            for filename, text, key in files:
+                writer.write(filename, text, key)
+            writer.close()
+            seconds = time.perf_counter() - start
+            usage = disk_usage(folder)
+        stored = ""
+        if dedup:
+            stats = writer.dedup.stats
+            stored = f", {stats['unique']} stored, {stats['retitled']} linked under another title"
+        print(f"{'dedup' if dedup else 'copies':6s} {len(files)} files{stored}: "
+              f"{seconds * 1e3:8.1f} ms, {usage / 2**20:6.1f} MB on disk")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time the folding of on/off runs into IntervalsT (ZwoModel.fold_repeats).
+
+Parses the workouts of the corpus and of seeded on/off sessions written as
+alternating steady lines, the way many plan pages list them, prints how many
+steps and .zwo bytes folding saves and how the time grows with the number of
+steps:
+
+    python benchmarks/bench_fold.py
+
+tests/test_fold.py checks that folding keeps the power profile and stats.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GetZwo
+from ZwoModel import fold_repeats
+from ZwoXml import workout_text
+from corpus import corpus, step_vocabulary
+
+
+def on_off_session(rng, vocabulary):
+    """Step texts of a session with on/off efforts written out one by one."""
+    texts = [f"10min from {rng.randint(30, 45)} to 75% FTP"]
+    for _ in range(rng.randint(1, 4)):
+        cadence = rng.choice(["", "100rpm, "])
+        rest_cadence = "85rpm, " if cadence else ""
+        on = f"{rng.randint(1, 5)}min @ {cadence}{rng.randint(95, 150)}% FTP"
+        off = f"{rng.choice(['1min', '2min', '30sec'])} @ {rest_cadence}{rng.randint(40, 60)}% FTP"
+        texts += [on, off] * rng.randint(2, 12)
+        texts += [rng.choice(vocabulary) for _ in range(rng.randint(0, 3))]
+    texts.append("10min from 70 to 30% FTP")
+    return texts
+
+
+def workout_texts(seed, sessions):
+    texts = [
+        [node.text_content() for node in workout.steps]
+        for content in corpus(seed).values()
+        for workout in GetZwo.page_workouts(content)
+    ]
+    rng = random.Random(seed)
+    vocabulary = step_vocabulary(rng)
+    return texts + [on_off_session(rng, vocabulary) for _ in range(sessions)]
+
+
+def written(texts):
+    """The steps as written on the page, not folded."""
+    return [GetZwo.parse_step_text(GetZwo.normalise_step_text(text)) for text in texts]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    workouts = [written(texts) for texts in workout_texts(args.seed, args.sessions)]
+    folded = [fold_repeats(steps) for steps in workouts]
+
+    size = sum(len(workout_text("w", steps).encode("utf-8")) for steps in workouts)
+    folded_size = sum(len(workout_text("w", steps).encode("utf-8")) for steps in folded)
+    steps = sum(map(len, workouts))
+    print(f"{len(workouts)} workouts: {steps} steps -> {sum(map(len, folded))}, "
+          f".zwo {size / 1024:.0f} KiB -> {folded_size / 1024:.0f} KiB")
+
+    flat = [step for workout in workouts for step in workout]
+    for n in (1_000, 10_000, 100_000):
+        sample = (flat * (n // len(flat) + 1))[:n]
+        start = time.perf_counter()
+        fold_repeats(sample)
+        seconds = time.perf_counter() - start
+        print(f"    {n:7d} steps  {seconds * 1e3:8.2f} ms  ({seconds / n * 1e9:6.0f} ns per step)")
+
+
+if __name__ == "__main__":
+    main()
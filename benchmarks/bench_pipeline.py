@@ -0,0 +1,171 @@
+"""Stage-by-stage benchmark of the GetZwo conversion pipeline.
+
+Serves the synthetic corpus from a local HTTP server and times every stage
+separately: network, html.fromstring, segmentation, step parsing, stats
+(NP, IF, TSS, zones), XML serialisation and file writing. Results are printed as a table and can be
+written as JSON to diff between releases:
+
+    python benchmarks/bench_pipeline.py --repeat 5 --output results.json
+"""
+import argparse
+import http.server
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree, html
+
+import GetZwo
+import ZwoXml
+from ZwoStats import workouts_stats
+from corpus import SIZES, corpus
+
+STAGES = ["network", "fromstring", "segment", "parse_steps", "stats", "serialise", "write"]
+
+
+class CorpusServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for the site, serving pages from memory."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        super().__init__(("127.0.0.1", 0), CorpusHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class CorpusHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.server.pages.get(self.path.lstrip("/"))
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_once(url, outdir):
+    """Convert one page, returning {stage: seconds} and a few counts."""
+    times = {}
+    GetZwo.parse_step_text.cache_clear()
+
+    start = time.perf_counter()
+    content = GetZwo.fetch_url(url)
+    times["network"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree = html.fromstring(content)
+    times["fromstring"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    workouts = GetZwo.segment_workouts(tree)
+    times["segment"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = [
+        (w.title, w.description, GetZwo.parse_steps(node.text_content() for node in w.steps))
+        for w in workouts
+    ]
+    times["parse_steps"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    all_stats = workouts_stats([steps for _, _, steps in parsed])
+    times["stats"] = time.perf_counter() - start
+
+    # with stats given, workout_text only serialises
+    start = time.perf_counter()
+    documents = [
+        ZwoXml.workout_text(title, steps, description, stats)
+        for (title, description, steps), stats in zip(parsed, all_stats)
+    ]
+    times["serialise"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, document in enumerate(documents):
+        with open(os.path.join(outdir, f"{i}.zwo"), "w") as f:
+            f.write(document)
+    times["write"] = time.perf_counter() - start
+
+    counts = {
+        "bytes": len(content),
+        "workouts": len(workouts),
+        "steps": sum(len(w.steps) for w in workouts),
+    }
+    return times, counts
+
+
+def summarise(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=list(SIZES))
+    ap.add_argument("--output", help="write the results as JSON to this file")
+    args = ap.parse_args()
+
+    pages = corpus(args.seed)
+    server = CorpusServer(pages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {
+        "python": platform.python_version(),
+        "lxml": ".".join(map(str, etree.LXML_VERSION)),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "pages": {},
+    }
+    try:
+        for name in args.sizes:
+            samples = {stage: [] for stage in STAGES}
+            with tempfile.TemporaryDirectory() as outdir:
+                # warm up the connection pool and the imports
+                run_once(f"{server.url}/{name}", outdir)
+                for _ in range(args.repeat):
+                    times, counts = run_once(f"{server.url}/{name}", outdir)
+                    for stage in STAGES:
+                        samples[stage].append(times[stage])
+            results["pages"][name] = dict(
+                counts,
+                stages={stage: summarise(samples[stage]) for stage in STAGES},
+            )
+    finally:
+        server.shutdown()
+
+    for name, page in results["pages"].items():
+        print(f"{name}: {page['bytes']} bytes, {page['workouts']} workouts, {page['steps']} steps")
+        for stage in STAGES:
+            t = page["stages"][stage]
+            print(f"    {stage:12s} median {t['median'] * 1e3:9.3f} ms   min {t['min'] * 1e3:9.3f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark of the bulk .zwo reader (ZwoReader, GetZwo.py --inventory).
+
+Writes seeded, hour-long workouts as .zwo files into a temporary folder
+tree, copied until there are --files of them, and times an inventory of
+the tree in this process and in a pool of reader processes:
+
+    python benchmarks/bench_reader.py --files 20000
+
+tests/test_reader.py checks that the files read back as the steps and stats
+they were written from.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GetZwo
+from ZwoReader import inventory
+from ZwoStats import workouts_stats
+from ZwoXml import workout_text
+from corpus import step_vocabulary
+
+
+def session_steps(rng, vocabulary):
+    """Step texts of a workout of about an hour, like most .zwo files."""
+    texts = [f"10min from {rng.randint(30, 45)} to 75% FTP"]
+    minutes = 10
+    while minutes < 50:
+        text = rng.choice(vocabulary)
+        steps = GetZwo.parse_steps([text])
+        if sum(step.total_duration for step in steps) <= 20 * 60:
+            texts.append(text)
+            minutes += sum(step.total_duration for step in steps) / 60
+    texts.append("10min from 70 to 30% FTP")
+    return texts
+
+
+def workouts(seed, count):
+    """(filename, .zwo text, steps, stats) of count different workouts."""
+    rng = random.Random(seed)
+    vocabulary = step_vocabulary(rng)
+    step_lists = [GetZwo.parse_steps(session_steps(rng, vocabulary)) for _ in range(count)]
+    return [
+        (f"Session {i + 1}.zwo", workout_text(f"Session {i + 1}", steps, None, stats), steps, stats)
+        for i, (steps, stats) in enumerate(zip(step_lists, workouts_stats(step_lists)))
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=20000)
+    ap.add_argument("--workouts", type=int, default=500,
+                    help="different workouts among the files")
+    ap.add_argument("--per-folder", type=int, default=500)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    converted = workouts(args.seed, args.workouts)
+
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(args.files):
+            filename, text, _, _ = converted[i % len(converted)]
+            subfolder = os.path.join(folder, f"{i // args.per_folder:04d}")
+            os.makedirs(subfolder, exist_ok=True)
+            with open(os.path.join(subfolder, f"{i:06d} {filename}"), "w", encoding="utf-8") as f:
+                f.write(text)
+
+        for workers in (0, args.workers):
+            start = time.perf_counter()
+            rows = list(inventory([folder], workers))
+            seconds = time.perf_counter() - start
+            keys = {row.key for row in rows}
+            print(f"{len(rows)} files, {len(keys)} different workouts, {workers} reader processes: "
+                  f"{seconds:6.2f} s, {len(rows) / seconds:7.0f} files/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark of the .erg/.mrc renderer for a roster of riders.
+
+Renders the synthetic corpus for a roster twice, once the naive way (every
+rider parses and lays out every workout again and scales it power by power)
+and once with ZwoRender.render_plan (every workout parsed once, all riders
+scaled in one NumPy operation), and compares the times:
+
+    python benchmarks/bench_render.py --riders 20
+
+tests/test_render.py checks that both give the same files and that every
+.erg follows the workout's power profile.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import GetZwo
+from ZwoRender import Rider, course_text, profile_points, render_plan
+from corpus import SIZES, corpus
+
+
+def corpus_workouts(seed):
+    """(title, description, step texts) of every workout in the corpus."""
+    return [
+        (workout.title, workout.description, [node.text_content() for node in workout.steps])
+        for content in corpus(seed).values()
+        for workout in GetZwo.page_workouts(content)
+    ]
+
+
+def stem(title):
+    return os.path.splitext(GetZwo.workout_filename(title))[0]
+
+
+def render_naive(workouts, riders):
+    files = []
+    for rider in riders:
+        # as if every rider were converted on their own
+        GetZwo.parse_step_text.cache_clear()
+        for title, description, texts in workouts:
+            minutes, power = profile_points(GetZwo.parse_steps(texts))
+            files.append((rider.name + "/" + stem(title) + ".erg", course_text(
+                title, description, stem(title) + ".erg", "MINUTES WATTS",
+                [f"{m:.2f}" for m in minutes], [round(p * rider.ftp) for p in power], rider.ftp,
+            )))
+    return files
+
+
+def render_batch(workouts, riders):
+    GetZwo.parse_step_text.cache_clear()
+    parsed = [
+        (stem(title), title, description, GetZwo.parse_steps(texts))
+        for title, description, texts in workouts
+    ]
+    return list(render_plan(parsed, riders, ("erg",)))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--riders", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    workouts = corpus_workouts(args.seed)
+    rng = np.random.default_rng(args.seed)
+    riders = [Rider(f"rider {i}", float(rng.integers(150, 380))) for i in range(args.riders)]
+
+    naive_time, naive = timed(render_naive, workouts, riders)
+    batch_time, batch = timed(render_batch, workouts, riders)
+
+    steps = sum(len(texts) for _, _, texts in workouts)
+    print(f"{len(workouts)} workouts ({', '.join(SIZES)}), {steps} steps, {len(riders)} riders: "
+          f"{len(batch)} .erg files")
+    print(f"    naive  {naive_time * 1e3:9.1f} ms")
+    print(f"    batch  {batch_time * 1e3:9.1f} ms   ({naive_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
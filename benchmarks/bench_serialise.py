@@ -0,0 +1,100 @@
+"""Time the lxml .zwo serialisation against the streaming ZwoXml writer.
+
+Writes the workouts of the huge page of the corpus, 10 times over, to
+strings and to files both ways:
+
+    python benchmarks/bench_serialise.py [--repeat 5]
+
+tests/test_zwoxml.py checks that both give the same bytes.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GetZwo
+import ZwoXml
+from ZwoOutput import DirectoryWriter
+from ZwoStats import workouts_stats
+from corpus import SIZES, corpus
+
+
+def corpus_workouts(seed):
+    workouts = []
+    for content in corpus(seed).values():
+        for workout in GetZwo.page_workouts(content):
+            steps = GetZwo.parse_steps(node.text_content() for node in workout.steps)
+            workouts.append((workout.title, steps, workout.description))
+    return workouts
+
+
+def write_lxml(writer, workouts, stats):
+    for (title, steps, description), s in zip(workouts, stats):
+        writer.write(
+            GetZwo.workout_filename(title),
+            GetZwo.workout_document(GetZwo.workout_xml(title, steps, description, s)),
+        )
+
+
+def write_streaming(writer, workouts, stats):
+    for (title, steps, description), s in zip(workouts, stats):
+        writer.write_to(
+            GetZwo.workout_filename(title),
+            lambda f: ZwoXml.write_workout(f, title, steps, description, s),
+        )
+
+
+def serialise_lxml(workouts, stats):
+    for (title, steps, description), s in zip(workouts, stats):
+        GetZwo.workout_document(GetZwo.workout_xml(title, steps, description, s))
+
+
+def serialise_streaming(workouts, stats):
+    f = io.StringIO()
+    for (title, steps, description), s in zip(workouts, stats):
+        ZwoXml.write_workout(f, title, steps, description, s)
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    workouts = corpus_workouts(args.seed)
+    # the huge page, 10 times over, so the timings are not all noise
+    count, _ = SIZES["huge"]
+    batch = workouts[-count:] * 10
+    batch = [(f"{i} {title}", steps, description)
+             for i, (title, steps, description) in enumerate(batch)]
+    stats = workouts_stats([steps for _, steps, _ in batch])
+    with tempfile.TemporaryDirectory() as outdir:
+        writer = DirectoryWriter(outdir)
+        results = [
+            ("lxml tree, to string", timed(lambda: serialise_lxml(batch, stats), args.repeat)),
+            ("streaming, to string", timed(lambda: serialise_streaming(batch, stats), args.repeat)),
+            ("lxml tree, to files", timed(lambda: write_lxml(writer, batch, stats), args.repeat)),
+            ("streaming, to files", timed(lambda: write_streaming(writer, batch, stats), args.repeat)),
+        ]
+    print(f"{len(batch)} workouts, {sum(len(steps) for _, steps, _ in batch)} steps, "
+          f"median of {args.repeat}")
+    for name, seconds in results:
+        print(f"{name:24s} {seconds * 1e3:9.1f} ms  {len(batch) / seconds:10,.0f} workouts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of the local conversion service (GetZwo.py --serve).
+
+Serves the synthetic corpus from a stand-in origin server, starts the
+service in front of it and times concurrent requests for a plan that is not
+converted yet and repeated requests answered from memory:
+
+    python benchmarks/bench_service.py --clients 16
+
+tests/test_service.py checks that concurrent requests make a single
+download and that the zip holds the .zwo files a direct conversion writes.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import GetZwo
+from ZwoService import ConversionService, PlanCache
+from bench_pipeline import CorpusServer
+from corpus import SIZES, corpus
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    origin = CorpusServer(corpus(args.seed))
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    downloads = []
+    client = GetZwo.make_client()
+
+    def fetch(url):
+        downloads.append(url)
+        return GetZwo.fetch_url(url, client)
+
+    plans = PlanCache(fetch, GetZwo.page_plan)
+    host = urlsplit(origin.url).hostname
+    service = ConversionService(("127.0.0.1", 0), plans, allowed_hosts=(host,))
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    service_url = f"http://127.0.0.1:{service.server_address[1]}"
+    session = requests.Session()
+
+    def get(path, name):
+        response = session.get(service_url + path, params={"url": f"{origin.url}/{name}"})
+        response.raise_for_status()
+        return response.content
+
+    try:
+        for name in SIZES:
+            downloads.clear()
+            barrier = threading.Barrier(args.clients)
+
+            def request():
+                barrier.wait()
+                requests.get(
+                    service_url + "/plan.zip", params={"url": f"{origin.url}/{name}"}
+                ).raise_for_status()
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=request) for _ in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                get("/plan.zip", name)
+            warm = (time.perf_counter() - start) / args.repeat
+            print(f"{name}: {args.clients} concurrent clients {cold * 1e3:8.1f} ms, "
+                  f"{len(downloads)} download(s); cached {warm * 1e3:6.2f} ms per request")
+        print("service:", plans.status())
+    finally:
+        service.shutdown()
+        origin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
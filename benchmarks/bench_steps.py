@@ -0,0 +1,86 @@
+"""Micro-benchmark for step text parsing.
+
+Compares the old parser (four regexes tried one after another) with the
+single STEP_RE grammar and its memo cache, on a catalogue-like stream of
+step texts where a few hundred distinct steps repeat many times.
+
+    python benchmarks/bench_steps.py [--steps 200000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GetZwo
+from corpus import step_vocabulary
+
+# the parser as it was before STEP_RE, kept here as the baseline
+RAMP_RE = re.compile(
+    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
+    r'(?:@ (?P<cadence>\d+)rpm, )?from (?P<low>\d+) to (?P<high>\d+)% FTP'
+)
+STEADY_RE = re.compile(
+    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?'
+    r'@ (?:(?P<cadence>\d+)rpm, )?(?P<power>\d+)% FTP'
+)
+INTERVALS_RE = re.compile(
+    r'(?P<reps>\d+)x (?:(?P<on_hrs>\d+)hr )?(?:(?P<on_mins>\d+)min )?(?:(?P<on_secs>\d+)sec )?'
+    r'@ (?:(?P<on_cadence>\d+)rpm, )?(?P<on_power>\d+)% FTP,'
+    r'(?:(?P<off_hrs>\d+)hr )?(?:(?P<off_mins>\d+)min )?(?:(?P<off_secs>\d+)sec )?'
+    r'@ (?:(?P<off_cadence>\d+)rpm, )?(?P<off_power>\d+)% FTP'
+)
+FREE_RIDE_RE = re.compile(
+    r'(?:(?P<hrs>\d+)hr )?(?:(?P<mins>\d+)min )?(?:(?P<secs>\d+)sec )?free ride'
+)
+LEGACY_BLOCKS = [RAMP_RE, STEADY_RE, INTERVALS_RE, FREE_RIDE_RE]
+
+
+def legacy_parse(text):
+    for regex in LEGACY_BLOCKS:
+        match = regex.match(text)
+        if match:
+            return {k: int(v) if v else None for k, v in match.groupdict().items()}
+    raise RuntimeError(f"Couldn't parse {text}")
+
+
+def run(parse, texts):
+    start = time.perf_counter()
+    for text in texts:
+        parse(text)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--steps", type=int, default=200000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = step_vocabulary(rng)
+    texts = [rng.choice(vocabulary) for _ in range(args.steps)]
+
+    def single_pass(text):
+        return GetZwo.parse_step_text.__wrapped__(GetZwo.normalise_step_text(text))
+
+    def memoised(text):
+        return GetZwo.parse_step_text(GetZwo.normalise_step_text(text))
+
+    GetZwo.parse_step_text.cache_clear()
+    results = [
+        ("sequential regexes (old)", run(legacy_parse, texts)),
+        ("single grammar, no memo", run(single_pass, texts)),
+        ("single grammar + memo", run(memoised, texts)),
+    ]
+    print(f"{len(texts)} steps, {len(vocabulary)} distinct")
+    for name, rate in results:
+        print(f"{name:28s} {rate:12,.0f} steps/s  ({rate / results[0][1]:.2f}x)")
+    print(GetZwo.parse_step_text.cache_info())
+
+
+if __name__ == "__main__":
+    main()
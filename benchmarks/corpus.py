@@ -0,0 +1,92 @@
+"""Synthetic whatsonzwift-like plan pages for the benchmarks.
+
+Pages are generated from a seed, so every run (and every release) measures
+exactly the same input.
+"""
+import random
+
+# name: (workouts, steps per workout)
+SIZES = {
+    "small": (1, 8),
+    "typical": (20, 12),
+    "huge": (84, 60),  # 12 weeks x 7 days
+}
+
+# a workout of the corpus lasts about this long, whatever its number of steps
+WORKOUT_SECONDS = 90 * 60
+# the step lengths plans use, and the on and off parts of their intervals
+DURATIONS = [30, 60, 90, 120, 180, 240, 300, 360, 480, 600, 720, 900, 1200, 1500, 1800,
+             2400, 2700, 3600, 5400]
+ON_DURATIONS = [30, 40, 60, 90, 120, 180, 240, 300, 480, 600]
+OFF_DURATIONS = [30, 60, 90, 120, 180, 240, 300]
+
+BOILERPLATE = (
+    '<nav class="menu">' + '<a href="/workouts/plan-{0}">plan {0}</a>' * 40 + '</nav>'
+    '<script>var config = {{"theme": "dark", "items": [1, 2, 3]}};</script>'
+)
+
+
+def duration_text(seconds):
+    hrs, rest = divmod(seconds, 3600)
+    mins, secs = divmod(rest, 60)
+    return ((f"{hrs}hr " if hrs else "") + (f"{mins}min " if mins else "")
+            + (f"{secs}sec " if secs else ""))
+
+
+def step_vocabulary(rng, size=300, longest=5400):
+    """Distinct step texts in the formats the site uses, none over longest seconds."""
+    durations = [seconds for seconds in DURATIONS if seconds <= longest]
+    steps = set()
+    while len(steps) < size:
+        duration = duration_text(rng.choice(durations))
+        cadence = rng.choice(["", f"{rng.randint(70, 110)}rpm, "])
+        kind = rng.randrange(4)
+        if kind == 0:
+            low = rng.randint(25, 70)
+            steps.add(f"{duration}{'@ ' + cadence if cadence else ''}from {low} to {low + 20}% FTP")
+        elif kind == 1:
+            steps.add(f"{duration}@ {cadence}{rng.randint(40, 120)}% FTP")
+        elif kind == 2:
+            reps, on, off = rng.randint(2, 10), rng.choice(ON_DURATIONS), rng.choice(OFF_DURATIONS)
+            if reps * (on + off) > longest:
+                continue
+            steps.add(
+                f"{reps}x {duration_text(on)}@ {cadence}{rng.randint(90, 150)}% FTP,"
+                f"{duration_text(off)}@ {cadence}{rng.randint(40, 60)}% FTP"
+            )
+        else:
+            steps.add(f"{duration}free ride")
+    return sorted(steps)
+
+
+def plan_page(workouts, steps_per_workout, seed=0):
+    rng = random.Random(seed)
+    # the more steps, the shorter they are: a step takes up to twice its share
+    vocabulary = step_vocabulary(rng, longest=max(180, 2 * WORKOUT_SECONDS // steps_per_workout))
+    out = [
+        "<!DOCTYPE html>",
+        '<html><head><meta charset="utf-8"><title>Synthetic plan</title></head><body>',
+        BOILERPLATE.format(seed),
+        '<header><h4 class="glyph-icon flaticon-bike">Synthetic plan</h4></header>',
+    ]
+    for w in range(workouts):
+        week, day = divmod(w, 7)
+        out.append('<article class="workout">')
+        out.append(f'<h4 class="glyph-icon flaticon-bike">Week {week + 1} Day {day + 1} - Session {w + 1}</h4>')
+        out.append('<div class="one-third column workoutdescription">')
+        out.append(f"<p>Workout {w + 1}: tempo &amp; threshold work, {rng.randint(40, 90)} minutes.</p>")
+        out.append("<div>Duration: 1h</div></div>")
+        out.append('<div class="two-thirds column workoutlist">')
+        for _ in range(steps_per_workout):
+            out.append(f'<div class="textbar">{rng.choice(vocabulary)}</div>')
+        out.append("</div></article>")
+    out.append("</body></html>")
+    return "\n".join(out).encode("utf-8")
+
+
+def corpus(seed=0):
+    """Return {name: page bytes} for every size in SIZES."""
+    return {
+        name: plan_page(workouts, steps, seed)
+        for name, (workouts, steps) in SIZES.items()
+    }
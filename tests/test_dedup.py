@@ -0,0 +1,47 @@
+import os
+
+from ZwoOutput import DirectoryWriter
+from bench_dedup import plans
+
+
+def write_all(folder, files, dedup):
+    writer = DirectoryWriter(str(folder), dedup)
+    for filename, text, key in files:
+        writer.write(filename, text, key)
+    writer.close()
+    return writer
+
+
+def read(folder, filename):
+    with open(os.path.join(folder, filename), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_copies(tmp_path):
+    files = plans(0, 10, 20, 0.25)
+    write_all(tmp_path, files, False)
+    for filename, text, _ in files:
+        assert read(tmp_path, filename) == text
+
+
+def test_dedup_links_same_steps(tmp_path):
+    files = plans(0, 10, 20, 0.25)
+    # the text stored first for every steps key
+    first = {}
+    for _, text, key in files:
+        first.setdefault(key, text)
+    retitled = sum(text != first[key] for _, text, key in files)
+    writer = write_all(tmp_path, files, True)
+    for filename, _, key in files:
+        assert read(tmp_path, filename) == first[key]
+    stats = writer.dedup.stats
+    assert stats["unique"] == len(first)
+    assert stats["retitled"] == retitled > 0
+    assert stats["linked"] == len(files) - len(first)
+
+
+def test_dedup_again_unchanged(tmp_path):
+    files = plans(0, 5, 20, 0.25)
+    write_all(tmp_path, files, True)
+    stats = write_all(tmp_path, files, True).dedup.stats
+    assert stats["unchanged"] == len(files)
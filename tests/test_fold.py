@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from ZwoModel import INTERVALS, STEADY, Step, fold_repeats
+from ZwoStats import power_profile, workouts_stats
+from bench_fold import workout_texts, written
+
+
+@pytest.fixture(scope="module")
+def workouts():
+    return [written(texts) for texts in workout_texts(0, 50)]
+
+
+def test_same_power_profile(workouts):
+    for steps in workouts:
+        assert np.array_equal(power_profile(steps), power_profile(fold_repeats(steps)),
+                              equal_nan=True)
+
+
+def test_same_stats(workouts):
+    assert workouts_stats(workouts) == workouts_stats([fold_repeats(steps) for steps in workouts])
+
+
+def test_on_off_run_folded():
+    on = Step(STEADY, 60, 1.2, 1.2, 100)
+    off = Step(STEADY, 120, 0.5, 0.5, 85)
+    assert fold_repeats([on, off] * 4) == [
+        Step(INTERVALS, 60, 1.2, 1.2, 100, reps=4, off_duration=120, off_power=0.5,
+             off_cadence=85),
+    ]
+
+
+def test_folding_saves_steps(workouts):
+    assert sum(len(fold_repeats(steps)) for steps in workouts) < sum(map(len, workouts))
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+import requests
+
+from HttpClient import HttpClient
+from bench_pipeline import CorpusServer
+
+PAGE = b"x" * (1024 * 1024)
+
+
+@pytest.fixture(scope="module")
+def origin():
+    server = CorpusServer({"page": PAGE})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client():
+    return HttpClient(requests.Session(), rate=1000.0, max_concurrency=1)
+
+
+def in_flight(client, origin):
+    return client.host(origin.url).limit.in_flight
+
+
+def test_slot_released_after_plain_get(client, origin):
+    assert client.get(origin.url + "/page").content == PAGE
+    assert in_flight(client, origin) == 0
+
+
+def test_stream_holds_slot_until_read(client, origin):
+    response = client.get(origin.url + "/page", stream=True)
+    chunks = response.iter_content(64 * 1024)
+    next(chunks)
+    assert in_flight(client, origin) == 1
+    for _ in chunks:
+        pass
+    assert in_flight(client, origin) == 0
+    response.close()
+    assert in_flight(client, origin) == 0
+
+
+def test_stream_holds_slot_until_closed(client, origin):
+    with client.get(origin.url + "/page", stream=True) as response:
+        next(response.iter_content(1024))
+        assert in_flight(client, origin) == 1
+    assert in_flight(client, origin) == 0
+    # the slot is free for the next request
+    assert client.get(origin.url + "/page").content == PAGE
@@ -0,0 +1,30 @@
+import os
+import threading
+
+import pytest
+
+import GetZwo
+from bench_pipeline import STAGES, CorpusServer, run_once
+from corpus import SIZES, corpus
+
+
+@pytest.fixture(scope="module")
+def origin():
+    server = CorpusServer(corpus(0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.parametrize("name", list(SIZES))
+def test_stages_write_the_converted_documents(origin, tmp_path, name):
+    """The benchmark's stages, run one by one, convert the page like GetZwo."""
+    times, counts = run_once(f"{origin.url}/{name}", str(tmp_path))
+    assert set(times) == set(STAGES)
+    workouts, steps = SIZES[name]
+    assert counts["workouts"] == workouts
+    assert counts["steps"] == workouts * steps
+    documents = GetZwo.page_documents(corpus(0)[name])
+    for i, document in enumerate(documents):
+        with open(os.path.join(tmp_path, f"{i}.zwo"), encoding="utf-8") as f:
+            assert f.read() == document.text
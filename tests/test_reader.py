@@ -0,0 +1,45 @@
+import math
+import os
+
+import pytest
+
+from ZwoReader import inventory, read_zwo
+from bench_reader import workouts
+
+
+def same_stats(a, b):
+    return all(
+        math.isclose(x, y, rel_tol=1e-9) if isinstance(x, float) else x == y
+        for x, y in zip(a, b)
+    )
+
+
+@pytest.fixture(scope="module")
+def converted():
+    return workouts(0, 30)
+
+
+@pytest.fixture
+def folder(tmp_path, converted):
+    for i, (filename, text, _, _) in enumerate(converted):
+        subfolder = tmp_path / f"{i // 10:02d}"
+        subfolder.mkdir(exist_ok=True)
+        (subfolder / filename).write_text(text, encoding="utf-8")
+    return tmp_path
+
+
+def test_read_back_steps(folder, converted):
+    for i, (filename, _, steps, _) in enumerate(converted):
+        assert read_zwo(os.path.join(folder, f"{i // 10:02d}", filename)).steps == steps
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_inventory_stats(folder, converted, workers):
+    expected = {filename: stats for filename, _, _, stats in converted}
+    rows = list(inventory([str(folder)], workers))
+    assert len(rows) == len(converted)
+    for row in rows:
+        # the stats of a batch are one vectorised pass, so the last digits
+        # depend on the other workouts in it
+        assert same_stats(row.stats, expected[os.path.basename(row.path)])
+    assert len({row.key for row in rows}) == len(converted)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import GetZwo
+from ZwoRender import Rider, profile_points, render_plan
+from ZwoStats import FREE_RIDE_POWER, power_profile
+from bench_render import corpus_workouts, render_batch, render_naive
+
+RIDERS = [Rider("rider 0", 250.0), Rider("rider 1", 183.0), Rider("rider 2", 371.0)]
+
+
+@pytest.fixture(scope="module")
+def workouts():
+    return corpus_workouts(0)
+
+
+def test_batch_same_as_naive(workouts):
+    assert sorted(render_batch(workouts, RIDERS)) == sorted(render_naive(workouts, RIDERS))
+
+
+def test_course_follows_power_profile(workouts):
+    """The .erg course, sampled mid-second, is the power profile in watts."""
+    rider = RIDERS[0]
+    for title, description, texts in workouts:
+        steps = GetZwo.parse_steps(texts)
+        expected = power_profile(steps)
+        expected = np.where(np.isnan(expected), FREE_RIDE_POWER, expected)
+        minutes, _ = profile_points(steps)
+        [(_, text)] = render_plan([("w", title, description, steps)], [rider], ("erg",))
+        data = text.split("[COURSE DATA]\n")[1].split("\n[END COURSE DATA]")[0]
+        watts = np.array([float(line.split("\t")[1]) for line in data.splitlines()])
+        course = np.interp(np.arange(len(expected)) + 0.5, minutes * 60.0, watts)
+        # ramps end on rounded watts, so up to half a watt off in between
+        assert np.abs(course - expected * rider.ftp).max(initial=0.0) <= 0.5 + 1e-9
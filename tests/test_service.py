@@ -0,0 +1,77 @@
+import io
+import threading
+import zipfile
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+
+import GetZwo
+from ZwoService import ConversionService, PlanCache
+from bench_pipeline import CorpusServer
+from corpus import SIZES, corpus
+
+CLIENTS = 8
+
+
+@pytest.fixture(scope="module")
+def origin():
+    server = CorpusServer(corpus(0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def service(origin):
+    downloads = []
+    client = GetZwo.make_client()
+
+    def fetch(url):
+        downloads.append(url)
+        return GetZwo.fetch_url(url, client)
+
+    plans = PlanCache(fetch, GetZwo.page_plan)
+    server = ConversionService(("127.0.0.1", 0), plans,
+                               allowed_hosts=(urlsplit(origin.url).hostname,))
+    server.downloads = downloads
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.parametrize("name", list(SIZES))
+def test_concurrent_requests_one_download(origin, service, name):
+    url = f"{origin.url}/{name}"
+    barrier = threading.Barrier(CLIENTS)
+    answers = []
+
+    def request():
+        barrier.wait()
+        answers.append(requests.get(service.url + "/plan.zip", params={"url": url}).content)
+
+    threads = [threading.Thread(target=request) for _ in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(answers) == CLIENTS and len(set(answers)) == 1
+    assert service.downloads == [url]
+
+    expected = {
+        document.filename: document.text.encode("utf-8")
+        for document in GetZwo.page_documents(GetZwo.fetch_url(url))
+    }
+    with zipfile.ZipFile(io.BytesIO(answers[0])) as archive:
+        assert {filename: archive.read(filename) for filename in archive.namelist()} == expected
+
+    requests.get(service.url + "/plan.zip", params={"url": url}).raise_for_status()
+    assert service.downloads == [url]
+    assert service.plans.status()["hits"] == 1
+
+
+def test_host_not_allowed(service):
+    response = requests.get(service.url + "/plan.json",
+                            params={"url": "http://example.com/plan"})
+    assert response.status_code == 403
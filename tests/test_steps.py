@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+import GetZwo
+from GetZwo import calc_duration
+from ZwoModel import FREE_RIDE, INTERVALS, RAMP, STEADY, Step
+from bench_steps import FREE_RIDE_RE, INTERVALS_RE, RAMP_RE, STEADY_RE
+from corpus import step_vocabulary
+
+FUZZ_PARTS = [
+    "3x ", "1hr ", "10min ", "30sec ", "@ ", "90rpm, ", "85", "% FTP", ",", "from 50 to 75",
+    "free ride", "2min ", "x", " ", "rpm", "@ 60rpm, ", "40",
+]
+
+
+def legacy_step(text):
+    """The Step the four regexes of the old parser, tried in turn, describe."""
+    for kind, regex in ((RAMP, RAMP_RE), (STEADY, STEADY_RE), (INTERVALS, INTERVALS_RE),
+                        (FREE_RIDE, FREE_RIDE_RE)):
+        match = regex.match(text)
+        if match:
+            break
+    else:
+        return None
+    m = {k: int(v) if v else None for k, v in match.groupdict().items()}
+    if kind == RAMP:
+        return Step(RAMP, calc_duration(m["hrs"], m["mins"], m["secs"]),
+                    m["low"] / 100.0, m["high"] / 100.0, m["cadence"])
+    if kind == STEADY:
+        return Step(STEADY, calc_duration(m["hrs"], m["mins"], m["secs"]),
+                    m["power"] / 100.0, m["power"] / 100.0, m["cadence"])
+    if kind == INTERVALS:
+        # the old parser took the off hours from the on part, a bug not kept
+        return Step(
+            INTERVALS,
+            calc_duration(m["on_hrs"], m["on_mins"], m["on_secs"]),
+            m["on_power"] / 100.0,
+            m["on_power"] / 100.0,
+            m["on_cadence"],
+            reps=m["reps"],
+            off_duration=calc_duration(m["off_hrs"], m["off_mins"], m["off_secs"]),
+            off_power=m["off_power"] / 100.0,
+            off_cadence=m["off_cadence"],
+        )
+    return Step(FREE_RIDE, calc_duration(m["hrs"], m["mins"], m["secs"]))
+
+
+def new_step(text):
+    try:
+        return GetZwo.parse_step_text.__wrapped__(text)
+    except RuntimeError:
+        return None
+
+
+def step_texts():
+    rng = random.Random(3)
+    fuzz = ["".join(rng.choice(FUZZ_PARTS) for _ in range(rng.randint(1, 9)))
+            for _ in range(20000)]
+    return [GetZwo.normalise_step_text(text) for text in step_vocabulary(rng) + fuzz]
+
+
+def test_same_steps_as_the_old_regexes():
+    texts = step_texts()
+    differ = [text for text in texts if new_step(text) != legacy_step(text)]
+    assert differ == []
+    # the fuzz must reach every kind of step, not only errors
+    kinds = {step.kind for step in map(new_step, texts) if step is not None}
+    assert kinds == {RAMP, STEADY, INTERVALS, FREE_RIDE}
+
+
+@pytest.mark.parametrize("text, step", [
+    ("10min from 25 to 75% FTP", Step(RAMP, 600, 0.25, 0.75)),
+    ("5min @ 85rpm, from 50 to 70% FTP", Step(RAMP, 300, 0.5, 0.7, 85)),
+    ("1hr 30sec @ 65% FTP", Step(STEADY, 3630, 0.65, 0.65)),
+    ("2min @ 95rpm, 105% FTP", Step(STEADY, 120, 1.05, 1.05, 95)),
+    ("6x 1min @ 100rpm, 120% FTP,2min @ 85rpm, 50% FTP",
+     Step(INTERVALS, 60, 1.2, 1.2, 100, reps=6, off_duration=120, off_power=0.5,
+          off_cadence=85)),
+    ("3x 1hr @ 90% FTP,1hr @ 50% FTP",
+     Step(INTERVALS, 3600, 0.9, 0.9, reps=3, off_duration=3600, off_power=0.5)),
+    ("20min free ride", Step(FREE_RIDE, 1200)),
+])
+def test_parse_step_text(text, step):
+    assert GetZwo.parse_step_text(text) == step
+
+
+@pytest.mark.parametrize("text", ["", "warm up", "3x 10min @ 90% FTP", "2x 5min free ride"])
+def test_unparseable_step_text(text):
+    with pytest.raises(RuntimeError):
+        GetZwo.parse_step_text(text)
+
+
+def test_normalise_step_text():
+    assert GetZwo.normalise_step_text("  10min\n @\t 65% FTP ") == "10min @ 65% FTP"
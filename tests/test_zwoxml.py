@@ -0,0 +1,84 @@
+import io
+
+import pytest
+
+import GetZwo
+import ZwoXml
+from ZwoModel import FREE_RIDE, INTERVALS, RAMP, STEADY, Step
+from ZwoStats import workout_stats, workouts_stats
+from bench_serialise import corpus_workouts
+
+WARMUP = Step(RAMP, 600, 0.25, 0.75)
+COOLDOWN = Step(RAMP, 600, 0.7, 0.3)
+
+WORKOUTS = {
+    "steady": ("Endurance", [Step(STEADY, 3600, 0.65, 0.65)], None),
+    "warmup, ramp and cooldown": (
+        "Ramps",
+        [WARMUP, Step(RAMP, 300, 0.6, 0.9, 85), Step(STEADY, 600, 0.8, 0.8, 90), COOLDOWN],
+        "build up",
+    ),
+    "single ramp": ("One ramp", [Step(RAMP, 300, 0.5, 0.8)], None),
+    "intervals": (
+        "VO2max",
+        [
+            WARMUP,
+            Step(INTERVALS, 30, 1.2, 1.2, 100, reps=8, off_duration=90, off_power=0.5,
+                 off_cadence=80),
+            Step(INTERVALS, 40, 1.1, 1.1, 95, reps=3, off_duration=20, off_power=0.5),
+            COOLDOWN,
+        ],
+        "8x30s",
+    ),
+    "free ride": ("Free", [Step(FREE_RIDE, 1200), Step(FREE_RIDE, 0)], ""),
+    "no steps": ("Nothing", [], "nothing to ride"),
+    "escaped text": (
+        "Tom & Jerry <3 \"quoted\" 'single' ]]>",
+        [Step(STEADY, 60, 0.5, 0.5)],
+        "a & b < c > d\r\nline\ttab",
+    ),
+    "unicode": ("Crème brûlée 💪", [Step(FREE_RIDE, 120)], "Über"),
+    "empty title": ("", [Step(STEADY, 60, 0.5, 0.5)], None),
+}
+
+
+def reference(title, steps, description, stats):
+    return GetZwo.workout_document(GetZwo.workout_xml(title, steps, description, stats))
+
+
+@pytest.mark.parametrize("title, steps, description", WORKOUTS.values(), ids=list(WORKOUTS))
+def test_same_bytes_as_lxml(title, steps, description):
+    stats = workout_stats(steps)
+    assert ZwoXml.workout_text(title, steps, description, stats) == \
+        reference(title, steps, description, stats)
+
+
+@pytest.mark.parametrize("title, steps, description", WORKOUTS.values(), ids=list(WORKOUTS))
+def test_stats_computed_when_missing(title, steps, description):
+    assert ZwoXml.workout_text(title, steps, description) == \
+        reference(title, steps, description, workout_stats(steps))
+
+
+def test_corpus_same_bytes_as_lxml():
+    workouts = corpus_workouts(0)
+    stats = workouts_stats([steps for _, steps, _ in workouts])
+    for (title, steps, description), s in zip(workouts, stats):
+        assert ZwoXml.workout_text(title, steps, description, s) == \
+            reference(title, steps, description, s)
+
+
+def test_written_to_file(tmp_path):
+    title, steps, description = WORKOUTS["intervals"]
+    path = tmp_path / "workout.zwo"
+    with open(path, "w", encoding="utf-8") as f:
+        ZwoXml.write_workout(f, title, steps, description)
+    assert path.read_text(encoding="utf-8") == ZwoXml.workout_text(title, steps, description)
+
+
+def test_invalid_text_writes_nothing():
+    f = io.StringIO()
+    with pytest.raises(ValueError):
+        ZwoXml.write_workout(f, "bell \x07", [Step(STEADY, 60, 0.5, 0.5)])
+    assert f.getvalue() == ""
+    with pytest.raises(ValueError):
+        reference("bell \x07", [Step(STEADY, 60, 0.5, 0.5)], None, None)